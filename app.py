@@ -1,38 +1,212 @@
 import asyncio
+import logging
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-import io
+from typing import Any, Dict, List, Optional, Tuple
 
-import mammoth
 from docx import Document
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse, HTMLResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from PIL import Image
-import pillow_heif
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse, JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel, ValidationError
 
 from remplace_rapport import (
     collect_headings_in_order,
     DEFAULT_ANALYSIS_TEMPLATE,
-    default_heading_decisions,
     find_placeholders_in_order,
     find_image_markers_in_order,
+    prestart_threads,
     process_document,
+    resolve_heading_decisions,
+    warm_image_pool,
 )
-
-TEMPLATES = {
-    "test": Path("test.docx"),
-    "test2": Path("test2.docx"),
-    "test3": Path("test3.docx"),
-}
-OUTPUT_PATHS = {name: path.with_name(f"{path.stem}_sortie.docx") for name, path in TEMPLATES.items()}
+from compression import CompressedStaticFiles, bytes_response, compressed_response, is_not_modified
+from event_bus import EventHub
+from generation_cache import GenerationCache, file_digest, generation_key
+from html_preview import render_docx_html
+from image_pipeline import normalize_image, register_heif_opener
+from logging_setup import configure_logging
+from metrics import (
+    DOC_LOCK_WAIT_SECONDS,
+    DOC_LOCK_WAITERS,
+    GENERATION_CACHE,
+    IMAGE_NORMALIZE_SECONDS,
+    REGISTRY,
+    REQUEST_SECONDS,
+    UPLOAD_BYTES,
+    UPLOADS,
+    Gauge,
+    record_stage_report,
+)
+from pdf_export import PdfConverter, PdfError, PdfQueueFull, PdfTimeout, find_soffice
+from sessions import EditSession, SessionStore, apply_json_patch
+from shared_state import create_backend
+from stage_timer import StageTimer
+from template_registry import TemplateRegistry
+from upload_store import UploadStore, content_hash
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Chaque <nom>.docx du dossier est une trame (voir template_registry)
+TEMPLATE_DIR = Path(os.environ.get("RAPPORT_TEMPLATE_DIR", "."))
+DEFAULT_TEMPLATE = os.environ.get("RAPPORT_DEFAULT_TEMPLATE", "test")
+# Documents générés à côté des trames par défaut ; RAPPORT_OUTPUT_DIR=/dev/shm/rapport pour un tmpfs
+OUTPUT_DIR = Path(os.environ["RAPPORT_OUTPUT_DIR"]) if os.environ.get("RAPPORT_OUTPUT_DIR") else None
+if OUTPUT_DIR is not None:
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 FRONTEND_DIR = Path("frontend")
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
-
-app = FastAPI(title="Rapport auto - API")  # HEIC support enabled
+# Mémoire du processus par défaut ; RAPPORT_SHARED_STATE=<fichier.sqlite> pour plusieurs workers
+shared = create_backend()
+# Références des uploads : dans l'état partagé s'il est persistant, sinon dans uploads/.references.json
+upload_store = UploadStore(UPLOAD_DIR, refs=shared.namespace("upload_refs") if shared.persistent else None)
+# Nettoyage de uploads/ : fichiers non utilisés depuis UPLOAD_TTL_SECONDS, quota en octets (0 = illimité).
+# Le quota supprime la seule copie d'images non référencées : il ne vise que celles
+# inutilisées depuis UPLOAD_QUOTA_MIN_AGE_SECONDS et depuis UPLOAD_TTL_SECONDS
+# (RAPPORT_UPLOAD_TTL_SECONDS=0 pour que le quota soit le seul critère)
+UPLOAD_TTL_SECONDS = float(os.environ.get("RAPPORT_UPLOAD_TTL_SECONDS", 7 * 24 * 3600))
+UPLOAD_QUOTA_BYTES = int(os.environ.get("RAPPORT_UPLOAD_QUOTA_BYTES", 0))
+UPLOAD_QUOTA_MIN_AGE_SECONDS = float(os.environ.get("RAPPORT_UPLOAD_QUOTA_MIN_AGE_SECONDS", 24 * 3600))
+UPLOAD_SWEEP_INTERVAL_SECONDS = float(os.environ.get("RAPPORT_UPLOAD_SWEEP_INTERVAL_SECONDS", 3600))
+# Préchauffage au démarrage (analyse des trames, convertisseurs) ; RAPPORT_WARMUP=0 pour le désactiver
+WARMUP_ENABLED = os.environ.get("RAPPORT_WARMUP", "1") != "0"
+# Threads de run_in_executor (même taille que le pool par défaut d'asyncio), démarrés au préchauffage
+EXECUTOR_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+# Aperçu HTML : rendu natif (html_preview) ; "mammoth" pour forcer l'ancien convertisseur
+PREVIEW_RENDERER = os.environ.get("RAPPORT_PREVIEW_RENDERER", "native")
+# Export PDF : soffice résidents (voir pdf_export) ; RAPPORT_PDF_WORKERS=0 pour le désactiver
+PDF_WORKERS = int(os.environ.get("RAPPORT_PDF_WORKERS", 2))
+PDF_TIMEOUT_SECONDS = float(os.environ.get("RAPPORT_PDF_TIMEOUT_SECONDS", 60))
+SOFFICE = find_soffice(os.environ.get("RAPPORT_SOFFICE")) if PDF_WORKERS > 0 else None
+# Python qui importe `uno` (sinon cherché : Python de LibreOffice, python3 du système)
+UNO_PYTHON = os.environ.get("RAPPORT_UNO_PYTHON") or None
+
+
+def release_expired_sessions() -> None:
+    """Expire les sessions inactives et libère les images des sessions qui n'existent plus."""
+    for session_id in edit_sessions.evict():
+        upload_store.release(f"session:{session_id}")
+    # Sessions disparues sans evict() : redémarrage, suppression par un autre worker.
+    # Propriétaires relevés avant les sessions : une session créée entre-temps reste connue
+    owners = upload_store.owners()
+    live = set(edit_sessions.session_ids())
+    for owner in owners:
+        if owner.startswith("session:") and owner[len("session:"):] not in live:
+            upload_store.release(owner)
+
+
+async def upload_sweeper() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(UPLOAD_SWEEP_INTERVAL_SECONDS)
+        try:
+            await loop.run_in_executor(None, release_expired_sessions)
+            stats = await loop.run_in_executor(
+                None, upload_store.sweep, UPLOAD_TTL_SECONDS, UPLOAD_QUOTA_BYTES or None,
+                UPLOAD_QUOTA_MIN_AGE_SECONDS,
+            )
+            if stats["removed"]:
+                logger.info("Nettoyage uploads: %d fichier(s) supprimé(s), %d octets libérés",
+                            stats["removed"], stats["freed_bytes"])
+        except Exception:
+            logger.exception("Échec du nettoyage des uploads")
+
+
+def warm_up() -> None:
+    """Prépare ce que la première requête paierait sinon : analyse des trames, imports tardifs."""
+    start = time.perf_counter()
+    for name in templates.names():
+        entry = templates.get(name)
+        if entry is not None:
+            try:
+                templates.analysis(entry)
+            except Exception:
+                logger.exception("Préchauffage de la trame %s impossible", name)
+    for name in templates.names():
+        entry = templates.get(name)
+        if entry is not None:
+            try:
+                # Compile aussi la feuille de style de la trame (partagée avec ses sorties)
+                convert_to_html(entry.path)
+            except Exception:
+                logger.exception("Préchauffage de l'aperçu %s impossible", name)
+    if PREVIEW_RENDERER == "mammoth":
+        import mammoth  # noqa: F401
+    register_heif_opener()
+    if pdf_converter is not None:
+        pdf_converter.warm_up()
+    logger.info("Préchauffage terminé en %.2f s", time.perf_counter() - start)
+
+
+def start_pdf_converter() -> None:
+    """Crée le convertisseur PDF : sondes de l'interpréteur uno et dossier des profils LibreOffice."""
+    global pdf_converter, PDF_UNAVAILABLE
+    if SOFFICE is None or pdf_converter is not None:
+        return
+    try:
+        pdf_converter = PdfConverter(SOFFICE, workers=PDF_WORKERS, timeout=PDF_TIMEOUT_SECONDS,
+                                     uno_python=UNO_PYTHON)
+    except PdfError as e:
+        logger.error("%s", e)
+        PDF_UNAVAILABLE = f"Export PDF indisponible : {e}"
+
+
+async def on_templates_changed(names: List[str]) -> None:
+    # Seuls les caches des trames touchées sont invalidés ; l'analyse est refaite à la demande
+    for name in names:
+        entry = templates.get(name)
+        logger.info("Trame %s %s", name, "ajoutée ou modifiée" if entry is not None else "retirée")
+        await in_executor(generation_cache.forget_on_disk,
+                          entry.output_path if entry is not None
+                          else templates.output_path_for(TEMPLATE_DIR / f"{name}.docx"))
+    await broadcast("templates", names)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pdf_converter
+    if frontend_files is not None:
+        # Variantes gzip/brotli de l'interface prêtes avant la première requête, même sans
+        # préchauffage : quelques fichiers, bien plus rapide que l'analyse des trames
+        await asyncio.get_running_loop().run_in_executor(None, frontend_files.precompress)
+    # Avant le préchauffage, qui démarre ensuite ses soffice (pdf_converter.warm_up)
+    await asyncio.get_running_loop().run_in_executor(None, start_pdf_converter)
+    if WARMUP_ENABLED:
+        # Pools de threads démarrés avant la première requête (quelques ms) : le pool
+        # par défaut de la boucle (génération, état partagé, uploads) et celui des images
+        executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="rapport")
+        asyncio.get_running_loop().set_default_executor(executor)
+        prestart_threads(executor, EXECUTOR_WORKERS)
+        warm_image_pool()
+        # En tâche de fond : le serveur accepte les requêtes sans attendre la fin
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+    sweeper = asyncio.create_task(upload_sweeper())
+    watcher = asyncio.create_task(templates.watch(on_templates_changed))
+    # Événements publiés par les autres workers -> abonnés SSE de ce worker
+    relay = asyncio.create_task(shared.listen(event_hub.publish))
+    publisher = asyncio.create_task(metrics_publisher()) if metric_snapshots is not None else None
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        watcher.cancel()
+        relay.cancel()
+        if publisher is not None:
+            publisher.cancel()
+            metric_snapshots.pop(str(os.getpid()), None)
+        shared.close()
+        if pdf_converter is not None:
+            pdf_converter.close()
+            pdf_converter = None
+
+
+app = FastAPI(title="Rapport auto - API", lifespan=lifespan)  # HEIC support enabled
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -40,8 +214,87 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-listeners: List[asyncio.Queue] = []
-doc_lock = asyncio.Lock()
+event_hub = EventHub()
+generation_cache = GenerationCache(on_disk=shared.namespace("generated_outputs"))
+edit_sessions = SessionStore(states=shared.namespace("sessions"))
+# Un patch à la fois par session (dans ce worker) : état fusionné et rendu par section
+# ne doivent pas s'entrelacer ; le verrou disparaît quand plus personne ne l'attend
+session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+# Créé au démarrage du serveur (start_pdf_converter), pas à l'import du module
+pdf_converter: Optional[PdfConverter] = None
+PDF_UNAVAILABLE = ("Export PDF indisponible : LibreOffice (soffice) introuvable" if SOFFICE is None
+                   else "Export PDF indisponible : serveur en cours de démarrage")
+# Interface : variantes gzip/brotli préparées au démarrage, revalidée à chaque chargement (ETag)
+frontend_files = (CompressedStaticFiles(directory=str(FRONTEND_DIR), html=True, cache_control="no-cache")
+                  if FRONTEND_DIR.exists() else None)
+# Noms des uploads = empreinte du contenu : une URL ne change jamais de contenu
+upload_files = CompressedStaticFiles(directory=str(UPLOAD_DIR), cache_control="public, max-age=31536000, immutable",
+                                     compress_text=False)
+REGISTRY.register(Gauge("rapport_sse_listeners", "Clients SSE connectés à ce worker", function=lambda: len(event_hub)))
+# Métriques propres à chaque worker (label worker) : avec l'état partagé, chacun publie les
+# siennes toutes les METRICS_PUBLISH_SECONDS et /metrics rend celles de tous les workers
+METRICS_PUBLISH_SECONDS = float(os.environ.get("RAPPORT_METRICS_PUBLISH_SECONDS", 15))
+metric_snapshots = shared.namespace("metrics") if shared.persistent else None
+
+
+def publish_metrics() -> None:
+    metric_snapshots[str(os.getpid())] = {"updated": time.time(), "samples": REGISTRY.snapshot()}
+
+
+def collect_metrics() -> str:
+    if metric_snapshots is None:
+        return REGISTRY.render()
+    publish_metrics()
+    now = time.time()
+    snapshots = []
+    for worker in list(metric_snapshots):
+        entry = metric_snapshots.get(worker)
+        if entry is None:
+            continue
+        if now - entry["updated"] > 4 * METRICS_PUBLISH_SECONDS:
+            # Worker arrêté (ou redémarré sous un autre pid) : ses séries disparaissent
+            metric_snapshots.pop(worker, None)
+            continue
+        snapshots.append(entry["samples"])
+    return REGISTRY.render(snapshots)
+
+
+async def metrics_publisher() -> None:
+    while True:
+        try:
+            await in_executor(publish_metrics)
+        except Exception:
+            logger.exception("Publication des métriques impossible")
+        await asyncio.sleep(METRICS_PUBLISH_SECONDS)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Modèle de route (/sessions/{session_id}) plutôt que le chemin : nombre de séries borné
+    route = request.scope.get("route")
+    route_path = getattr(route, "path", None) or "unmatched"
+    REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=route_path,
+                            status=str(response.status_code))
+    return response
+
+
+@asynccontextmanager
+async def doc_lock():
+    # Verrou des fichiers de sortie, commun à tous les workers si l'état est partagé
+    start = time.perf_counter()
+    DOC_LOCK_WAITERS.inc()
+    acquired = False
+    try:
+        async with shared.lock("documents"):
+            acquired = True
+            DOC_LOCK_WAITERS.dec()
+            DOC_LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            yield
+    finally:
+        if not acquired:
+            DOC_LOCK_WAITERS.dec()
 
 
 class ImageTextData(BaseModel):
@@ -66,29 +319,56 @@ class GeneratePayload(BaseModel):
     images_at_markers_sizes: Dict[str, float] = {}
 
 
+class PatchOperation(BaseModel):
+    op: str  # "add", "remove" ou "replace"
+    path: str  # JSON Pointer, ex. "/mapping/{nom}"
+    value: Any = None
+
+
+def analyze_template(src_path: Path) -> dict:
+    """Placeholders, titres et marqueurs d'une trame (gardés par le registre jusqu'à modification)."""
+    doc = Document(str(src_path))
+    return {
+        "placeholders": find_placeholders_in_order(doc),
+        "headings": [p.text for p in collect_headings_in_order(doc)],
+        "markers": find_image_markers_in_order(doc),
+    }
+
+
+templates = TemplateRegistry(TEMPLATE_DIR, analyze_template, default=DEFAULT_TEMPLATE, output_dir=OUTPUT_DIR)
+templates.scan()
+
+
 def available_templates() -> List[str]:
-    # On liste toutes les trames déclarées ; l'existence est vérifiée plus tard
-    return list(TEMPLATES.keys())
+    return templates.names()
 
 
 def get_template_paths(selected: Optional[str] = None) -> Tuple[Path, Path, str]:
-    if selected:
-        if selected not in TEMPLATES:
+    # Le registre est à jour (surveillance du dossier) : aucun accès disque ici
+    entry = templates.get(selected) if selected else templates.first()
+    if entry is None:
+        if selected:
             raise HTTPException(status_code=404, detail=f"Trame inconnue: {selected}")
-        src = TEMPLATES[selected]
-        if not src.exists():
-            raise HTTPException(status_code=404, detail=f"Source file not found: {src}")
-        return src, OUTPUT_PATHS[selected], selected
-    for name, src in TEMPLATES.items():
-        if src.exists():
-            return src, OUTPUT_PATHS[name], name
-    raise HTTPException(status_code=404, detail="Aucune trame disponible")
+        raise HTTPException(status_code=404, detail="Aucune trame disponible")
+    return entry.path, entry.output_path, entry.name
+
+
+def template_analysis(template_key: str) -> dict:
+    return templates.analysis(templates.get(template_key))
 
 
 def convert_to_html(docx_path: Path) -> str:
     if not docx_path.exists():
         raise HTTPException(status_code=404, detail="Document introuvable pour l'aperçu HTML")
+    if PREVIEW_RENDERER != "mammoth":
+        try:
+            return render_docx_html(docx_path)
+        except Exception:
+            logger.exception("Rendu natif de l'aperçu impossible, repli sur mammoth: %s", docx_path)
+    return convert_to_html_mammoth(docx_path)
 
+
+def convert_to_html_mammoth(docx_path: Path) -> str:
     # Extraire les en-têtes avec python-docx
     doc = Document(str(docx_path))
     headers_html = ""
@@ -132,7 +412,8 @@ def convert_to_html(docx_path: Path) -> str:
                 style = 'style="text-align: center; font-weight: bold; margin-bottom: 10px;"'
                 headers_html += f'<div {style}>{text}</div>\n'
 
-    # Convertir le reste du document avec mammoth
+    # Convertir le reste du document avec mammoth (import tardif : inutile tant qu'aucun aperçu n'est demandé)
+    import mammoth
     with open(docx_path, "rb") as f:
         result = mammoth.convert_to_html(f)
 
@@ -145,20 +426,16 @@ def convert_to_html(docx_path: Path) -> str:
     return full_html
 
 
-async def broadcast(message: str) -> None:
-    for q in list(listeners):
-        await q.put(message)
+async def in_executor(func, *args):
+    # État partagé SQLite (timeout=10) et fichier des références : une écriture peut
+    # attendre un verrou, jamais sur la boucle qui sert les autres requêtes et les flux SSE
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
 
 
-async def event_stream():
-    queue: asyncio.Queue = asyncio.Queue()
-    listeners.append(queue)
-    try:
-        while True:
-            msg = await queue.get()
-            yield f"data: {msg}\n\n"
-    finally:
-        listeners.remove(queue)
+async def broadcast(message: str, topics: Optional[List[str]] = None) -> None:
+    # Ne bloque jamais : chaque client a son propre tampon borné
+    event_hub.publish(message, topics)
+    await in_executor(shared.publish, message, topics)
 
 
 @app.get("/")
@@ -170,68 +447,45 @@ def root():
 
 @app.get("/templates")
 def list_templates():
-    templates = available_templates()
-    default = None
-    for name in templates:
-        if TEMPLATES[name].exists():
-            default = name
-            break
-    if default is None:
-        default = templates[0] if templates else None
-    return {"templates": templates, "default": default}
+    default = templates.first()
+    return {"templates": available_templates(), "default": default.name if default is not None else None}
 
 
 @app.get("/placeholders")
 def get_placeholders(template: Optional[str] = None):
-    src_path, _, template_key = get_template_paths(template)
-    doc = Document(str(src_path))
-    placeholders = find_placeholders_in_order(doc)
-    headings = [p.text for p in collect_headings_in_order(doc)]
-    markers = find_image_markers_in_order(doc)
+    _, _, template_key = get_template_paths(template)
+    analysis = template_analysis(template_key)
     return {
         "template": template_key,
         "templates": available_templates(),
-        "placeholders": placeholders,
-        "headings": headings,
-        "markers": markers,
+        "placeholders": analysis["placeholders"],
+        "headings": analysis["headings"],
+        "markers": analysis["markers"],
         "default_template": DEFAULT_ANALYSIS_TEMPLATE,
     }
 
 
-@app.post("/generate")
-async def generate(payload: GeneratePayload):
+def resolve_upload_path(path_str: str) -> str:
+    if path_str.startswith("/uploads/"):
+        return str(UPLOAD_DIR / Path(path_str).name)
+    return path_str
+
+
+def pin_report_images(template_key: str, session: Optional[EditSession], used_images: List[str]) -> None:
+    # Les images utilisées par ce rapport (et par sa session) ne doivent pas être nettoyées
+    uploads = [src for src in used_images if Path(src).parent == UPLOAD_DIR]
+    upload_store.set_references(f"report:{template_key}", uploads)
+    if session is not None:
+        upload_store.set_references(f"session:{session.id}", uploads)
+
+
+async def generate_report(payload: GeneratePayload, session: Optional[EditSession] = None,
+                          timings: bool = False) -> dict:
     src_path, output_path, template_key = get_template_paths(payload.template)
     mapping = payload.mapping or {}
     if payload.overwrite:
-        if output_path.exists():
-            output_path.unlink()
-    doc = Document(str(src_path))
-    placeholders_in_doc = find_placeholders_in_order(doc)
-    for missing in placeholders_in_doc:
-        mapping.setdefault(missing, "")
-    headings = collect_headings_in_order(doc)
-    decisions = payload.decisions
-    if decisions is None:
-        decisions = default_heading_decisions(headings, mapping)
-    else:
-        # "__DEFAULT__" => phrase auto, "__KEEP_TITLE_ONLY__" => garder titre sans phrase, "" => supprimer, autre => texte personnalisé
-        resolved = []
-        defaults = default_heading_decisions(headings, mapping)
-        for idx, h in enumerate(headings):
-            choice = payload.decisions[idx] if idx < len(payload.decisions) else "__DEFAULT__"
-            if choice == "__DEFAULT__" or choice is None:
-                resolved.append(defaults[idx])
-            elif choice == "__KEEP_TITLE_ONLY__":
-                # Garder le titre mais ne rien ajouter en dessous
-                resolved.append("__KEEP_TITLE_ONLY__")
-            else:
-                resolved.append(choice)
-        decisions = resolved
-
-    def resolve_path(path_str: str) -> str:
-        if path_str.startswith("/uploads/"):
-            return str(UPLOAD_DIR / Path(path_str).name)
-        return path_str
+        output_path.unlink(missing_ok=True)
+        await in_executor(generation_cache.forget_on_disk, output_path)
 
     # Convert heading_content blocks to resolved paths
     heading_content_resolved = {}
@@ -240,74 +494,311 @@ async def generate(payload: GeneratePayload):
         for block in blocks:
             block_dict = block.model_dump()
             if block.type == "image" and block.src:
-                block_dict["src"] = resolve_path(block.src)
+                block_dict["src"] = resolve_upload_path(block.src)
             heading_content_resolved[heading].append(block_dict)
 
     # Resolve marker images
     markers_resolved = {}
     for k, v in (payload.images_at_markers or {}).items():
-        markers_resolved[k] = resolve_path(v)
-
-    # Debug logging
-    print(f"[DEBUG] mapping: {mapping}")
-    print(f"[DEBUG] decisions: {decisions}")
-    print(f"[DEBUG] heading_content_resolved: {heading_content_resolved}")
-    print(f"[DEBUG] markers_resolved: {markers_resolved}")
-
-    async with doc_lock:
-        process_document(
-            src_path,
-            output_path,
-            mapping_override=mapping,
-            decisions_override=decisions,
-            interactive=False,
-            heading_content=heading_content_resolved,
-            images_at_markers=markers_resolved,
-            image_width_inches=payload.image_width_inches or 3.0,
-            images_at_markers_sizes=payload.images_at_markers_sizes or {},
-        )
-    await broadcast("updated")
-    return {"status": "ok", "template": template_key, "output": str(output_path), "pdf": None}
+        markers_resolved[k] = resolve_upload_path(v)
+
+    used_images = [b["src"] for blocks in heading_content_resolved.values() for b in blocks
+                   if b.get("type") == "image" and b.get("src")]
+    used_images += list(markers_resolved.values())
+
+    event_topics = [template_key] + ([f"session:{session.id}"] if session is not None else [])
+
+    # Même payload, même trame, mêmes images => même document : on le ressert tel quel
+    normalized_payload = payload.model_dump(exclude={"overwrite"})
+    normalized_payload["template"] = template_key
+    loop = asyncio.get_running_loop()
+    timer = StageTimer()
+    with timer.stage("generation_key"):
+        key = await loop.run_in_executor(None, generation_key, normalized_payload, src_path, used_images)
+    cached = None
+    async with doc_lock():
+        on_disk = await in_executor(generation_cache.is_on_disk, output_path, key)
+        if not on_disk:
+            cached = generation_cache.get(key)
+            if cached is not None:
+                # Plusieurs Mo à écrire : hors de la boucle (le verrou reste tenu)
+                await in_executor(output_path.write_bytes, cached)
+                await in_executor(generation_cache.mark_on_disk, output_path, key)
+    if on_disk or cached is not None:
+        GENERATION_CACHE.inc(result="disk" if on_disk else "memory")
+        # Document resservi : ses images restent référencées par le rapport et la session
+        await in_executor(pin_report_images, template_key, session, used_images)
+        if cached is not None:
+            await broadcast("updated", event_topics)
+        result = {"status": "ok", "template": template_key, "output": str(output_path), "pdf": pdf_link(template_key), "cached": True}
+        if timings:
+            result["timings"] = timer.report()
+        return result
+
+    GENERATION_CACHE.inc(result="miss")
+    analysis = await in_executor(template_analysis, template_key)
+    for missing in analysis["placeholders"]:
+        mapping.setdefault(missing, "")
+    headings = analysis["headings"]
+    decisions = resolve_heading_decisions(headings, mapping, payload.decisions)
+
+    logger.debug("Génération %s: mapping=%s decisions=%s heading_content=%s markers=%s",
+                 template_key, mapping, decisions, heading_content_resolved, markers_resolved)
+
+    def render() -> Optional[Dict[str, int]]:
+        if session is None:
+            process_document(
+                src_path,
+                output_path,
+                mapping_override=mapping,
+                decisions_override=decisions,
+                interactive=False,
+                heading_content=heading_content_resolved,
+                images_at_markers=markers_resolved,
+                image_width_inches=payload.image_width_inches or 3.0,
+                images_at_markers_sizes=payload.images_at_markers_sizes or {},
+                timer=timer,
+            )
+            stages = None
+        else:
+            # Session : seules les sections invalidées par la modification sont rejouées
+            stages = session.render(
+                src_path,
+                output_path,
+                mapping,
+                decisions,
+                heading_content_resolved,
+                markers_resolved,
+                payload.image_width_inches or 3.0,
+                payload.images_at_markers_sizes or {},
+                timer=timer,
+            )
+        generation_cache.put(key, output_path.read_bytes())
+        generation_cache.mark_on_disk(output_path, key)
+        return stages
+
+    async with doc_lock():
+        # Génération (plusieurs secondes pour un gros rapport) hors de la boucle ; le verrou reste tenu
+        stages = await in_executor(render)
+    await in_executor(pin_report_images, template_key, session, used_images)
+    await broadcast("updated", event_topics)
+    result = {"status": "ok", "template": template_key, "output": str(output_path), "pdf": pdf_link(template_key)}
+    if stages is not None:
+        result["stages"] = stages
+    report = timer.report()
+    record_stage_report(report)
+    if timings:
+        result["timings"] = report
+    return result
+
+
+@app.post("/generate")
+async def generate(payload: GeneratePayload, timings: bool = False):
+    """`?timings=true` ajoute à la réponse le temps passé dans chaque étape."""
+    return await generate_report(payload, timings=timings)
+
+
+def get_session_or_404(session_id: str) -> EditSession:
+    session = edit_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session inconnue ou expirée: {session_id}")
+    return session
+
+
+@app.post("/sessions")
+async def create_session(payload: GeneratePayload):
+    """Ouvre une session d'édition : le payload complet n'est envoyé qu'une fois."""
+    await in_executor(release_expired_sessions)
+    session = await in_executor(edit_sessions.create, payload.model_dump(exclude={"overwrite"}))
+    result = await generate_report(payload, session)
+    result["session"] = session.id
+    return result
+
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    session = get_session_or_404(session_id)
+    return {"session": session.id, "state": session.state}
+
+
+@app.patch("/sessions/{session_id}")
+async def patch_session(session_id: str, operations: List[PatchOperation]):
+    """Applique des modifications JSON Patch à l'état de la session puis régénère."""
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = session_locks[session_id] = asyncio.Lock()
+    async with lock:
+        session = await in_executor(get_session_or_404, session_id)
+        try:
+            state = apply_json_patch(session.state, [op.model_dump(exclude_unset=True) for op in operations])
+            payload = GeneratePayload(**state)
+        except ValueError as e:
+            # ValidationError (pydantic) hérite aussi de ValueError
+            detail = e.errors() if isinstance(e, ValidationError) else str(e)
+            raise HTTPException(status_code=422 if isinstance(e, ValidationError) else 400, detail=detail)
+        session.state = state
+        await in_executor(edit_sessions.save, session)
+        result = await generate_report(payload, session)
+    result["session"] = session.id
+    return result
+
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if edit_sessions.remove(session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session inconnue ou expirée: {session_id}")
+    upload_store.release(f"session:{session_id}")
+    return {"status": "ok"}
+
+
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def pdf_link(template_key: str) -> Optional[str]:
+    return f"/download?format=pdf&template={template_key}" if pdf_converter is not None else None
 
 
 @app.get("/download")
-async def download(template: Optional[str] = None):
-    """Télécharge le fichier Word généré"""
+async def download(request: Request, template: Optional[str] = None, format: str = "docx"):
+    """Télécharge le fichier Word généré, ou sa conversion PDF (`?format=pdf`).
+
+    ETag = clé de la génération (ou empreinte du fichier) : un rapport inchangé revient
+    en 304. Les plages (Range) sont acceptées pour reprendre un téléchargement ; le
+    document est servi depuis le cache de génération s'il y est, sinon depuis le disque
+    (sendfile/pathsend quand le serveur le permet).
+    """
+    if format not in ("docx", "pdf"):
+        raise HTTPException(status_code=400, detail=f"Format inconnu: {format} (docx ou pdf)")
     _, output_path, _ = get_template_paths(template)
-    if not output_path.exists():
+    try:
+        stat_result = output_path.stat()
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Fichier de sortie non trouvé. Générez d'abord le document.")
-    return FileResponse(
-        path=str(output_path),
-        filename=output_path.name,
-        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    )
+    key = await in_executor(generation_cache.key_on_disk, output_path)
+    if key is None:
+        # Fichier produit hors de l'API (CLI) : empreinte mémorisée tant qu'il ne change pas
+        key = await in_executor(file_digest, output_path)
+    if format == "pdf":
+        return await download_pdf(request, output_path, key)
+    etag = f'"{key[:32]}"'
+    data = generation_cache.get(key)
+    if data is not None:
+        return bytes_response(request, data, etag, DOCX_MEDIA_TYPE, filename=output_path.name)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path=str(output_path), filename=output_path.name, media_type=DOCX_MEDIA_TYPE,
+                        headers=headers, stat_result=stat_result)
+
+
+def read_output(output_path: Path) -> Tuple[str, bytes]:
+    """Clé du document généré et ses octets (depuis le cache de génération s'il y est)."""
+    key = generation_cache.key_on_disk(output_path) or file_digest(output_path)
+    data = generation_cache.get(key)
+    return key, data if data is not None else output_path.read_bytes()
+
+
+async def download_pdf(request: Request, output_path: Path, key: str) -> Response:
+    if pdf_converter is None:
+        raise HTTPException(status_code=501, detail=PDF_UNAVAILABLE)
+    etag = f'"{key[:32]}-pdf"'
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    pdf = pdf_converter.cached(key)
+    if pdf is not None:
+        return bytes_response(request, pdf, etag, "application/pdf", filename=f"{output_path.stem}.pdf")
+
+    # Clé et octets relus ensemble sous le verrou : une régénération concurrente ne peut
+    # pas faire mettre en cache le PDF de l'ancien document sous la clé du nouveau
+    async with doc_lock():
+        key, docx = await in_executor(read_output, output_path)
+    etag = f'"{key[:32]}-pdf"'
+    try:
+        pdf = await in_executor(pdf_converter.convert, key, lambda: docx)
+    except PdfQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except PdfTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except PdfError as e:
+        logger.error("Export PDF de %s impossible: %s", output_path.name, e)
+        raise HTTPException(status_code=500, detail=str(e))
+    return bytes_response(request, pdf, etag, "application/pdf", filename=f"{output_path.stem}.pdf")
 
 
 @app.get("/preview")
-async def preview(template: Optional[str] = None):
+async def preview(request: Request, template: Optional[str] = None):
     src_path, output_path, template_key = get_template_paths(template)
     target = output_path if output_path.exists() else src_path
     if not target.exists():
         raise HTTPException(status_code=404, detail="Aucun fichier de reference disponible")
-    async with doc_lock:
+    async with doc_lock():
         html = await asyncio.get_running_loop().run_in_executor(None, convert_to_html, target)
-    return HTMLResponse(html)
+    # Compressé si assez gros ; un aperçu inchangé revient en 304
+    return compressed_response(request, html)
 
 
 @app.get("/preview/html")
-async def preview_html(template: Optional[str] = None):
+async def preview_html(request: Request, template: Optional[str] = None):
     src_path, output_path, _ = get_template_paths(template)
     target = output_path if output_path.exists() else src_path
     if not target.exists():
         raise HTTPException(status_code=404, detail="Aucun fichier de reference disponible")
-    async with doc_lock:
+    async with doc_lock():
         html = await asyncio.get_running_loop().run_in_executor(None, convert_to_html, target)
-    return HTMLResponse(html)
+    # Compressé si assez gros ; un aperçu inchangé revient en 304
+    return compressed_response(request, html)
+
+
+@app.get("/metrics")
+def metrics():
+    """Métriques de tous les workers, chaque série marquée par le pid de son worker (label worker)."""
+    return PlainTextResponse(collect_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/events")
-async def events():
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+async def events(template: Optional[str] = None, session: Optional[str] = None):
+    """Flux SSE ; `template` / `session` limitent les événements reçus."""
+    topics = set()
+    if template:
+        topics.add(template)
+    if session:
+        topics.add(f"session:{session}")
+    return StreamingResponse(
+        event_hub.stream(topics or None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+NORMALIZE_FORMAT_LABELS = {"heic", "heif", "jpg", "jpeg", "png"}
+
+
+def store_upload(contents: bytes, digest: str, original_filename: str) -> dict:
+    # Une seule étape pour tous les formats : HEIC -> JPEG, orientation EXIF,
+    # métadonnées retirées, résolution plafonnée
+    start = time.perf_counter()
+    try:
+        normalized = normalize_image(contents, original_filename)
+    except Exception as e:
+        logger.warning("Erreur normalisation %s: %s", original_filename, e)
+        raise HTTPException(status_code=400, detail=f"Image illisible: {original_filename}")
+    # Libellé borné : le temps de conversion HEIC se lit sur format="heic"
+    suffix = Path(original_filename).suffix.lower().lstrip(".")
+    source_format = suffix if suffix in NORMALIZE_FORMAT_LABELS else "other"
+    IMAGE_NORMALIZE_SECONDS.observe(time.perf_counter() - start, format=source_format)
+    return upload_store.store(digest, normalized.data, normalized.extension, original_filename,
+                              info=normalized.info)
+
+
+def find_or_store_upload(contents: bytes, original_filename: str) -> Tuple[dict, bool]:
+    """Fiche du fichier stocké pour ce contenu et True s'il l'était déjà (doublon)."""
+    digest = content_hash(contents)
+    meta = upload_store.find(digest)
+    if meta:
+        # Ré-envoyé à l'instant : le fichier ne doit pas être nettoyé avant la génération
+        upload_store.touch(meta["filename"], resolution=0)
+        return meta, True
+    return store_upload(contents, digest, original_filename), False
 
 
 @app.post("/upload")
@@ -317,53 +808,25 @@ async def upload_image(file: UploadFile = File(...)):
 
     contents = await file.read()
     original_filename = file.filename
-    filename_lower = original_filename.lower()
 
-    print(f"[UPLOAD DEBUG] Fichier reçu: {original_filename}, extension détectée: {filename_lower}")
+    logger.debug("Fichier reçu: %s (%d octets)", original_filename, len(contents))
 
-    # Convertir HEIC en JPEG si nécessaire
-    if filename_lower.endswith('.heic') or filename_lower.endswith('.heif'):
-        try:
-            # Enregistrer le support HEIF
-            pillow_heif.register_heif_opener()
-
-            # Ouvrir l'image HEIC
-            heic_image = Image.open(io.BytesIO(contents))
-
-            # Convertir en RGB si nécessaire (HEIC peut être en RGBA)
-            if heic_image.mode in ('RGBA', 'LA', 'P'):
-                rgb_image = Image.new('RGB', heic_image.size, (255, 255, 255))
-                if heic_image.mode == 'P':
-                    heic_image = heic_image.convert('RGBA')
-                rgb_image.paste(heic_image, mask=heic_image.split()[-1] if heic_image.mode == 'RGBA' else None)
-                heic_image = rgb_image
-            elif heic_image.mode != 'RGB':
-                heic_image = heic_image.convert('RGB')
-
-            # Nouveau nom de fichier en .jpg (garder le nom original sans l'extension)
-            new_filename = Path(original_filename).stem + '.jpg'
-            
-            dest = UPLOAD_DIR / new_filename
-
-            # Sauvegarder en JPEG avec bonne qualité
-            heic_image.save(dest, 'JPEG', quality=95, optimize=True)
-
-            web_path = f"/uploads/{new_filename}"
-            print(f"[UPLOAD] HEIC converti: {original_filename} -> {new_filename}")
-            return JSONResponse({"path": web_path})
-        except Exception as e:
-            print(f"[UPLOAD ERROR] Erreur conversion HEIC {original_filename}: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Erreur conversion HEIC: {str(e)}")
+    # Même contenu déjà stocké (sous ce nom ou un autre) : on renvoie le fichier existant.
+    # Empreinte, fiche et écriture hors de la boucle : plusieurs Mo à hacher par photo
+    UPLOAD_BYTES.inc(len(contents))
+    meta, duplicate = await asyncio.get_running_loop().run_in_executor(
+        None, find_or_store_upload, contents, original_filename
+    )
+    if duplicate:
+        UPLOADS.inc(result="duplicate")
+        logger.info("Doublon de %s, rien à écrire: %s", meta["filename"], original_filename)
     else:
-        # Pour les autres formats, sauvegarder directement
-        dest = UPLOAD_DIR / file.filename
-        dest.write_bytes(contents)
-        web_path = f"/uploads/{file.filename}"
-        print(f"[UPLOAD] Image sauvegardée: {file.filename}")
-        return JSONResponse({"path": web_path})
+        UPLOADS.inc(result="stored")
+        logger.info("Image sauvegardée: %s -> %s", original_filename, meta["filename"])
+    return JSONResponse({"path": f"/uploads/{meta['filename']}", "original_name": meta["original_name"]})
 
 
-if FRONTEND_DIR.exists():
-    app.mount("/ui", StaticFiles(directory=str(FRONTEND_DIR), html=True), name="ui")
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR), html=False), name="uploads")
+if frontend_files is not None:
+    app.mount("/ui", frontend_files, name="ui")
+app.mount("/uploads", upload_files, name="uploads")
 
@@ -0,0 +1,286 @@
+"""
+Benchmark de la chaîne de génération sur des trames synthétiques de taille croissante.
+
+    python benchmark_pipeline.py                      # tailles 10, 50, 100 sections
+    python benchmark_pipeline.py --save-baseline      # enregistre la référence
+    python benchmark_pipeline.py --baseline benchmark_baseline.json --tolerance 0.25
+
+Chaque section d'une trame contient un titre, des paragraphes à placeholders
+(dont un coupé sur plusieurs runs), un tableau, un tableau SIM (une carte sur
+deux sans valeur) et un marqueur d'image. Pour chaque fonction et chaque taille,
+on relève le meilleur temps sur `--repeat` passes, puis, sur des passes séparées
+pour ne pas fausser les temps :
+- le pic de RSS (mémoire réelle du processus, arbres lxml/libxml2 compris) d'un
+  processus enfant qui n'exécute que ce cas, une fois (ru_maxrss ; absent sous
+  Windows). Il inclut l'interpréteur et les imports, identiques d'un cas à l'autre ;
+- le pic du tas Python (tracemalloc), qui ne voit pas la mémoire de libxml2.
+
+Avec une référence, le script sort en erreur si une mesure dépasse la référence
+de plus de `--tolerance` : une régression d'échelle (quadratique sur les grandes
+trames) se voit avant le déploiement. Les temps dépendent de la machine : la
+référence est à produire sur la machine qui exécute la comparaison.
+"""
+import argparse
+import io
+import json
+import logging
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from docx import Document
+from PIL import Image
+
+from html_preview import render_docx_html
+try:
+    import resource
+except ImportError:  # Windows : pas de pic RSS
+    resource = None
+
+from remplace_rapport import (
+    apply_heading_decisions,
+    collect_headings_in_order,
+    default_heading_decisions,
+    find_placeholders_in_order,
+    iter_all_paragraphs,
+    process_document,
+    replace_in_runs,
+)
+
+DEFAULT_SIZES = (10, 50, 100)
+DEFAULT_REPEAT = 3
+DEFAULT_BASELINE = Path("benchmark_baseline.json")
+SIM_FIELDS = ("operateur", "iccid", "imsi", "msisdn", "datesync")
+# En dessous, les écarts relatifs ne sont que du bruit de mesure
+MIN_COMPARED_SECONDS = 0.002
+
+
+def build_template(path: Path, sections: int) -> None:
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "Rapport {daterap} - {nom} {prenom}"
+    for i in range(sections):
+        doc.add_heading(f"Section {i} {{titre{i}}}", level=1)
+        doc.add_paragraph(f"{{nom}} a examiné l'objet {{objet{i}}} le {{date}} à {{lieu}}.")
+        split = doc.add_paragraph("Référence : ")
+        # Placeholder coupé sur plusieurs runs, comme après une édition dans Word
+        for chunk in ("{ref", f"{i}", "}"):
+            split.add_run(chunk)
+        doc.add_paragraph(f"{{commentaire{i}}}")
+        table = doc.add_table(rows=2, cols=3)
+        for col, text in enumerate(("Marque", "Modèle", "IMEI")):
+            table.cell(0, col).text = text
+        for col, text in enumerate((f"{{marque{i}}}", f"{{modele{i}}}", f"{{imei{i}}}")):
+            table.cell(1, col).text = text
+        sim = doc.add_table(rows=2, cols=len(SIM_FIELDS))
+        card = i % 8 + 1
+        for col, field in enumerate(SIM_FIELDS):
+            sim.cell(0, col).text = field
+            sim.cell(1, col).text = f"{{{field}{card}}}"
+        doc.add_paragraph(f"[[IMG:photo{i}]]")
+    doc.save(str(path))
+
+
+def build_mapping(sections: int) -> Dict[str, str]:
+    mapping = {"{daterap}": "01/01/2025", "{nom}": "Dupont", "{prenom}": "Jean", "{date}": "02/01/2025",
+               "{lieu}": "Paris"}
+    for i in range(sections):
+        mapping[f"{{titre{i}}}"] = f"Scellé {i}"
+        mapping[f"{{objet{i}}}"] = f"OBJ-{i:04d}"
+        mapping[f"{{ref{i}}}"] = f"REF-{i:04d}"
+        # Un commentaire sur trois vide : le paragraphe est supprimé
+        mapping[f"{{commentaire{i}}}"] = "" if i % 3 == 0 else f"Commentaire {i}"
+        mapping[f"{{marque{i}}}"] = "Apple"
+        mapping[f"{{modele{i}}}"] = "iPhone"
+        mapping[f"{{imei{i}}}"] = f"35{i:013d}"
+    for card in range(1, 9):
+        for field in SIM_FIELDS:
+            mapping[f"{{{field}{card}}}"] = f"{field}-{card}" if card % 2 else ""
+    return mapping
+
+
+def build_image(path: Path) -> None:
+    Image.new("RGB", (800, 600), (90, 140, 200)).save(str(path), "JPEG", quality=85)
+
+
+def peak_rss_kb() -> Optional[float]:
+    """Pic de RSS de ce processus depuis son démarrage, en Ko."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, Ko sous Linux
+    return round(peak / 1024 if sys.platform == "darwin" else peak, 1)
+
+
+def measure(func: Callable, setup: Callable[[], Tuple], repeat: int) -> Dict[str, float]:
+    """Meilleur temps sur `repeat` passes (setup non mesuré) puis pic du tas Python sur une passe."""
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    args = setup()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 6), "python_heap_kb": round(peak / 1024, 1)}
+
+
+def measure_rss(case: str, sections: int, workdir: Path) -> Optional[float]:
+    """Pic de RSS d'un processus neuf qui n'exécute que `case`, une fois."""
+    if resource is None:
+        return None
+    completed = subprocess.run(
+        [sys.executable, str(Path(__file__).resolve()), "--child", case, "--sizes", str(sections),
+         "--workdir", str(workdir)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])["peak_rss_kb"]
+
+
+def _replace_all(doc, mapping):
+    for p in list(iter_all_paragraphs(doc)):
+        replace_in_runs(p, mapping)
+
+
+def build_cases(sections: int, workdir: Path) -> Dict[str, Tuple[Callable, Callable[[], Tuple]]]:
+    """Cas mesurés sur la trame synthétique de `sections` sections (déjà écrite dans `workdir`)."""
+    image_path = workdir / "photo.jpg"
+    template = workdir / f"synthetic_{sections}.docx"
+    output = workdir / f"synthetic_{sections}_sortie.docx"
+    template_bytes = template.read_bytes()
+    mapping = build_mapping(sections)
+    markers = {f"photo{i}": str(image_path) for i in range(sections)}
+
+    def fresh_doc():
+        return Document(io.BytesIO(template_bytes))
+
+    def heading_setup():
+        doc = fresh_doc()
+        headings = collect_headings_in_order(doc)
+        decisions = default_heading_decisions(headings, mapping)
+        # Un titre sur quatre supprimé avec ses tableaux
+        decisions = ["" if i % 4 == 0 else d or "__KEEP_TITLE_ONLY__" for i, d in enumerate(decisions)]
+        return doc, decisions
+
+    cases = {
+        "find_placeholders_in_order": (find_placeholders_in_order, lambda: (fresh_doc(),)),
+        "replace_in_runs": (_replace_all, lambda: (fresh_doc(), mapping)),
+        "apply_heading_decisions": (apply_heading_decisions, heading_setup),
+        "process_document": (
+            lambda: process_document(template, output, mapping_override=dict(mapping), interactive=False,
+                                     images_at_markers=markers),
+            lambda: (),
+        ),
+        "process_document_streaming": (
+            lambda: process_document(template, output, mapping_override=dict(mapping), interactive=False,
+                                     images_at_markers=markers, streaming=True),
+            lambda: (),
+        ),
+        # Après process_document : aperçu du document généré
+        "render_docx_html": (render_docx_html, lambda: (output,)),
+    }
+    return cases
+
+
+def run_benchmarks(sizes: List[int], repeat: int, workdir: Path) -> Dict[str, Dict[str, float]]:
+    build_image(workdir / "photo.jpg")
+    results = {}
+    for sections in sizes:
+        build_template(workdir / f"synthetic_{sections}.docx", sections)
+        for name, (func, setup) in build_cases(sections, workdir).items():
+            result = measure(func, setup, repeat)
+            result["peak_rss_kb"] = measure_rss(name, sections, workdir)
+            results[f"{name}@{sections}"] = result
+    return results
+
+
+def run_child(case: str, sections: int, workdir: Path) -> None:
+    """Processus enfant de measure_rss : un seul cas, une passe, pic de RSS sur stdout."""
+    func, setup = build_cases(sections, workdir)[case]
+    func(*setup())
+    print(json.dumps({"peak_rss_kb": peak_rss_kb()}))
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[str]:
+    """Mesures qui dépassent la référence de plus de `tolerance` (temps ou mémoire)."""
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if (reference["seconds"] >= MIN_COMPARED_SECONDS
+                and current["seconds"] > reference["seconds"] * (1 + tolerance)):
+            regressions.append(f"{key}: {reference['seconds']:.4f}s -> {current['seconds']:.4f}s")
+        for field, label in (("peak_rss_kb", "RSS"), ("python_heap_kb", "tas Python")):
+            if current.get(field) is not None and reference.get(field) is not None \
+                    and current[field] > reference[field] * (1 + tolerance):
+                regressions.append(f"{key}: {label} {reference[field]:.0f} Ko -> {current[field]:.0f} Ko")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'mesure':<36} {'temps (s)':>10} {'RSS max (Ko)':>13} {'tas Py (Ko)':>12} {'réf. (s)':>10} {'écart':>8}")
+    for key, current in results.items():
+        reference = baseline.get(key)
+        ref_text, delta_text = "-", "-"
+        if reference:
+            ref_text = f"{reference['seconds']:.4f}"
+            if reference["seconds"]:
+                delta_text = f"{(current['seconds'] / reference['seconds'] - 1) * 100:+.0f}%"
+        rss = "-" if current.get("peak_rss_kb") is None else f"{current['peak_rss_kb']:.0f}"
+        print(f"{key:<36} {current['seconds']:>10.4f} {rss:>13} {current['python_heap_kb']:>12.0f} "
+              f"{ref_text:>10} {delta_text:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la génération sur des trames synthétiques")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Nombres de sections des trames, séparés par des virgules")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Passes par mesure (meilleur temps)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Fichier de référence JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="Enregistre les mesures comme référence")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Dépassement toléré par rapport à la référence (0.25 = +25%%)")
+    # Interne : processus enfant de la mesure RSS
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    # Une ligne "Document genere" par passe noierait le tableau
+    logging.getLogger("remplace_rapport").setLevel(logging.WARNING)
+    if args.child:
+        run_child(args.child, sizes[0], args.workdir)
+        return 0
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_benchmarks(sizes, args.repeat, Path(tmp))
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2, sort_keys=True), encoding="utf-8")
+        print(f"\nRéférence enregistrée : {args.baseline}")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRégressions :")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""
+Compression HTTP (gzip, et brotli si le module est installé) et validation par ETag.
+
+- CompressedStaticFiles : StaticFiles dont les fichiers texte sont compressés une
+  seule fois (precompress() au démarrage, puis après chaque modification) et servis
+  avec un ETag fort et Cache-Control ; If-None-Match identique -> 304.
+- compressed_response : réponse calculée (aperçu HTML) compressée à la volée
+  au-delà de MIN_COMPRESS_SIZE octets, avec ETag.
+- bytes_response : contenu déjà en mémoire (document généré) servi avec ETag et
+  requêtes partielles (Range: bytes=...), pour reprendre un téléchargement.
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # gzip seul
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1024
+# Fichiers statiques compressés une fois : niveau maximal ; réponses à la volée : rapide
+STATIC_GZIP_LEVEL = 9
+STATIC_BROTLI_QUALITY = 11
+DYNAMIC_GZIP_LEVEL = 5
+DYNAMIC_BROTLI_QUALITY = 4
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def is_compressible(media_type: Optional[str]) -> bool:
+    return bool(media_type) and media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding: str, available: Iterable[Optional[str]]) -> Optional[str]:
+    """Meilleur encodage accepté par le client parmi `available` (None = non compressé)."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, 0.0) > 0:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str, static: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=STATIC_BROTLI_QUALITY if static else DYNAMIC_BROTLI_QUALITY)
+    # mtime=0 : même contenu => mêmes octets (ETag stable)
+    return gzip.compress(data, compresslevel=STATIC_GZIP_LEVEL if static else DYNAMIC_GZIP_LEVEL, mtime=0)
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def _etag(digest: str, encoding: Optional[str]) -> str:
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def is_not_modified(request_headers: Headers, etag: str) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def compressed_response(request: Request, content: str, media_type: str = "text/html",
+                        cache_control: str = "no-cache") -> Response:
+    """Réponse avec ETag (304 si inchangée), compressée si assez grosse et acceptée."""
+    body = content.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), available_encodings())
+    etag = _etag(digest, encoding)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Plage unique `bytes=a-b`, `bytes=a-` ou `bytes=-n` -> (début, fin incluse).
+
+    None si l'en-tête est ignoré (autre unité, plusieurs plages : réponse complète) ;
+    ValueError si la plage est hors du contenu (416).
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, sep, end_text = (part.strip() for part in spec.partition("-"))
+    if not sep or not (start_text + end_text).isdigit():
+        return None  # syntaxe invalide : en-tête ignoré
+    if start_text == "":
+        length = int(end_text)
+        if length == 0:
+            raise ValueError("plage vide")
+        return max(size - length, 0), size - 1
+    start = int(start_text)
+    end = int(end_text) if end_text else size - 1
+    if start >= size or end < start:
+        raise ValueError("plage hors du contenu")
+    return start, min(end, size - 1)
+
+
+def bytes_response(request: Request, data: bytes, etag: str, media_type: str,
+                   filename: Optional[str] = None, cache_control: str = "no-cache") -> Response:
+    """Contenu en mémoire : 304 si l'ETag correspond, 206 pour une plage, 416 si elle est invalide."""
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if filename:
+        quoted = quote(filename)
+        # Même forme que FileResponse : filename* seulement pour les noms non ASCII
+        headers["Content-Disposition"] = (f'attachment; filename="{filename}"' if quoted == filename
+                                          else f"attachment; filename*=utf-8''{quoted}")
+    if is_not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, len(data))
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+    return Response(data, media_type=media_type, headers=headers)
+
+
+class _Asset(NamedTuple):
+    mtime_ns: int
+    size: int
+    digest: str
+    media_type: str
+    variants: Dict[Optional[str], bytes]
+
+
+class CompressedStaticFiles(StaticFiles):
+    """StaticFiles avec variantes précompressées en mémoire et Cache-Control.
+
+    Seuls les fichiers texte sont gardés en mémoire ; les autres (images...) passent
+    par FileResponse comme avant, avec le Cache-Control configuré.
+    """
+
+    def __init__(self, *, directory: str, html: bool = False, cache_control: str = "no-cache",
+                 compress_text: bool = True):
+        super().__init__(directory=directory, html=html)
+        self.cache_control = cache_control
+        self.compress_text = compress_text
+        self._assets: Dict[str, _Asset] = {}
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def lookup_path(self, path: str):
+        # Fichiers cachés (fiches .meta, références des uploads) jamais servis ;
+        # "." est la racine (/ui/), ".." reste refusé par StaticFiles
+        if any(part.startswith(".") and part not in (".", "..") for part in path.replace("\\", "/").split("/")):
+            return "", None
+        return super().lookup_path(path)
+
+    def precompress(self) -> int:
+        """Prépare les variantes de tous les fichiers texte du dossier ; retourne leur nombre."""
+        count = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.realpath(os.path.join(root, name))
+                if self._build(full_path, os.stat(full_path)) is not None:
+                    count += 1
+        return count
+
+    def _fresh(self, full_path: str, stat_result: os.stat_result) -> Optional[_Asset]:
+        asset = self._assets.get(full_path)
+        if asset is not None and (asset.mtime_ns, asset.size) == (stat_result.st_mtime_ns, stat_result.st_size):
+            return asset
+        return None
+
+    def _build(self, full_path: str, stat_result: os.stat_result) -> Optional[_Asset]:
+        media_type = mimetypes.guess_type(full_path)[0]
+        if not self.compress_text or not is_compressible(media_type):
+            return None
+        asset = self._fresh(full_path, stat_result)
+        if asset is not None:
+            return asset
+        with open(full_path, "rb") as f:
+            data = f.read()
+        variants: Dict[Optional[str], bytes] = {None: data}
+        if len(data) >= MIN_COMPRESS_SIZE:
+            for encoding in available_encodings():
+                compressed = compress(data, encoding, static=True)
+                if len(compressed) < len(data):
+                    variants[encoding] = compressed
+        if "charset" not in media_type and media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        asset = _Asset(stat_result.st_mtime_ns, stat_result.st_size,
+                       hashlib.sha256(data).hexdigest()[:32], media_type, variants)
+        with self._lock:
+            self._assets[full_path] = asset
+        return asset
+
+    def _build_and_release(self, full_path: str, stat_result: os.stat_result) -> None:
+        try:
+            self._build(full_path, stat_result)
+        except OSError:
+            pass  # supprimé entre-temps : la prochaine requête renverra 404
+        finally:
+            with self._lock:
+                self._building.discard(full_path)
+
+    def _build_in_background(self, full_path: str, stat_result: os.stat_result) -> None:
+        with self._lock:
+            if full_path in self._building:
+                return
+            self._building.add(full_path)
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._build_and_release, full_path, stat_result)
+        except RuntimeError:
+            self._build_and_release(full_path, stat_result)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        full_path = os.path.realpath(full_path)
+        asset = self._fresh(full_path, stat_result)
+        if asset is None:
+            if self.compress_text and is_compressible(mimetypes.guess_type(full_path)[0]):
+                # Fichier nouveau ou modifié : servi tel quel cette fois, sans compresser sur la boucle
+                self._build_in_background(full_path, stat_result)
+            response = super().file_response(full_path, stat_result, scope, status_code)
+            response.headers["Cache-Control"] = self.cache_control
+            return response
+
+        request_headers = Headers(scope=scope)
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""), asset.variants)
+        etag = _etag(asset.digest, encoding)
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if is_not_modified(request_headers, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], status_code=status_code, media_type=asset.media_type,
+                        headers=headers)
@@ -0,0 +1,145 @@
+"""
+Ecriture directe du paquet OOXML (.docx) à partir d'un Document python-docx.
+
+`doc.save()` re-sérialise et re-compresse toutes les parties du paquet à chaque
+génération. Ici, les entrées ZIP inchangées (styles, numbering, thème, médias
+existants...) sont recopiées brutes depuis la trame, sans décompression ni
+recompression ; seules les parties modifiées sont re-sérialisées.
+"""
+import copy
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.part import XmlPart
+from docx.opc.pkgwriter import _ContentTypesItem
+
+# 0 = pas de compression (écriture la plus rapide), 9 = fichier le plus petit
+DEFAULT_COMPRESSLEVEL = 6
+
+# Bit 3 du champ "flags" : tailles/CRC dans un data descriptor après les données
+_FLAG_DATA_DESCRIPTOR = 0x08
+
+# Internes de zipfile (non documentés) nécessaires à la copie brute
+_ZIPFILE_INTERNALS = ("sizeFileHeader", "structFileHeader", "stringFileHeader",
+                      "_FH_FILENAME_LENGTH", "_FH_EXTRA_FIELD_LENGTH")
+
+
+def document_parts_to_rewrite(doc) -> Set[str]:
+    """Parties XML modifiées par process_document : le corps et les en-têtes."""
+    partnames = {str(doc.part.partname)}
+    for section in doc.sections:
+        partnames.add(str(section.header.part.partname))
+    return partnames
+
+
+def _zip_name(partname) -> str:
+    return str(partname).lstrip("/")
+
+
+def _same_bytes(info: zipfile.ZipInfo, blob: bytes) -> bool:
+    return info.file_size == len(blob) and info.CRC == (zlib.crc32(blob) & 0xFFFFFFFF)
+
+
+def _raw_copy_supported(zin: zipfile.ZipFile, zout: zipfile.ZipFile) -> bool:
+    """La copie brute s'appuie sur des attributs internes de zipfile : on vérifie qu'ils existent."""
+    return (all(hasattr(zipfile, name) for name in _ZIPFILE_INTERNALS)
+            and hasattr(zout, "_didModify") and hasattr(zout, "start_dir")
+            and zin.fp is not None and zout.fp is not None and zout.fp.seekable()
+            and not getattr(zout, "_writing", False))
+
+
+def copy_raw_entry(zin: zipfile.ZipFile, zout: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+    """Recopie une entrée compressée telle quelle d'une archive à l'autre.
+
+    zipfile n'expose pas de copie brute : on relit l'en-tête local pour trouver
+    le début des données compressées, puis on écrit un nouvel en-tête local
+    suivi des mêmes octets. Si les internes de zipfile utilisés ici changent,
+    l'entrée est décompressée puis réécrite normalement.
+    """
+    if not _raw_copy_supported(zin, zout):
+        zout.writestr(copy.copy(info), zin.read(info))
+        return
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(zipfile.sizeFileHeader)
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    if fields[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"En-tête local invalide pour {info.filename}")
+    skip = fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH]
+    zin.fp.seek(info.header_offset + zipfile.sizeFileHeader + skip)
+    raw = zin.fp.read(info.compress_size)
+
+    new_info = copy.copy(info)
+    new_info.flag_bits &= ~_FLAG_DATA_DESCRIPTOR
+    new_info.extra = b""
+    new_info.header_offset = zout.fp.tell()
+    zout.fp.write(new_info.FileHeader())
+    zout.fp.write(raw)
+    zout.filelist.append(new_info)
+    zout.NameToInfo[new_info.filename] = new_info
+    zout.start_dir = zout.fp.tell()
+    zout._didModify = True
+
+
+def save_document(doc, output_path, template_path=None,
+                  modified_parts: Optional[Iterable[str]] = None,
+                  compresslevel: int = DEFAULT_COMPRESSLEVEL) -> int:
+    """Enregistre `doc` dans `output_path` en recopiant les parties inchangées de `template_path`.
+
+    - `modified_parts` : noms des parties XML à re-sérialiser (ex. "/word/document.xml").
+      None => toutes les parties XML sont re-sérialisées, seuls les binaires sont recopiés.
+    - Une partie absente de la trame (nouvelle image, nouvel en-tête) est toujours écrite.
+    - `compresslevel` : 0 (stocké, rapide) à 9 (compact).
+
+    Retourne le nombre d'octets écrits.
+    """
+    output_path = Path(output_path)
+    # Sans trame, ou si on écrase la trame elle-même, pas de copie brute possible
+    if template_path is None or Path(template_path).resolve() == output_path.resolve():
+        doc.save(str(output_path))
+        return output_path.stat().st_size
+
+    modified = None if modified_parts is None else {str(p) for p in modified_parts}
+    if compresslevel <= 0:
+        compression, level = zipfile.ZIP_STORED, None
+    else:
+        compression, level = zipfile.ZIP_DEFLATED, min(compresslevel, 9)
+
+    package = doc.part.package
+    parts = list(package.iter_parts())
+
+    with zipfile.ZipFile(str(template_path), "r") as zin, \
+            zipfile.ZipFile(str(output_path), "w", compression=compression, compresslevel=level) as zout:
+        template_entries = {info.filename: info for info in zin.infolist()}
+
+        def write_blob(partname, blob: bytes) -> None:
+            zout.writestr(_zip_name(partname), blob)
+
+        # Les petites parties de structure sont toujours régénérées
+        write_blob(CONTENT_TYPES_URI, _ContentTypesItem.from_parts(parts).blob)
+        write_blob(PACKAGE_URI.rels_uri, package.rels.xml)
+
+        for part in parts:
+            name = _zip_name(part.partname)
+            info = template_entries.get(name)
+            if info is None:
+                write_blob(part.partname, part.blob)
+            elif isinstance(part, XmlPart):
+                if modified is None or str(part.partname) in modified:
+                    write_blob(part.partname, serialize_part_xml(part.element))
+                else:
+                    copy_raw_entry(zin, zout, info)
+            else:
+                blob = part.blob
+                if _same_bytes(info, blob):
+                    copy_raw_entry(zin, zout, info)
+                else:
+                    write_blob(part.partname, blob)
+            if len(part.rels):
+                write_blob(part.partname.rels_uri, part.rels.xml)
+
+    return output_path.stat().st_size
@@ -0,0 +1,115 @@
+"""
+Diffusion des événements SSE (/events) vers les navigateurs abonnés.
+
+Chaque client a un tampon borné qui fusionne les messages : seul le dernier
+"updated" d'une trame compte, inutile d'en empiler dix derrière un onglet figé.
+`publish` ne bloque jamais (pas d'attente sur un client lent), un client qui ne
+lit plus rien pendant DEAD_CLIENT_SECONDS est déconnecté, et un commentaire
+SSE est envoyé toutes les HEARTBEAT_SECONDS pour garder la connexion ouverte et
+détecter les sockets mortes.
+
+Les abonnements peuvent être limités à une trame ou à une session d'édition :
+un client qui regarde "test3" ne reçoit pas les mises à jour de "test".
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, List, Optional, Set
+
+MAX_PENDING_EVENTS = 32
+HEARTBEAT_SECONDS = 15.0
+DEAD_CLIENT_SECONDS = 60.0
+
+
+class Subscriber:
+    def __init__(self, topics: Optional[Set[str]], max_pending: int = MAX_PENDING_EVENTS):
+        self.topics = topics  # None = tous les événements
+        self.max_pending = max_pending
+        # clé de fusion -> message ; l'ordre d'insertion donne l'ordre d'envoi
+        self._pending: "OrderedDict[str, str]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.last_read = time.monotonic()
+        self.closed = False
+
+    def wants(self, topic: Optional[str]) -> bool:
+        return self.topics is None or topic is None or topic in self.topics
+
+    def push(self, key: str, message: str) -> None:
+        if key in self._pending:
+            # Un message plus récent remplace l'ancien et passe en fin de file
+            del self._pending[key]
+        elif len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+        self._pending[key] = message
+        self._ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._ready.set()
+
+    async def wait(self, timeout: float) -> List[str]:
+        """Messages en attente (vide si rien avant `timeout` secondes)."""
+        if not self._pending and not self.closed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        messages = list(self._pending.values())
+        self._pending.clear()
+        self.last_read = time.monotonic()
+        return messages
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+
+class EventHub:
+    def __init__(self, dead_client_seconds: float = DEAD_CLIENT_SECONDS):
+        self.dead_client_seconds = dead_client_seconds
+        self._subscribers: Set[Subscriber] = set()
+
+    def subscribe(self, topics: Optional[Set[str]] = None) -> Subscriber:
+        subscriber = Subscriber(topics)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+        subscriber.close()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, message: str, topics: Optional[List[str]] = None) -> None:
+        """Dépose `message` chez chaque abonné concerné, sans jamais attendre."""
+        now = time.monotonic()
+        for subscriber in list(self._subscribers):
+            if subscriber.pending and now - subscriber.last_read > self.dead_client_seconds:
+                # Client qui ne lit plus : on libère sa place
+                self.unsubscribe(subscriber)
+                continue
+            if topics is None:
+                subscriber.push(message, message)
+                continue
+            for topic in topics:
+                if subscriber.wants(topic):
+                    subscriber.push(f"{topic}:{message}", message)
+                    break
+
+    async def stream(self, topics: Optional[Set[str]] = None,
+                     heartbeat_seconds: float = HEARTBEAT_SECONDS) -> AsyncIterator[str]:
+        """Générateur SSE pour un client ; se désabonne à la déconnexion."""
+        subscriber = self.subscribe(topics)
+        try:
+            yield ": connected\n\n"
+            while not subscriber.closed:
+                messages = await subscriber.wait(heartbeat_seconds)
+                if not messages:
+                    yield ": ping\n\n"
+                    continue
+                for message in messages:
+                    yield f"data: {message}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,113 @@
+"""
+Mémoïsation des générations de rapport.
+
+Une génération est identifiée par l'empreinte du payload normalisé, de la trame
+et des images référencées. Si le même rapport a déjà été produit récemment, son
+contenu est resservi sans repasser par process_document.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, MutableMapping, Optional, Tuple
+
+MAX_CACHED_OUTPUTS = 16
+MAX_CACHED_BYTES = 64 * 1024 * 1024
+
+# chemin -> (mtime_ns, taille, sha256) : un fichier inchangé n'est relu qu'une fois
+_digest_memo: Dict[str, Tuple[int, int, str]] = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path: Path) -> str:
+    """Empreinte SHA-256 d'un fichier, mémorisée tant que sa date et sa taille ne changent pas."""
+    path = Path(path)
+    try:
+        st = path.stat()
+    except OSError:
+        return "missing"
+    memo_key = str(path.resolve())
+    with _digest_lock:
+        memo = _digest_memo.get(memo_key)
+    if memo is not None and memo[:2] == (st.st_mtime_ns, st.st_size):
+        return memo[2]
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    with _digest_lock:
+        _digest_memo[memo_key] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def generation_key(payload: Dict, template_path: Path, image_paths: Iterable[str]) -> str:
+    """Clé d'une génération : payload normalisé + trame + contenu des images."""
+    h = hashlib.sha256()
+    h.update(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(file_digest(template_path).encode("ascii"))
+    for image_path in sorted(set(image_paths)):
+        h.update(image_path.encode("utf-8"))
+        h.update(file_digest(Path(image_path)).encode("ascii"))
+    return h.hexdigest()
+
+
+class GenerationCache:
+    """LRU borné (nombre d'entrées et octets) des derniers documents générés."""
+
+    def __init__(self, max_entries: int = MAX_CACHED_OUTPUTS, max_bytes: int = MAX_CACHED_BYTES,
+                 on_disk: Optional[MutableMapping] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._outputs: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        # chemin de sortie -> [clé, mtime_ns, taille] de la génération écrite sur disque ;
+        # `on_disk` peut être partagé entre workers (voir shared_state)
+        self._on_disk: MutableMapping = on_disk if on_disk is not None else {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._outputs.get(key)
+            if data is not None:
+                self._outputs.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            if len(data) > self.max_bytes:
+                return
+            old = self._outputs.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._outputs[key] = data
+            self._size += len(data)
+            while len(self._outputs) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._outputs.popitem(last=False)
+                self._size -= len(evicted)
+
+    def is_on_disk(self, output_path: Path, key: str) -> bool:
+        """Vrai si `output_path` contient déjà exactement cette génération (et n'a pas été modifié depuis)."""
+        with self._lock:
+            entry = self._on_disk.get(str(output_path))
+        if entry is None or entry[0] != key:
+            return False
+        try:
+            st = Path(output_path).stat()
+        except OSError:
+            return False
+        return [st.st_mtime_ns, st.st_size] == list(entry[1:])
+
+    def key_on_disk(self, output_path: Path) -> Optional[str]:
+        """Clé de la génération présente dans `output_path`, si le fichier n'a pas changé depuis."""
+        with self._lock:
+            entry = self._on_disk.get(str(output_path))
+        if entry is None:
+            return None
+        return entry[0] if self.is_on_disk(output_path, entry[0]) else None
+
+    def mark_on_disk(self, output_path: Path, key: str) -> None:
+        st = Path(output_path).stat()
+        with self._lock:
+            self._on_disk[str(output_path)] = [key, st.st_mtime_ns, st.st_size]
+
+    def forget_on_disk(self, output_path: Path) -> None:
+        with self._lock:
+            self._on_disk.pop(str(output_path), None)
@@ -0,0 +1,501 @@
+"""
+Aperçu HTML d'un .docx en une seule lecture du paquet (lxml).
+
+Le corps, les en-têtes, les styles, la numérotation et les images sont lus une
+fois depuis le ZIP, puis en-têtes, tableaux et corps sont rendus ensemble dans
+un seul tampon. Les balises suivent celles de mammoth :
+- h1 à h6 pour les titres,
+- ul/ol pour les listes,
+- table/td avec colspan/rowspan,
+- a id pour les signets,
+- img en data URI.
+
+La traduction des styles Word (balise, alignement CSS, listes ordonnées ou non)
+ne dépend que de styles.xml et numbering.xml. Elle est gardée en cache selon le
+CRC de ces parties, que le ZIP fournit sans rien décompresser. Elle est donc
+calculée une fois par trame et resservie pour tous les documents générés à partir
+de cette trame.
+"""
+import base64
+import html
+import mimetypes
+import posixpath
+import threading
+import zipfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+V_NS = "urn:schemas-microsoft-com:vml"
+MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+HYPERLINK_REL = R_NS + "/hyperlink"
+
+STYLE_CACHE_SIZE = 32
+EMU_PER_PIXEL = 9525
+HEADING_PREFIXES = ("heading ", "titre ")
+JC_CSS = {"center": "text-align: center", "right": "text-align: right", "end": "text-align: right",
+          "both": "text-align: justify", "distribute": "text-align: justify"}
+# Éléments transparents : on rend leur contenu
+INLINE_CONTAINERS = {"ins", "smartTag", "fldSimple", "customXml", "sdtContent", "moveTo"}
+BLOCK_CONTAINERS = {"sdtContent", "customXml"}
+
+
+def _w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+def _local(element) -> str:
+    tag = element.tag
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _on(element) -> bool:
+    # <w:b/>, <w:b w:val="1"/> ou "true" : actif ; "0" / "false" : désactivé
+    return element is not None and element.get(_w("val"), "true") not in ("0", "false", "off")
+
+
+class ParagraphStyle(NamedTuple):
+    tag: str
+    css: str
+
+
+class StyleSheet(NamedTuple):
+    paragraphs: Dict[str, ParagraphStyle]
+    default: ParagraphStyle
+    ordered_lists: Dict[Tuple[str, str], bool]  # (numId, ilvl) -> liste numérotée
+
+    def paragraph(self, style_id: Optional[str]) -> ParagraphStyle:
+        return self.paragraphs.get(style_id, self.default) if style_id else self.default
+
+    def is_ordered(self, num_id: str, level: str) -> bool:
+        return self.ordered_lists.get((num_id, level), False)
+
+
+_style_cache: Dict[Tuple, StyleSheet] = {}
+_style_lock = threading.Lock()
+
+
+def _heading_tag(name: str) -> Optional[str]:
+    lowered = name.lower()
+    for prefix in HEADING_PREFIXES:
+        if lowered.startswith(prefix) and lowered[len(prefix):].strip().isdigit():
+            return f"h{min(max(int(lowered[len(prefix):]), 1), 6)}"
+    return None
+
+
+def parse_stylesheet(styles_xml: Optional[bytes], numbering_xml: Optional[bytes]) -> StyleSheet:
+    raw = {}
+    default_id = None
+    if styles_xml:
+        for style in etree.fromstring(styles_xml).iterfind(_w("style")):
+            if style.get(_w("type")) != "paragraph":
+                continue
+            style_id = style.get(_w("styleId"))
+            name = style.find(_w("name"))
+            based_on = style.find(_w("basedOn"))
+            jc = style.find(f"{_w('pPr')}/{_w('jc')}")
+            raw[style_id] = (
+                name.get(_w("val"), "") if name is not None else "",
+                based_on.get(_w("val")) if based_on is not None else None,
+                jc.get(_w("val")) if jc is not None else None,
+            )
+            if style.get(_w("default")) in ("1", "true"):
+                default_id = style_id
+
+    def inherited_jc(style_id: str) -> Optional[str]:
+        seen = set()
+        while style_id in raw and style_id not in seen:
+            seen.add(style_id)
+            _, based_on, jc = raw[style_id]
+            if jc is not None:
+                return jc
+            style_id = based_on
+        return None
+
+    paragraphs = {}
+    for style_id, (name, _, _) in raw.items():
+        paragraphs[style_id] = ParagraphStyle(_heading_tag(name) or "p", JC_CSS.get(inherited_jc(style_id), ""))
+    default = paragraphs.get(default_id, ParagraphStyle("p", ""))
+
+    ordered_lists = {}
+    if numbering_xml:
+        root = etree.fromstring(numbering_xml)
+        abstract_formats = {}
+        for abstract in root.iterfind(_w("abstractNum")):
+            for lvl in abstract.iterfind(_w("lvl")):
+                fmt = lvl.find(_w("numFmt"))
+                abstract_formats[(abstract.get(_w("abstractNumId")), lvl.get(_w("ilvl")))] = (
+                    fmt.get(_w("val")) if fmt is not None else "decimal"
+                )
+        for num in root.iterfind(_w("num")):
+            abstract_id = num.find(_w("abstractNumId"))
+            if abstract_id is None:
+                continue
+            for (aid, level), fmt in abstract_formats.items():
+                if aid == abstract_id.get(_w("val")):
+                    ordered_lists[(num.get(_w("numId")), level)] = fmt not in ("bullet", "none")
+    return StyleSheet(paragraphs, default, ordered_lists)
+
+
+def stylesheet_for(archive: zipfile.ZipFile) -> StyleSheet:
+    """Feuille de style de l'archive, en cache par CRC de styles.xml et numbering.xml."""
+    infos = []
+    for name in ("word/styles.xml", "word/numbering.xml"):
+        try:
+            info = archive.getinfo(name)
+            infos.append((name, info.CRC, info.file_size))
+        except KeyError:
+            infos.append((name, None, None))
+    key = tuple(infos)
+    sheet = _style_cache.get(key)
+    if sheet is None:
+        sheet = parse_stylesheet(*(archive.read(name) if crc is not None else None for name, crc, _ in infos))
+        with _style_lock:
+            if len(_style_cache) >= STYLE_CACHE_SIZE:
+                _style_cache.clear()
+            _style_cache[key] = sheet
+    return sheet
+
+
+def _rels_path(part_name: str) -> str:
+    directory, name = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", name + ".rels")
+
+
+def _read_rels(archive: zipfile.ZipFile, part_name: str) -> Dict[str, Tuple[str, str, Optional[str]]]:
+    """rId -> (cible, type, mode) pour une partie du paquet."""
+    try:
+        root = etree.fromstring(archive.read(_rels_path(part_name)))
+    except KeyError:
+        return {}
+    return {
+        rel.get("Id"): (rel.get("Target"), rel.get("Type"), rel.get("TargetMode"))
+        for rel in root.iterfind(f"{{{PKG_REL_NS}}}Relationship")
+    }
+
+
+def _plain_text(element) -> str:
+    """Texte comme python-docx : tabulations et sauts de ligne conservés."""
+    parts = []
+    for node in element.iter(_w("t"), _w("tab"), _w("br"), _w("cr")):
+        tag = _local(node)
+        if tag == "t":
+            parts.append(node.text or "")
+        elif tag == "tab":
+            parts.append("\t")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+
+class _Renderer:
+    def __init__(self, archive: zipfile.ZipFile, part_name: str, styles: StyleSheet,
+                 images: Dict[str, str]):
+        self.archive = archive
+        self.part_dir = posixpath.dirname(part_name)
+        self.rels = _read_rels(archive, part_name)
+        self.styles = styles
+        self.images = images  # chemin dans le paquet -> data URI (une image répétée n'est encodée qu'une fois)
+
+    # --- blocs -------------------------------------------------------------
+
+    def blocks(self, container, out: List[str]) -> None:
+        list_stack: List[bool] = []
+        for child in container:
+            tag = _local(child)
+            if tag == "p":
+                self.paragraph(child, out, list_stack)
+            elif tag == "tbl":
+                self._close_lists(out, list_stack, 0)
+                self.table(child, out)
+            elif tag == "sdt":
+                content = child.find(_w("sdtContent"))
+                if content is not None:
+                    self._close_lists(out, list_stack, 0)
+                    self.blocks(content, out)
+            elif tag in BLOCK_CONTAINERS:
+                self._close_lists(out, list_stack, 0)
+                self.blocks(child, out)
+        self._close_lists(out, list_stack, 0)
+
+    @staticmethod
+    def _close_lists(out: List[str], stack: List[bool], depth: int) -> None:
+        while len(stack) > depth:
+            out.append("</li></ol>" if stack.pop() else "</li></ul>")
+
+    def paragraph(self, p, out: List[str], list_stack: List[bool]) -> None:
+        ppr = p.find(_w("pPr"))
+        style_id = num_id = level = jc = None
+        if ppr is not None:
+            pstyle = ppr.find(_w("pStyle"))
+            style_id = pstyle.get(_w("val")) if pstyle is not None else None
+            num_pr = ppr.find(_w("numPr"))
+            if num_pr is not None:
+                num = num_pr.find(_w("numId"))
+                ilvl = num_pr.find(_w("ilvl"))
+                num_id = num.get(_w("val")) if num is not None else None
+                level = ilvl.get(_w("val"), "0") if ilvl is not None else "0"
+            jc_el = ppr.find(_w("jc"))
+            jc = jc_el.get(_w("val")) if jc_el is not None else None
+        style = self.styles.paragraph(style_id)
+        inner = self.inline(p)
+        if not inner:
+            return
+        css = JC_CSS.get(jc, "") if jc is not None else style.css
+        attr = f' style="{css}"' if css else ""
+
+        if num_id and num_id != "0" and style.tag == "p":
+            depth = int(level) + 1
+            ordered = self.styles.is_ordered(num_id, level)
+            self._close_lists(out, list_stack, depth)
+            if len(list_stack) == depth:
+                if list_stack[-1] != ordered:
+                    self._close_lists(out, list_stack, depth - 1)
+                else:
+                    out.append("</li>")
+            while len(list_stack) < depth:
+                out.append("<ol>" if ordered else "<ul>")
+                list_stack.append(ordered)
+            out.append(f"<li{attr}>{inner}")
+            return
+        self._close_lists(out, list_stack, 0)
+        out.append(f"<{style.tag}{attr}>{inner}</{style.tag}>")
+
+    def table(self, tbl, out: List[str]) -> None:
+        rows = []
+        # colonne -> cellule ouverte par vMerge="restart", dont on augmente le rowspan
+        merge_origin: Dict[int, dict] = {}
+        for tr in tbl.iterfind(_w("tr")):
+            cells = []
+            column = 0
+            for tc in tr.iterfind(_w("tc")):
+                tcpr = tc.find(_w("tcPr"))
+                span = 1
+                vmerge = None
+                if tcpr is not None:
+                    grid_span = tcpr.find(_w("gridSpan"))
+                    if grid_span is not None:
+                        span = int(grid_span.get(_w("val"), "1"))
+                    vmerge_el = tcpr.find(_w("vMerge"))
+                    if vmerge_el is not None:
+                        vmerge = vmerge_el.get(_w("val"), "continue")
+                if vmerge == "continue" and column in merge_origin:
+                    merge_origin[column]["rowspan"] += 1
+                else:
+                    cell = {"element": tc, "colspan": span, "rowspan": 1}
+                    cells.append(cell)
+                    if vmerge == "restart":
+                        merge_origin[column] = cell
+                    else:
+                        merge_origin.pop(column, None)
+                column += span
+            rows.append(cells)
+
+        out.append("<table>")
+        for cells in rows:
+            out.append("<tr>")
+            for cell in cells:
+                attrs = ""
+                if cell["colspan"] > 1:
+                    attrs += f' colspan="{cell["colspan"]}"'
+                if cell["rowspan"] > 1:
+                    attrs += f' rowspan="{cell["rowspan"]}"'
+                out.append(f"<td{attrs}>")
+                self.blocks(cell["element"], out)
+                out.append("</td>")
+            out.append("</tr>")
+        out.append("</table>")
+
+    # --- contenu des paragraphes -------------------------------------------
+
+    def inline(self, container) -> str:
+        segments: List[Tuple[Tuple[str, ...], str]] = []
+        for child in container:
+            tag = _local(child)
+            if tag == "r":
+                self.run(child, segments)
+            elif tag == "hyperlink":
+                href = None
+                rel = self.rels.get(child.get(f"{{{R_NS}}}id"))
+                if rel is not None and rel[1] == HYPERLINK_REL:
+                    href = rel[0]
+                elif child.get(_w("anchor")):
+                    href = "#" + child.get(_w("anchor"))
+                content = self.inline(child)
+                if href and content:
+                    segments.append(((), f'<a href="{html.escape(href)}">{content}</a>'))
+                elif content:
+                    segments.append(((), content))
+            elif tag == "bookmarkStart":
+                name = child.get(_w("name"))
+                if name and name != "_GoBack":
+                    segments.append(((), f'<a id="{html.escape(name)}"></a>'))
+            elif tag in INLINE_CONTAINERS or tag == "sdt":
+                target = child.find(_w("sdtContent")) if tag == "sdt" else child
+                if target is not None:
+                    segments.append(((), self.inline(target)))
+        return self._merge(segments)
+
+    @staticmethod
+    def _merge(segments: List[Tuple[Tuple[str, ...], str]]) -> str:
+        # Runs consécutifs de même mise en forme fusionnés : <strong>ab</strong> et non <strong>a</strong><strong>b</strong>
+        out = []
+        current: Tuple[str, ...] = ()
+        for tags, text in segments:
+            if not text:
+                continue
+            if tags != current:
+                out.extend(f"</{t}>" for t in reversed(current))
+                out.extend(f"<{t}>" for t in tags)
+                current = tags
+            out.append(text)
+        out.extend(f"</{t}>" for t in reversed(current))
+        return "".join(out)
+
+    def run(self, r, segments: List[Tuple[Tuple[str, ...], str]]) -> None:
+        rpr = r.find(_w("rPr"))
+        tags: Tuple[str, ...] = ()
+        if rpr is not None:
+            if _on(rpr.find(_w("vanish"))):
+                return
+            if _on(rpr.find(_w("b"))):
+                tags += ("strong",)
+            if _on(rpr.find(_w("i"))):
+                tags += ("em",)
+            if _on(rpr.find(_w("strike"))):
+                tags += ("s",)
+            vert = rpr.find(_w("vertAlign"))
+            if vert is not None and vert.get(_w("val")) in ("superscript", "subscript"):
+                tags += ("sup" if vert.get(_w("val")) == "superscript" else "sub",)
+        parts = []
+        for child in r:
+            tag = _local(child)
+            if tag == "t":
+                parts.append(html.escape(child.text or "", quote=False))
+            elif tag == "tab":
+                parts.append("\t")
+            elif tag in ("br", "cr"):
+                if child.get(_w("type")) not in ("page", "column"):
+                    parts.append("<br />")
+            elif tag == "noBreakHyphen":
+                parts.append("-")
+            elif tag in ("drawing", "pict", "AlternateContent"):
+                parts.append(self.image(child))
+        segments.append((tags, "".join(parts)))
+
+    def image(self, element) -> str:
+        rel_id = None
+        blip = next(element.iter(f"{{{A_NS}}}blip"), None)
+        if blip is not None:
+            rel_id = blip.get(f"{{{R_NS}}}embed")
+        else:
+            imagedata = next(element.iter(f"{{{V_NS}}}imagedata"), None)
+            if imagedata is not None:
+                rel_id = imagedata.get(f"{{{R_NS}}}id")
+        rel = self.rels.get(rel_id)
+        if rel is None or rel[2] == "External":
+            return ""
+        path = posixpath.normpath(posixpath.join(self.part_dir, rel[0]))
+        src = self.images.get(path)
+        if src is None:
+            try:
+                data = self.archive.read(path)
+            except KeyError:
+                return ""
+            mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            src = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            self.images[path] = src
+        attrs = ""
+        doc_pr = next(element.iter(f"{{{WP_NS}}}docPr"), None)
+        if doc_pr is not None and doc_pr.get("descr"):
+            attrs += f' alt="{html.escape(doc_pr.get("descr"))}"'
+        extent = next(element.iter(f"{{{WP_NS}}}extent"), None)
+        if extent is not None and extent.get("cx", "").isdigit():
+            attrs += f' width="{round(int(extent.get("cx")) / EMU_PER_PIXEL)}"'
+        return f'<img{attrs} src="{src}" />'
+
+
+def _header_parts(archive: zipfile.ZipFile, body, rels: Dict[str, Tuple[str, str, Optional[str]]]) -> List[str]:
+    """En-têtes par défaut des sections, dans l'ordre (une section sans en-tête reprend le précédent)."""
+    parts = []
+    previous = None
+    for sect_pr in body.iter(_w("sectPr")):
+        target = previous
+        for ref in sect_pr.iterfind(_w("headerReference")):
+            if ref.get(_w("type"), "default") == "default":
+                rel = rels.get(ref.get(f"{{{R_NS}}}id"))
+                if rel is not None:
+                    target = posixpath.normpath(posixpath.join("word", rel[0]))
+        if target is not None and target not in parts:
+            parts.append(target)
+        previous = target
+    return parts
+
+
+def _render_header(root) -> str:
+    """En-tête au format de l'aperçu historique : paragraphes centrés, tableau sur toute la largeur."""
+    out = []
+    for child in root:
+        tag = _local(child)
+        if tag == "p":
+            text = _plain_text(child)
+            if text.strip():
+                style = 'style="text-align: center; font-weight: bold; margin-bottom: 10px;"'
+                out.append(f"<div {style}>{html.escape(text, quote=False)}</div>\n")
+        elif tag == "tbl":
+            out.append('<table style="width: 100%; border-collapse: collapse; margin-bottom: 10px;">\n')
+            for tr in child.iterfind(_w("tr")):
+                out.append("  <tr>\n")
+                for tc in tr.iterfind(_w("tc")):
+                    span = tc.find(f"{_w('tcPr')}/{_w('gridSpan')}")
+                    colspan = f' colspan="{span.get(_w("val"))}"' if span is not None else ""
+                    cell_text = "\n".join(_plain_text(p) for p in tc.iterfind(_w("p"))).strip()
+                    if cell_text:
+                        if "Rapport" in cell_text or "Art." in cell_text:
+                            style = 'style="text-align: center; font-weight: bold; padding: 5px; vertical-align: middle;"'
+                        else:
+                            style = 'style="text-align: right; padding: 5px; vertical-align: middle;"'
+                        cell_html = html.escape(cell_text, quote=False).replace("\n", "<br>")
+                        out.append(f"    <td{colspan} {style}>{cell_html}</td>\n")
+                    else:
+                        out.append(f'    <td{colspan} style="padding: 5px;"></td>\n')
+                out.append("  </tr>\n")
+            out.append("</table>\n")
+    return "".join(out)
+
+
+def render_docx_html(docx_path: Path) -> str:
+    """Aperçu HTML complet (en-têtes + corps) en une lecture du fichier."""
+    with zipfile.ZipFile(docx_path) as archive:
+        styles = stylesheet_for(archive)
+        body = etree.fromstring(archive.read("word/document.xml")).find(_w("body"))
+        renderer = _Renderer(archive, "word/document.xml", styles, images={})
+
+        headers_html = ""
+        for part in _header_parts(archive, body, renderer.rels):
+            try:
+                headers_html += _render_header(etree.fromstring(archive.read(part)))
+            except KeyError:
+                continue
+        if not headers_html:
+            # Pas d'en-tête : premiers paragraphes contenant des placeholders
+            for p in body.findall(_w("p"))[:5]:
+                text = _plain_text(p).strip()
+                if text and "{" in text:
+                    style = 'style="text-align: center; font-weight: bold; margin-bottom: 10px;"'
+                    headers_html += f"<div {style}>{html.escape(text, quote=False)}</div>\n"
+
+        out: List[str] = []
+        renderer.blocks(body, out)
+
+    body_html = "".join(out)
+    if headers_html:
+        return (f'<div style="border-bottom: 2px solid #333; padding-bottom: 20px; margin-bottom: 20px;">\n'
+                f"{headers_html}</div>\n{body_html}")
+    return body_html
@@ -0,0 +1,111 @@
+"""
+Normalisation des images au moment de l'upload.
+
+Toutes les images (HEIC, JPEG, PNG...) passent par une seule étape :
+- orientation EXIF appliquée aux pixels (les photos de téléphone ne sont plus couchées),
+- métadonnées lourdes retirées (EXIF, XMP, miniatures ; le profil ICC est conservé),
+- résolution plafonnée à MAX_IMAGE_DIMENSION pixels sur le grand côté,
+- dimensions relevées pour la fiche de l'upload.
+
+Les étapes suivantes (génération, aperçu) ne décodent donc plus jamais l'original.
+"""
+import io
+from typing import Dict, NamedTuple
+
+from PIL import Image, ImageOps
+
+# ~8 pouces à 300 dpi : au-delà, Word réduit de toute façon l'image à l'affichage
+MAX_IMAGE_DIMENSION = 2400
+JPEG_QUALITY = 90
+EXIF_ORIENTATION_TAG = 0x0112
+HEIF_EXTENSIONS = (".heic", ".heif")
+# Formats conservés tels quels (les autres sont ré-encodés en JPEG ou PNG)
+KEPT_FORMATS = {"JPEG": ".jpg", "PNG": ".png"}
+
+
+_heif_registered = False
+
+
+def register_heif_opener() -> None:
+    """Charge pillow_heif à la première image HEIC seulement (import coûteux, usage rare)."""
+    global _heif_registered
+    if not _heif_registered:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        _heif_registered = True
+
+
+class NormalizedImage(NamedTuple):
+    data: bytes
+    extension: str
+    info: Dict
+
+
+def _flatten_to_rgb(image: Image.Image) -> Image.Image:
+    # Convertir en RGB si nécessaire (fond blanc sous la transparence)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+        rgb_image.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
+        return rgb_image
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def _has_heavy_metadata(image: Image.Image) -> bool:
+    return bool(image.info.get("exif") or image.info.get("xmp") or image.getexif())
+
+
+def normalize_image(contents: bytes, filename: str) -> NormalizedImage:
+    """Applique l'orientation, retire les métadonnées et plafonne la résolution.
+
+    Une image déjà droite, sans métadonnées et assez petite est renvoyée octet pour
+    octet (pas de ré-encodage, donc pas de perte).
+    """
+    is_heif = filename.lower().endswith(HEIF_EXTENSIONS)
+    if is_heif:
+        register_heif_opener()
+
+    with Image.open(io.BytesIO(contents)) as image:
+        fmt = image.format
+        orientation = int(image.getexif().get(EXIF_ORIENTATION_TAG, 1))
+        too_big = max(image.size) > MAX_IMAGE_DIMENSION
+
+        if (not is_heif and fmt in KEPT_FORMATS and orientation == 1
+                and not too_big and not _has_heavy_metadata(image)):
+            return NormalizedImage(contents, KEPT_FORMATS[fmt], {
+                "width": image.width,
+                "height": image.height,
+                "mime": Image.MIME[fmt],
+                "orientation": orientation,
+            })
+
+        if fmt == "JPEG" and too_big:
+            # Décodage JPEG directement à échelle réduite (1/2, 1/4, 1/8)
+            image.draft("RGB", (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        icc_profile = image.info.get("icc_profile")
+        normalized = ImageOps.exif_transpose(image)
+        normalized.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.LANCZOS)
+
+        out = io.BytesIO()
+        keep_png = fmt == "PNG" or (fmt not in KEPT_FORMATS and not is_heif and "A" in normalized.mode)
+        if keep_png:
+            if normalized.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                normalized = normalized.convert("RGBA")
+            normalized.save(out, "PNG", optimize=True, icc_profile=icc_profile)
+            extension, out_fmt = ".png", "PNG"
+        else:
+            normalized = _flatten_to_rgb(normalized)
+            normalized.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, icc_profile=icc_profile)
+            extension, out_fmt = ".jpg", "JPEG"
+
+        return NormalizedImage(out.getvalue(), extension, {
+            "width": normalized.width,
+            "height": normalized.height,
+            "mime": Image.MIME[out_fmt],
+            # Pixels déjà redressés : l'image stockée est droite ; l'orientation reçue est gardée à part
+            "orientation": 1,
+            "original_orientation": orientation,
+        })
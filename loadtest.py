@@ -0,0 +1,298 @@
+"""
+Test de charge HTTP de bout en bout de l'application (app.py).
+Dépendances de développement en plus de l'application : pip install -r requirements-dev.txt (httpx).
+
+    python loadtest.py                                # app en processus (ASGI), 8 utilisateurs, 20 s
+    python loadtest.py --uvicorn --users 16           # uvicorn local lancé par le script
+    python loadtest.py --url http://127.0.0.1:8000    # serveur déjà démarré (ex. --workers 4)
+    python loadtest.py --mix placeholders=3,generate=2,upload=1,preview=2 --listeners 4
+
+Chaque utilisateur simulé enchaîne des requêtes tirées selon `--mix` :
+- placeholders : GET /placeholders
+- generate     : POST /generate ; une requête sur `--unique` (proportion) porte un
+                 mapping inédit pour passer outre le cache de génération
+- upload       : POST /upload d'une image JPEG ou HEIC prise dans un petit jeu fixe
+                 (les doublons sont donc fréquents, comme en usage réel)
+- preview      : GET /preview
+`--listeners` clients SSE restent abonnés à /events pendant le test.
+
+Le rapport donne, par type de requête et au total : nombre, erreurs, débit et
+latences p50 / p95 / p99 / max. Attention : les générations écrivent réellement
+les fichiers *_sortie.docx des trames et les images dans uploads/.
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from PIL import Image
+
+DEFAULT_MIX = "placeholders=3,generate=2,upload=1,preview=2"
+IMAGE_POOL_SIZE = 4
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_samples: List[str] = []
+        self.sse_events = 0
+
+    def record(self, op: str, seconds: float, error: Optional[str] = None) -> None:
+        self.latencies.setdefault(op, []).append(seconds)
+        if error is not None:
+            self.errors[op] = self.errors.get(op, 0) + 1
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f"{op}: {error}")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Rang le plus proche : pas d'interpolation, valeur réellement observée
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def parse_mix(text: str) -> List[Tuple[str, int]]:
+    mix = []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Opération inconnue dans --mix: {name} (choix: {', '.join(OPERATIONS)})")
+        mix.append((name, int(weight or 1)))
+    return mix
+
+
+def build_image_pool() -> List[Tuple[str, bytes, str]]:
+    """Quelques photos synthétiques ; la moitié en HEIC si l'encodeur est disponible."""
+    pool = []
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        heic = True
+    except ImportError:
+        heic = False
+    for i in range(IMAGE_POOL_SIZE):
+        image = Image.new("RGB", (2000 + 200 * i, 1500), (40 * i, 120, 200 - 30 * i))
+        out = io.BytesIO()
+        if heic and i % 2:
+            image.save(out, "HEIF", quality=80)
+            pool.append((f"photo{i}.heic", out.getvalue(), "image/heic"))
+        else:
+            image.save(out, "JPEG", quality=85)
+            pool.append((f"photo{i}.jpg", out.getvalue(), "image/jpeg"))
+    return pool
+
+
+class Scenario:
+    def __init__(self, client: httpx.AsyncClient, template: Optional[str], unique: float, seed: int):
+        self.client = client
+        self.template = template
+        self.unique = unique
+        self.random = random.Random(seed)
+        self.placeholders: List[str] = []
+        self.markers: List[str] = []
+        self.uploaded: List[str] = []
+        self.images = build_image_pool()
+        self._counter = 0
+
+    def _params(self) -> dict:
+        return {"template": self.template} if self.template else {}
+
+    async def prepare(self) -> None:
+        response = await self.client.get("/placeholders", params=self._params())
+        response.raise_for_status()
+        data = response.json()
+        self.template = self.template or data["template"]
+        self.placeholders = data["placeholders"]
+        self.markers = data["markers"]
+
+    async def placeholders_op(self) -> httpx.Response:
+        return await self.client.get("/placeholders", params=self._params())
+
+    async def generate_op(self) -> httpx.Response:
+        self._counter += 1
+        variant = self._counter if self.random.random() < self.unique else 0
+        mapping = {ph: f"{ph.strip('{}')}-{variant}" for ph in self.placeholders}
+        payload = {"template": self.template, "mapping": mapping}
+        if self.uploaded and self.markers:
+            payload["images_at_markers"] = {m: self.random.choice(self.uploaded) for m in self.markers}
+        return await self.client.post("/generate", json=payload)
+
+    async def upload_op(self) -> httpx.Response:
+        name, data, mime = self.random.choice(self.images)
+        response = await self.client.post("/upload", files={"file": (name, data, mime)})
+        if response.status_code == 200:
+            path = response.json()["path"]
+            if path not in self.uploaded:
+                self.uploaded.append(path)
+        return response
+
+    async def preview_op(self) -> httpx.Response:
+        return await self.client.get("/preview", params=self._params())
+
+
+OPERATIONS = {
+    "placeholders": Scenario.placeholders_op,
+    "generate": Scenario.generate_op,
+    "upload": Scenario.upload_op,
+    "preview": Scenario.preview_op,
+}
+
+
+async def user_loop(scenario: Scenario, mix: List[Tuple[str, int]], deadline: float, stats: Stats) -> None:
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    while time.perf_counter() < deadline:
+        op = scenario.random.choices(names, weights)[0]
+        start = time.perf_counter()
+        error = None
+        try:
+            response = await OPERATIONS[op](scenario)
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code} {response.text[:120]}"
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+        stats.record(op, time.perf_counter() - start, error)
+
+
+async def http_listener(client: httpx.AsyncClient, template: Optional[str], stats: Stats) -> None:
+    params = {"template": template} if template else {}
+    async with client.stream("GET", "/events", params=params, timeout=None) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                stats.sse_events += 1
+
+
+async def hub_listener(template: Optional[str], stats: Stats) -> None:
+    # En processus, le transport ASGI de httpx attend la fin de la réponse :
+    # l'abonné lit donc directement le flux de l'EventHub, comme le fait /events
+    from app import event_hub
+    async for chunk in event_hub.stream({template} if template else None):
+        if chunk.startswith("data:"):
+            stats.sse_events += 1
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@asynccontextmanager
+async def open_client(url: Optional[str], use_uvicorn: bool):
+    """Client HTTP vers la cible ; retourne aussi True si l'app tourne dans ce processus."""
+    timeout = httpx.Timeout(120.0)
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=timeout) as client:
+            yield client, False
+        return
+    from app import app
+    if use_uvicorn:
+        import uvicorn
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            await asyncio.sleep(0.05)
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout) as client:
+                yield client, False
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+        return
+    # Le transport ASGI ne déclenche pas le lifespan : on l'exécute nous-mêmes
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=timeout) as client:
+            yield client, True
+
+
+async def run(args) -> Tuple[Stats, float]:
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    async with open_client(args.url, args.uvicorn) as (client, in_process):
+        scenarios = [Scenario(client, args.template, args.unique, seed=i) for i in range(args.users)]
+        for scenario in scenarios:
+            await scenario.prepare()
+        listeners = [
+            asyncio.create_task(hub_listener(scenarios[0].template, stats) if in_process
+                                else http_listener(client, scenarios[0].template, stats))
+            for _ in range(args.listeners)
+        ]
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(user_loop(s, mix, deadline, stats) for s in scenarios))
+        elapsed = time.perf_counter() - start
+        for task in listeners:
+            task.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+    return stats, elapsed
+
+
+def summarize(stats: Stats, elapsed: float) -> Dict[str, dict]:
+    summary = {}
+    groups = dict(stats.latencies)
+    groups["total"] = [v for values in stats.latencies.values() for v in values]
+    for op, values in groups.items():
+        values = sorted(values)
+        errors = sum(stats.errors.values()) if op == "total" else stats.errors.get(op, 0)
+        summary[op] = {
+            "requests": len(values),
+            "errors": errors,
+            "error_rate": round(errors / len(values), 4) if values else 0.0,
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge HTTP de l'API rapport")
+    parser.add_argument("--url", help="Serveur cible (par défaut : app chargée dans ce processus)")
+    parser.add_argument("--uvicorn", action="store_true", help="Lance un uvicorn local au lieu du transport ASGI")
+    parser.add_argument("--users", type=int, default=8, help="Utilisateurs simulés concurrents")
+    parser.add_argument("--listeners", type=int, default=2, help="Clients SSE abonnés à /events")
+    parser.add_argument("--duration", type=float, default=20.0, help="Durée du test en secondes")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Poids des requêtes (défaut: {DEFAULT_MIX})")
+    parser.add_argument("--template", help="Trame utilisée (défaut : celle de /placeholders)")
+    parser.add_argument("--unique", type=float, default=0.5,
+                        help="Proportion de générations au mapping inédit (hors cache)")
+    parser.add_argument("--json", dest="json_path", help="Écrit aussi le résumé dans ce fichier JSON")
+    args = parser.parse_args()
+
+    stats, elapsed = asyncio.run(run(args))
+    summary = summarize(stats, elapsed)
+
+    print(f"{args.users} utilisateurs, {args.listeners} clients SSE, {elapsed:.1f} s")
+    print(f"{'requête':<14} {'nb':>7} {'err.':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for op, row in summary.items():
+        print(f"{op:<14} {row['requests']:>7} {row['errors']:>6} {row['rps']:>8} {row['p50_ms']:>9} "
+              f"{row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+    print(f"Événements SSE reçus : {stats.sse_events}")
+    for sample in stats.error_samples:
+        print(f"  erreur {sample}")
+    if args.json_path:
+        summary["sse_events"] = stats.sse_events
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
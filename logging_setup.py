@@ -0,0 +1,93 @@
+"""
+Journalisation : niveaux, formatage paresseux, écriture hors du thread appelant.
+
+    configure_logging()  # RAPPORT_LOG_LEVEL (INFO), RAPPORT_LOG_FORMAT (text | json)
+    logger = logging.getLogger(__name__)
+    logger.debug("mapping: %s", mapping)  # rien n'est formaté si DEBUG est désactivé
+    logger.info("Image sauvegardée", extra={"upload": name})  # champ structuré
+
+Les enregistrements passent par une QueueHandler : la requête ne fait que déposer
+l'enregistrement dans une file, un QueueListener les formate et les écrit sur
+stderr depuis son propre thread.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Optional
+
+# Attributs présents sur tout LogRecord : le reste vient de `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Bibliothèques très bavardes en DEBUG (PIL trace chaque balise EXIF) : INFO au minimum
+QUIET_LOGGERS = ("PIL", "asyncio", "httpx", "multipart")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES and not k.startswith("_")}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Une ligne par enregistrement : texte `clé=valeur` ou objet JSON."""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = _extra_fields(record)
+        if not self.json_output:
+            line = super().format(record)
+            if fields:
+                line += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+            return line
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Seul le message est figé ici (les arguments peuvent être modifiés ensuite
+        # par l'appelant) ; horodatage, JSON et trace sont produits par le listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(level: Optional[str] = None, json_output: Optional[bool] = None) -> None:
+    """Installe la file de journalisation sur le logger racine (une seule fois par processus)."""
+    global _listener
+    level = (level or os.environ.get("RAPPORT_LOG_LEVEL", "INFO")).upper()
+    if json_output is None:
+        json_output = os.environ.get("RAPPORT_LOG_FORMAT", "text").lower() == "json"
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.INFO))
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(json_output=json_output))
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root.addHandler(_DeferredQueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    # Vide la file avant la sortie du processus
+    atexit.register(_listener.stop)
@@ -0,0 +1,221 @@
+"""
+Métriques au format texte Prometheus, sans dépendance externe.
+
+    GENERATIONS = Counter("rapport_generations_total", "Générations terminées", ["template"])
+    GENERATIONS.inc(template="test")
+    REGISTRY.render()  # texte servi par GET /metrics
+
+Compteurs et histogrammes sont ceux du processus : chaque échantillon porte un
+label `worker` (pid). Avec plusieurs workers, chacun publie `REGISTRY.snapshot()`
+dans l'état partagé et /metrics rend ceux de tous les workers (`render(snapshots)`) ;
+les totaux du service s'obtiennent côté Prometheus, par ex.
+`sum without (worker) (rate(rapport_request_seconds_count[5m]))`.
+"""
+import math
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], *extra: str) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(e for e in extra if e)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def worker_label() -> str:
+    """Label ajouté à tous les échantillons : les valeurs sont propres à ce processus."""
+    return f'worker="{os.getpid()}"'
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _samples(self, worker: str) -> List[str]:
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self, worker: str) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k, worker)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Valeur instantanée ; `function` (optionnelle) est appelée à chaque lecture."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self.function = function
+        self._value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+    def _samples(self, worker: str) -> List[str]:
+        value = self.function() if self.function is not None else self._value
+        return [f"{self.name}{_format_labels((), (), worker)} {_format_value(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (compteurs par tranche, somme, nombre)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, n + 1)
+
+    def _samples(self, worker: str) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((k, (list(c), t, n)) for k, (c, t, n) in self._values.items())
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, worker, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key, worker)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key, worker)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, List[str]]:
+        """Échantillons de ce worker, par métrique (à publier pour les autres workers)."""
+        worker = worker_label()
+        return {m.name: m._samples(worker) for m in self._metrics}
+
+    def render(self, snapshots: Optional[List[Dict[str, List[str]]]] = None) -> str:
+        """Texte Prometheus de ce worker, ou des instantanés de plusieurs workers."""
+        if snapshots is None:
+            snapshots = [self.snapshot()]
+        blocks = []
+        for m in self._metrics:
+            lines = m.header()
+            for snapshot in snapshots:
+                lines.extend(snapshot.get(m.name, []))
+            blocks.append("\n".join(lines))
+        return "\n".join(blocks) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rapport_stage_seconds", "Durée de chaque étape de génération du document", ["stage"],
+))
+GENERATION_ITEMS = REGISTRY.register(Counter(
+    "rapport_generation_items_total",
+    "Éléments traités par les générations (paragraphes visités, remplacements, images, octets écrits)",
+    ["item"],
+))
+OUTPUT_BYTES = REGISTRY.register(Histogram(
+    "rapport_output_bytes", "Taille des documents générés",
+    buckets=(64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6, 50e6),
+))
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rapport_request_seconds", "Latence des requêtes HTTP par route", ["method", "route", "status"],
+))
+DOC_LOCK_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "rapport_doc_lock_wait_seconds", "Attente du verrou des documents avant génération/aperçu",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+))
+DOC_LOCK_WAITERS = REGISTRY.register(Gauge(
+    "rapport_doc_lock_waiters", "Requêtes en file d'attente sur le verrou des documents",
+))
+GENERATION_CACHE = REGISTRY.register(Counter(
+    "rapport_generation_cache_total",
+    "Résultat de la recherche dans le cache de génération (disk, memory, miss)", ["result"],
+))
+UPLOADS = REGISTRY.register(Counter(
+    "rapport_uploads_total", "Uploads reçus (stored = écrit, duplicate = contenu déjà stocké)", ["result"],
+))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "rapport_upload_bytes_total", "Octets reçus par /upload",
+))
+IMAGE_NORMALIZE_SECONDS = REGISTRY.register(Histogram(
+    "rapport_image_normalize_seconds", "Durée de normalisation d'une image à l'upload (conversion HEIC incluse)",
+    ["format"],
+))
+
+PDF_CONVERSION_SECONDS = REGISTRY.register(Histogram(
+    "rapport_pdf_conversion_seconds", "Durée d'une conversion PDF par LibreOffice",
+    buckets=(0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+))
+PDF_EXPORTS = REGISTRY.register(Counter(
+    "rapport_pdf_exports_total",
+    "Demandes de PDF (cached, converted, timeout, error, rejected = file d'attente pleine)", ["result"],
+))
+
+
+def record_stage_report(report: Dict) -> None:
+    """Ajoute le rapport d'un StageTimer aux histogrammes agrégés."""
+    for stage in report["stages"]:
+        STAGE_SECONDS.observe(stage["seconds"], stage=stage["stage"])
+    for item, value in report["counts"].items():
+        GENERATION_ITEMS.inc(value, item=item)
+    if "bytes_written" in report["counts"]:
+        OUTPUT_BYTES.observe(report["counts"]["bytes_written"])
@@ -0,0 +1,285 @@
+"""
+Export PDF par LibreOffice headless, avec des processus gardés au chaud.
+
+PdfConverter gère un pool de `workers` soffice résidents, chacun avec son propre
+profil utilisateur (deux soffice ne peuvent pas partager un profil). Chaque soffice
+écoute sur un port local et reçoit les conversions par UNO : LibreOffice ne démarre
+pas à chaque document. Le module `uno` n'est en général pas importable depuis
+l'environnement de l'application (virtualenv) : les appels UNO passent par
+pdf_uno_helper.py, lancé une fois par soffice sous un Python qui l'importe (celui
+de LibreOffice, python3 avec python3-uno, ou RAPPORT_UNO_PYTHON). Sans un tel
+Python, PdfConverter refuse de démarrer (PdfError) plutôt que de lancer un
+soffice par conversion.
+
+- file d'attente : au plus `max_pending` conversions en cours ou en attente d'un
+  processus libre ; au-delà, PdfQueueFull ;
+- délai : une conversion qui dépasse `timeout` tue son processus (relancé à la
+  conversion suivante) et lève PdfTimeout ;
+- cache : les PDF sont gardés en mémoire par empreinte du document Word ; des
+  demandes simultanées pour le même document partagent une seule conversion.
+"""
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from generation_cache import GenerationCache
+from metrics import PDF_CONVERSION_SECONDS, PDF_EXPORTS
+
+DEFAULT_TIMEOUT_SECONDS = 60.0
+DEFAULT_MAX_PENDING = 8
+START_TIMEOUT_SECONDS = 30.0
+MAX_CACHED_PDFS = 32
+MAX_CACHED_PDF_BYTES = 128 * 1024 * 1024
+HELPER_SCRIPT = Path(__file__).with_name("pdf_uno_helper.py")
+
+logger = logging.getLogger(__name__)
+
+
+class PdfError(RuntimeError):
+    pass
+
+
+class PdfTimeout(PdfError):
+    pass
+
+
+class PdfQueueFull(PdfError):
+    pass
+
+
+def find_soffice(configured: Optional[str] = None) -> Optional[str]:
+    """Chemin de l'exécutable LibreOffice (`configured`, sinon soffice ou libreoffice dans le PATH)."""
+    for candidate in (configured, "soffice", "libreoffice"):
+        if candidate:
+            path = shutil.which(candidate)
+            if path:
+                return path
+    return None
+
+
+def find_uno_python(soffice: str, configured: Optional[str] = None) -> Optional[str]:
+    """Interpréteur capable d'importer `uno` : `configured`, celui de l'application,
+    celui livré avec LibreOffice (à côté de soffice), sinon python3 du système."""
+    program_dir = Path(os.path.realpath(soffice)).parent
+    candidates = [configured, sys.executable,
+                  str(program_dir / "python.exe"), str(program_dir / "python"),
+                  str(program_dir.parent / "Resources" / "python"),  # macOS
+                  shutil.which("python3")]
+    for candidate in candidates:
+        if not candidate or not (Path(candidate).is_file() or shutil.which(candidate)):
+            continue
+        try:
+            subprocess.run([candidate, "-c", "import uno"], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=START_TIMEOUT_SECONDS, check=True)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        return candidate
+    return None
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _Office:
+    """Un soffice headless, son profil et son pilote UNO ; relancés après un échec ou un dépassement de délai."""
+
+    def __init__(self, soffice: str, uno_python: str, profile_dir: Path):
+        self.soffice = soffice
+        self.uno_python = uno_python
+        self.profile_dir = profile_dir
+        self.process: Optional[subprocess.Popen] = None
+        self.helper: Optional[subprocess.Popen] = None
+        self._replies: "queue.Queue[Optional[dict]]" = queue.Queue()
+
+    def _alive(self) -> bool:
+        return (self.process is not None and self.process.poll() is None
+                and self.helper is not None and self.helper.poll() is None)
+
+    def start(self) -> None:
+        if self._alive():
+            return
+        self.stop()
+        port = _free_port()
+        try:
+            self.process = subprocess.Popen(
+                [self.soffice, f"-env:UserInstallation={self.profile_dir.as_uri()}", "--headless", "--invisible",
+                 "--nologo", "--norestore", "--nolockcheck", "--nodefault",
+                 f"--accept=socket,host=127.0.0.1,port={port};urp;"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            self.helper = subprocess.Popen(
+                [self.uno_python, str(HELPER_SCRIPT), str(port)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                text=True, encoding="utf-8", bufsize=1,
+            )
+        except OSError as e:
+            self.stop()
+            raise PdfError(f"LibreOffice n'a pas démarré: {e}") from e
+        # Lecture des réponses par un thread : une attente avec délai marche aussi sous Windows
+        self._replies = queue.Queue()
+        threading.Thread(target=self._read_replies, args=(self.helper.stdout, self._replies),
+                         daemon=True).start()
+        reply = self._reply(START_TIMEOUT_SECONDS)
+        if reply is None or not reply.get("ready"):
+            self.stop()
+            raise PdfError(f"LibreOffice n'a pas démarré: {(reply or {}).get('error', 'pilote UNO arrêté')}")
+        logger.info("LibreOffice démarré (pid %s, port %s)", self.process.pid, port)
+
+    @staticmethod
+    def _read_replies(stream, replies: "queue.Queue[Optional[dict]]") -> None:
+        for line in stream:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                replies.put({"error": line.strip()})
+        replies.put(None)  # pilote arrêté
+
+    def _reply(self, timeout: float) -> Optional[dict]:
+        try:
+            return self._replies.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise PdfTimeout(f"LibreOffice n'a pas répondu en {timeout:.0f} s")
+
+    def stop(self) -> None:
+        for attr in ("helper", "process"):
+            process = getattr(self, attr)
+            setattr(self, attr, None)
+            if process is not None and process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def close(self) -> None:
+        if self._alive():
+            try:
+                self.helper.stdin.write(json.dumps({"quit": True}) + "\n")
+                self.helper.stdin.flush()
+                self.helper.wait(timeout=5)
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                pass  # tués ci-dessous
+        self.stop()
+
+    def convert(self, src: Path, dst: Path, timeout: float) -> None:
+        self.start()
+        try:
+            self.helper.stdin.write(json.dumps({"src": str(src.resolve()), "dst": str(dst.resolve())}) + "\n")
+            self.helper.stdin.flush()
+        except OSError as e:
+            self.stop()
+            raise PdfError(f"Pilote UNO arrêté: {e}") from e
+        # Une conversion bloquée ne s'interrompt qu'en tuant LibreOffice (fait par _reply)
+        try:
+            reply = self._reply(timeout)
+        except PdfTimeout:
+            raise PdfTimeout(f"Conversion PDF interrompue après {timeout:.0f} s") from None
+        if reply is None:
+            self.stop()
+            raise PdfError("LibreOffice s'est arrêté pendant la conversion")
+        if "error" in reply:
+            raise PdfError(f"Conversion PDF impossible: {reply['error']}")
+        if not dst.exists():
+            raise PdfError("LibreOffice n'a produit aucun PDF")
+
+
+class PdfConverter:
+    def __init__(self, soffice: str, workers: int = 2, timeout: float = DEFAULT_TIMEOUT_SECONDS,
+                 max_pending: int = DEFAULT_MAX_PENDING, cache: Optional[GenerationCache] = None,
+                 uno_python: Optional[str] = None):
+        found = find_uno_python(soffice, uno_python)
+        if found is None:
+            raise PdfError("Aucun Python capable d'importer uno (python3-uno, ou le Python de LibreOffice "
+                           "via RAPPORT_UNO_PYTHON) : export PDF désactivé")
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.cache = cache if cache is not None else GenerationCache(MAX_CACHED_PDFS, MAX_CACHED_PDF_BYTES)
+        self._workdir = Path(tempfile.mkdtemp(prefix="rapport-pdf-"))
+        self._offices = [_Office(soffice, found, self._workdir / f"profil{i}") for i in range(max(workers, 1))]
+        self._idle: "queue.Queue[_Office]" = queue.Queue()
+        for office in self._offices:
+            self._idle.put(office)
+        self._inflight: Dict[str, Future] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        """Démarre les processus et leurs pilotes UNO avant la première conversion."""
+        for office in self._offices:
+            try:
+                office.start()
+            except (OSError, subprocess.SubprocessError, PdfError):
+                logger.exception("Démarrage de LibreOffice impossible")
+
+    def cached(self, key: str) -> Optional[bytes]:
+        """PDF déjà converti pour le document d'empreinte `key`, ou None."""
+        data = self.cache.get(key)
+        if data is not None:
+            PDF_EXPORTS.inc(result="cached")
+        return data
+
+    def convert(self, key: str, source: Callable[[], bytes]) -> bytes:
+        """PDF du document d'empreinte `key` ; `source` (octets du .docx) n'est lu que s'il faut convertir."""
+        data = self.cached(key)
+        if data is not None:
+            return data
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                if self._pending >= self.max_pending:
+                    PDF_EXPORTS.inc(result="rejected")
+                    raise PdfQueueFull("Trop de conversions PDF en attente")
+                future = Future()
+                self._inflight[key] = future
+                self._pending += 1
+        if not owner:
+            return future.result()
+        try:
+            data = self._convert(source())
+        except BaseException as e:
+            PDF_EXPORTS.inc(result="timeout" if isinstance(e, PdfTimeout) else "error")
+            future.set_exception(e)
+            raise
+        else:
+            PDF_EXPORTS.inc(result="converted")
+            self.cache.put(key, data)
+            future.set_result(data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._pending -= 1
+
+    def _convert(self, docx: bytes) -> bytes:
+        office = self._idle.get()
+        try:
+            # Copie privée : le fichier de sortie peut être régénéré pendant la conversion
+            with tempfile.TemporaryDirectory(dir=self._workdir) as tmp:
+                src = Path(tmp) / "document.docx"
+                src.write_bytes(docx)
+                dst = Path(tmp) / "document.pdf"
+                start = time.perf_counter()
+                office.convert(src, dst, self.timeout)
+                PDF_CONVERSION_SECONDS.observe(time.perf_counter() - start)
+                return dst.read_bytes()
+        finally:
+            self._idle.put(office)
+
+    def close(self) -> None:
+        for office in self._offices:
+            office.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
@@ -0,0 +1,95 @@
+"""
+Pilote UNO d'un soffice résident, lancé par pdf_export sous un Python qui
+importe `uno` (le Python livré avec LibreOffice, ou python3 avec python3-uno).
+
+    <python-uno> pdf_uno_helper.py <port>
+
+Se connecte au soffice qui écoute sur 127.0.0.1:<port>, puis lit sur stdin une
+demande JSON par ligne et répond sur stdout, une ligne JSON par demande :
+    {"src": "/tmp/.../document.docx", "dst": "/tmp/.../document.pdf"} -> {"ok": true} | {"error": "..."}
+    {"quit": true}  -> ferme LibreOffice et s'arrête
+La première ligne écrite est {"ready": true} (ou {"error": ...} si la connexion échoue).
+
+Autonome : n'importe rien du projet (l'interpréteur n'est pas celui de l'application).
+"""
+import json
+import sys
+import time
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+CONNECT_TIMEOUT_SECONDS = 30.0
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+def connect(port):
+    local = uno.getComponentContext()
+    resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+    deadline = time.monotonic() + CONNECT_TIMEOUT_SECONDS
+    while True:
+        try:
+            context = resolver.resolve(
+                "uno:socket,host=127.0.0.1,port=%d;urp;StarOffice.ComponentContext" % port)
+            break
+        except NoConnectException:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+
+def convert(desktop, src, dst):
+    document = desktop.loadComponentFromURL(
+        uno.systemPathToFileUrl(src), "_blank", 0,
+        (_property("Hidden", True), _property("ReadOnly", True)),
+    )
+    if document is None:
+        raise RuntimeError("document illisible par LibreOffice")
+    try:
+        document.storeToURL(uno.systemPathToFileUrl(dst), (_property("FilterName", "writer_pdf_Export"),))
+    finally:
+        document.close(True)
+
+
+def main():
+    # stdout est réservé au protocole : toute autre sortie part sur stderr
+    out = sys.stdout
+    sys.stdout = sys.stderr
+
+    def reply(message):
+        out.write(json.dumps(message) + "\n")
+        out.flush()
+
+    try:
+        desktop = connect(int(sys.argv[1]))
+    except Exception as e:
+        reply({"error": "connexion à LibreOffice impossible: %s" % e})
+        return 1
+    reply({"ready": True})
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request.get("quit"):
+            try:
+                desktop.terminate()
+            except Exception:
+                pass  # le processus est tué par pdf_export s'il ne s'arrête pas
+            return 0
+        try:
+            convert(desktop, request["src"], request["dst"])
+        except Exception as e:
+            reply({"error": str(e) or type(e).__name__})
+        else:
+            reply({"ok": True})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
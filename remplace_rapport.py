@@ -1,17 +1,36 @@
 ﻿import argparse
+import io
+import logging
+import os
 import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Union
 from docx import Document
 from docx.oxml import OxmlElement
 from docx.table import Table
 from docx.text.paragraph import Paragraph
 from docx.shared import Inches
 
+from docx_writer import DEFAULT_COMPRESSLEVEL, document_parts_to_rewrite, save_document
+from image_pipeline import normalize_image
+from logging_setup import configure_logging
+from stage_timer import StageTimer
+
+logger = logging.getLogger(__name__)
+
 PLACEHOLDER_PATTERN = re.compile(r"\{[^{}]+\}")
 DEFAULT_ANALYSIS_TEMPLATE = ""
 BACK_TOKEN = "__BACK__"
 IMAGE_MARKER = re.compile(r"\[\[\s*IMG\s*:\s*([^\]]+?)\s*\]\]")
+# Au-delà de cette taille (word/document.xml décompressé), génération en flux (stream_rewrite)
+STREAMING_THRESHOLD_BYTES = 16 * 1024 * 1024
+# Préparation des images en parallèle du traitement du texte (Pillow libère le GIL)
+IMAGE_WORKERS = min(8, os.cpu_count() or 1)
+
+_image_executor: Optional[ThreadPoolExecutor] = None
+_image_executor_lock = threading.Lock()
 
 
 def remove_paragraph(paragraph):
@@ -106,7 +125,7 @@ def is_in_table_cell(paragraph):
     return False
 
 
-def replace_in_runs(paragraph, mapping, allow_delete=True):
+def replace_in_runs(paragraph, mapping, allow_delete=True, timer: Optional[StageTimer] = None):
     """Remplace placeholders coupes en runs. Valeur vide -> supprime le paragraphe entier (sauf dans les cellules de tableau)."""
     if not mapping:
         return False
@@ -130,12 +149,16 @@ def replace_in_runs(paragraph, mapping, allow_delete=True):
 
     if remove_entire:
         remove_paragraph(paragraph)
+        if timer:
+            timer.count("paragraphs_removed")
         return True
     if new_text == original:
         return False
     for run in list(paragraph.runs):
         run.text = ""
     paragraph.add_run(new_text)
+    if timer:
+        timer.count("replacements")
     return False
 
 
@@ -181,51 +204,57 @@ def remove_empty_paragraphs(doc):
                 remove_paragraph(p)
 
 
+def sim_placeholders(index: int) -> List[str]:
+    """Placeholders d'une carte SIM : un tableau SIM est gardé si l'un d'eux est rempli."""
+    return [f"{{operateur{index}}}", f"{{iccid{index}}}", f"{{imsi{index}}}", f"{{msisdn{index}}}",
+            f"{{datesync{index}}}"]
+
+
+def sim_table_state(table, mapping, table_idx: int = 0):
+    """(numéro de la carte SIM du tableau ou None, au moins une valeur remplie pour cette carte)."""
+    debug = logger.isEnabledFor(logging.DEBUG)
+    for row in table.rows:
+        row_text = "".join(cell.text for cell in row.cells)
+        # Chercher des placeholders SIM indexés (operateur/iccid/imsi/msisdn/datesync)
+        for i in range(1, 9):
+            sim_keys = sim_placeholders(i)
+            if any(key in row_text for key in sim_keys):
+                if debug:
+                    logger.debug("Tableau %d identifié comme SIM %d, contient: %s",
+                                 table_idx, i, [k for k in sim_keys if k in row_text])
+                # Vérifier si AU MOINS UNE valeur est remplie dans le mapping pour cette carte SIM
+                for key in sim_keys:
+                    value = mapping.get(key, "").strip()
+                    logger.debug("  Vérification %s -> %r", key, value)
+                    if value:
+                        logger.debug("  => Valeur trouvée pour %s", key)
+                        return i, True
+                return i, False
+    return None, False
+
+
 def remove_empty_sim_tables(doc, mapping):
     """Supprime les tableaux SIM dont tous les placeholders sont vides."""
     tables_to_remove = []
 
-    print(f"[DEBUG remove_empty_sim_tables] Nombre de tableaux dans le document: {len(doc.tables)}")
-    print(f"[DEBUG remove_empty_sim_tables] Clés SIM dans le mapping:")
-    for i in range(1, 9):
-        sim_keys = [f"{{operateur{i}}}", f"{{iccid{i}}}", f"{{imsi{i}}}", f"{{msisdn{i}}}", f"{{datesync{i}}}"]
-        for key in sim_keys:
-            if key in mapping:
-                print(f"  {key} = '{mapping[key]}'")
+    if logger.isEnabledFor(logging.DEBUG):
+        sim_values = {}
+        for i in range(1, 9):
+            for key in (f"{{operateur{i}}}", f"{{iccid{i}}}", f"{{imsi{i}}}", f"{{msisdn{i}}}", f"{{datesync{i}}}"):
+                if key in mapping:
+                    sim_values[key] = mapping[key]
+        logger.debug("remove_empty_sim_tables: %d tableau(x), clés SIM: %s", len(doc.tables), sim_values)
 
     for table_idx, table in enumerate(doc.tables):
-        # Vérifier si c'est un tableau SIM (a une ligne avec des placeholders operateur/iccid/imsi/msisdn/datesync)
-        is_sim_table = False
-        sim_index = None
-        has_at_least_one_value = False
-
-        for row in table.rows:
-            row_text = "".join(cell.text for cell in row.cells)
-            # Chercher des placeholders SIM indexés
-            for i in range(1, 9):
-                sim_keys = [f"{{operateur{i}}}", f"{{iccid{i}}}", f"{{imsi{i}}}", f"{{msisdn{i}}}", f"{{datesync{i}}}"]
-                if any(key in row_text for key in sim_keys):
-                    is_sim_table = True
-                    sim_index = i
-                    print(f"[DEBUG] Tableau {table_idx} identifié comme SIM {i}, row_text contient: {[k for k in sim_keys if k in row_text]}")
-                    # Vérifier si AU MOINS UNE valeur est remplie dans le mapping pour cette carte SIM
-                    for key in sim_keys:
-                        value = mapping.get(key, "").strip()
-                        print(f"[DEBUG]   Vérification {key} -> '{value}'")
-                        if value:
-                            has_at_least_one_value = True
-                            print(f"[DEBUG]   => Valeur trouvée pour {key}!")
-                            break
-                    break
-            if is_sim_table:
-                break
+        sim_index, has_at_least_one_value = sim_table_state(table, mapping, table_idx)
+        is_sim_table = sim_index is not None
 
         # Ne supprimer que si c'est un tableau SIM ET qu'aucune valeur n'est remplie
         if is_sim_table and not has_at_least_one_value:
-            print(f"[DEBUG] Suppression du tableau SIM {sim_index} - aucune valeur remplie")
+            logger.debug("Suppression du tableau SIM %d - aucune valeur remplie", sim_index)
             tables_to_remove.append(table)
         elif is_sim_table:
-            print(f"[DEBUG] Conservation du tableau SIM {sim_index} - au moins une valeur remplie")
+            logger.debug("Conservation du tableau SIM %d - au moins une valeur remplie", sim_index)
 
     # Supprimer les tableaux marqués
     for table in tables_to_remove:
@@ -331,16 +360,115 @@ def apply_heading_decisions(doc, decisions):
         idx += 1
 
 
+def referenced_images(heading_content: Optional[Dict[str, List[Dict]]] = None,
+                      images_at_markers: Optional[Dict[str, str]] = None) -> List[str]:
+    """Chemins des images placees par les blocs de contenu et les marqueurs."""
+    paths = [block.get("src") for blocks in (heading_content or {}).values() for block in blocks
+             if block.get("type") == "image" and block.get("src")]
+    paths.extend(path for path in (images_at_markers or {}).values() if path)
+    return paths
+
+
+def prepare_image(path: Path) -> bytes:
+    """Lit et controle l'image ; orientation appliquee et resolution plafonnee si besoin.
+
+    Une image deja normalisee a l'upload est rendue octet pour octet.
+    """
+    return normalize_image(path.read_bytes(), path.name).data
+
+
+def _image_pool() -> ThreadPoolExecutor:
+    global _image_executor
+    with _image_executor_lock:
+        if _image_executor is None:
+            _image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="images")
+        return _image_executor
+
+
+def prestart_threads(executor: ThreadPoolExecutor, count: int) -> None:
+    """Démarre tout de suite `count` threads du pool (au plus sa taille), sinon créés à la demande.
+
+    Les tâches s'attendent les unes les autres : le pool ne peut pas les servir avec
+    un thread déjà libre et en crée un par tâche.
+    """
+    barrier = threading.Barrier(count)
+
+    def wait():
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+
+    for future in [executor.submit(wait) for _ in range(count)]:
+        future.result()
+
+
+def warm_image_pool() -> None:
+    prestart_threads(_image_pool(), IMAGE_WORKERS)
+
+
+def start_image_preparation(paths: Iterable[str]) -> Dict[str, Union[bytes, Future]]:
+    """Lance la preparation des images en arriere-plan ; le dict se passe ensuite comme `image_cache`.
+
+    Les images sont lues, decodees et reduites en parallele pendant que le texte est
+    traite ; l'insertion n'attend que celles qui ne sont pas encore pretes.
+    """
+    image_cache: Dict[str, Union[bytes, Future]] = {}
+    for path in paths:
+        key = str(Path(path).resolve())
+        if key not in image_cache and Path(key).is_file():
+            image_cache[key] = _image_pool().submit(prepare_image, Path(key))
+    return image_cache
+
+
+def read_image(image_path, image_cache: Optional[Dict[str, Union[bytes, Future]]] = None) -> io.BytesIO:
+    """Lit l'image une seule fois par generation, meme si elle est placee plusieurs fois.
+
+    python-docx ne cree qu'une partie image par contenu (empreinte SHA-1) : une photo
+    placee a un marqueur et dans un bloc de titre n'est embarquee qu'une fois.
+    """
+    key = str(Path(image_path).resolve())
+    if image_cache is None:
+        return io.BytesIO(Path(key).read_bytes())
+    data = image_cache.get(key)
+    if isinstance(data, Future):
+        # Une image illisible leve ici, comme le ferait add_picture
+        data = data.result()
+        image_cache[key] = data
+    elif data is None:
+        data = Path(key).read_bytes()
+        image_cache[key] = data
+    return io.BytesIO(data)
+
+
 def default_heading_decisions(headings: List[Paragraph], mapping: Dict[str, str]) -> List[str]:
     """Genere une phrase par defaut sous chaque titre (non interactif)."""
     return [fill_with_mapping(DEFAULT_ANALYSIS_TEMPLATE, mapping) for _ in headings]
 
-def insert_image_after(paragraph: Paragraph, image_path: str, width_inches: float = 3.0, text_before: str = "", text_after: str = ""):
+
+def resolve_heading_decisions(headings: List, mapping: Dict[str, str],
+                              choices: Optional[List[Optional[str]]] = None) -> List[str]:
+    """Decisions finales a partir des choix fournis (API, fichier de valeurs).
+
+    "__DEFAULT__" (ou choix absent) => phrase auto, "__KEEP_TITLE_ONLY__" => garder le
+    titre sans phrase, "" => supprimer, autre => texte personnalise.
+    """
+    defaults = default_heading_decisions(headings, mapping)
+    if choices is None:
+        return defaults
+    resolved = []
+    for idx in range(len(headings)):
+        choice = choices[idx] if idx < len(choices) else "__DEFAULT__"
+        resolved.append(defaults[idx] if choice is None or choice == "__DEFAULT__" else choice)
+    return resolved
+
+def insert_image_after(paragraph: Paragraph, image_path: str, width_inches: float = 3.0, text_before: str = "", text_after: str = "",
+                       image_cache: Optional[Dict[str, bytes]] = None):
     """Insere une image juste apres le paragraphe donne, avec optionnellement du texte avant/après."""
     # Vérifier que le fichier image existe
     img_path = Path(image_path)
     if not img_path.exists():
-        print(f"ATTENTION: Image introuvable: {image_path}")
+        logger.warning("Image introuvable: %s", image_path)
         return
 
     if text_before:
@@ -349,9 +477,9 @@ def insert_image_after(paragraph: Paragraph, image_path: str, width_inches: floa
     new_p = insert_after(paragraph, "")
     run = new_p.add_run()
     try:
-        run.add_picture(str(img_path), width=Inches(width_inches))
+        run.add_picture(read_image(img_path, image_cache), width=Inches(width_inches))
     except Exception as e:
-        print(f"ERREUR lors de l'insertion de l'image {image_path}: {e}")
+        logger.error("Erreur lors de l'insertion de l'image %s: %s", image_path, e)
         return
     if text_after:
         insert_after(new_p, text_after)
@@ -415,52 +543,62 @@ def apply_images_after_paragraphs(doc: Document, images_after: Dict[str, str], w
 
 def apply_images_at_markers(doc: Document, images_at_markers: Dict[str, str], width_inches: float = 3.0,
                             per_image_widths: Optional[Dict[str, float]] = None,
-                            image_texts: Optional[Dict[str, Dict[str, str]]] = None):
+                            image_texts: Optional[Dict[str, Dict[str, str]]] = None,
+                            image_cache: Optional[Dict[str, bytes]] = None):
     """Remplace les marqueurs [[IMG:cle]] par l'image correspondante inseree a cet endroit."""
     if not images_at_markers:
         return
     for p in iter_all_paragraphs(doc):
-        full_text = "".join(run.text for run in p.runs)
-        if "[[IMG" not in full_text:
-            continue
-        parts = IMAGE_MARKER.split(full_text)  # [texte, cle, texte, cle, ...]
-        for run in list(p.runs):
-            run.text = ""
-        for idx, chunk in enumerate(parts):
-            if idx % 2 == 0:
-                if chunk:
-                    p.add_run(chunk)
-            else:
-                key = chunk.strip()
-                img_path = images_at_markers.get(key)
-                if img_path:
-                    # Vérifier que le fichier existe
-                    img_file = Path(img_path)
-                    if not img_file.exists():
-                        print(f"ATTENTION: Image introuvable pour le marqueur '{key}': {img_path}")
-                        p.add_run(f"[[IMG:{key} - INTROUVABLE]]")
-                        continue
+        replace_image_markers(p, images_at_markers, width_inches, per_image_widths, image_texts, image_cache)
 
-                    text_data = image_texts.get(key, {}) if image_texts else {}
-                    # Add text before image
-                    if text_data.get("position") == "before" and text_data.get("before"):
-                        p.add_run(text_data["before"] + " ")
-                    # Add image
-                    try:
-                        w = per_image_widths.get(key) if per_image_widths else None
-                        p.add_run().add_picture(str(img_file), width=Inches(w or width_inches))
-                    except Exception as e:
-                        print(f"ERREUR lors de l'insertion de l'image pour le marqueur '{key}': {e}")
-                        p.add_run(f"[[IMG:{key} - ERREUR]]")
-                        continue
-                    # Add text after image
-                    if text_data.get("position") == "after" and text_data.get("after"):
-                        p.add_run(" " + text_data["after"])
-                else:
-                    p.add_run(f"[[IMG:{key}]]")
 
+def replace_image_markers(p: Paragraph, images_at_markers: Dict[str, str], width_inches: float = 3.0,
+                          per_image_widths: Optional[Dict[str, float]] = None,
+                          image_texts: Optional[Dict[str, Dict[str, str]]] = None,
+                          image_cache: Optional[Dict[str, bytes]] = None):
+    """Remplace les marqueurs [[IMG:cle]] d'un paragraphe."""
+    full_text = "".join(run.text for run in p.runs)
+    if "[[IMG" not in full_text:
+        return
+    parts = IMAGE_MARKER.split(full_text)  # [texte, cle, texte, cle, ...]
+    for run in list(p.runs):
+        run.text = ""
+    for idx, chunk in enumerate(parts):
+        if idx % 2 == 0:
+            if chunk:
+                p.add_run(chunk)
+        else:
+            key = chunk.strip()
+            img_path = images_at_markers.get(key)
+            if img_path:
+                # Vérifier que le fichier existe
+                img_file = Path(img_path)
+                if not img_file.exists():
+                    logger.warning("Image introuvable pour le marqueur '%s': %s", key, img_path)
+                    p.add_run(f"[[IMG:{key} - INTROUVABLE]]")
+                    continue
+
+                text_data = image_texts.get(key, {}) if image_texts else {}
+                # Add text before image
+                if text_data.get("position") == "before" and text_data.get("before"):
+                    p.add_run(text_data["before"] + " ")
+                # Add image
+                try:
+                    w = per_image_widths.get(key) if per_image_widths else None
+                    p.add_run().add_picture(read_image(img_file, image_cache), width=Inches(w or width_inches))
+                except Exception as e:
+                    logger.error("Erreur lors de l'insertion de l'image pour le marqueur '%s': %s", key, e)
+                    p.add_run(f"[[IMG:{key} - ERREUR]]")
+                    continue
+                # Add text after image
+                if text_data.get("position") == "after" and text_data.get("after"):
+                    p.add_run(" " + text_data["after"])
+            else:
+                p.add_run(f"[[IMG:{key}]]")
 
-def apply_heading_content_blocks(doc: Document, heading_content: Dict[str, List[Dict]], default_width_inches: float = 3.0):
+
+def apply_heading_content_blocks(doc: Document, heading_content: Dict[str, List[Dict]], default_width_inches: float = 3.0,
+                                 image_cache: Optional[Dict[str, bytes]] = None):
     """Insere les blocs de contenu (texte/images) apres chaque heading specifie."""
     if not heading_content:
         return
@@ -481,31 +619,119 @@ def apply_heading_content_blocks(doc: Document, heading_content: Dict[str, List[
                 if not is_heading(next_para):
                     target_para = next_para
 
-            # Inserer chaque bloc dans l'ordre
-            current_para = target_para
-            for block in blocks:
-                if block.get("type") == "text":
-                    content = block.get("content", "")
-                    if content:
-                        new_para = insert_after(current_para, content)
-                        current_para = new_para
-                elif block.get("type") == "image":
-                    src = block.get("src", "")
-                    if src:
-                        width = block.get("width") or default_width_inches
-                        img_path = Path(src)
-                        if not img_path.exists():
-                            print(f"ATTENTION: Image introuvable: {src}")
-                            continue
-
-                        # Creer un nouveau paragraphe pour l'image
-                        new_para = insert_after(current_para, "")
-                        run = new_para.add_run()
-                        try:
-                            run.add_picture(str(img_path), width=Inches(width))
-                            current_para = new_para
-                        except Exception as e:
-                            print(f"ERREUR lors de l'insertion de l'image {src}: {e}")
+            insert_content_blocks(target_para, blocks, default_width_inches, image_cache)
+
+
+def insert_content_blocks(target_para: Paragraph, blocks: List[Dict], default_width_inches: float = 3.0,
+                          image_cache: Optional[Dict[str, bytes]] = None):
+    """Insere les blocs (texte/images) dans l'ordre, juste apres `target_para`."""
+    current_para = target_para
+    for block in blocks:
+        if block.get("type") == "text":
+            content = block.get("content", "")
+            if content:
+                new_para = insert_after(current_para, content)
+                current_para = new_para
+        elif block.get("type") == "image":
+            src = block.get("src", "")
+            if src:
+                width = block.get("width") or default_width_inches
+                img_path = Path(src)
+                if not img_path.exists():
+                    logger.warning("Image introuvable: %s", src)
+                    continue
+
+                # Creer un nouveau paragraphe pour l'image
+                new_para = insert_after(current_para, "")
+                run = new_para.add_run()
+                try:
+                    run.add_picture(read_image(img_path, image_cache), width=Inches(width))
+                    current_para = new_para
+                except Exception as e:
+                    logger.error("Erreur lors de l'insertion de l'image %s: %s", src, e)
+
+
+def replace_in_headers(headers, mapping: Dict[str, str], timer: Optional[StageTimer] = None):
+    """Remplace les placeholders des en-têtes (paragraphes et tableaux)."""
+    for header in headers:
+        # Paragraphes dans l'en-tête
+        for p in header.paragraphs:
+            if timer:
+                timer.count("paragraphs_visited")
+            replace_in_runs(p, mapping, timer=timer)
+        # Tableaux dans l'en-tête
+        for table in header.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for p in cell.paragraphs:
+                        if timer:
+                            timer.count("paragraphs_visited")
+                        replace_in_runs(p, mapping, timer=timer)
+
+
+def apply_mapping(doc, mapping: Dict[str, str], timer: Optional[StageTimer] = None):
+    """Etape placeholders : en-tetes, tableaux SIM vides, corps, paragraphes vides."""
+    timer = timer or StageTimer()
+
+    # Remplacer dans les en-têtes
+    with timer.stage("header_replacement"):
+        replace_in_headers([section.header for section in doc.sections], mapping, timer=timer)
+    apply_body_mapping(doc, mapping, timer=timer)
+
+
+def apply_body_mapping(doc, mapping: Dict[str, str], timer: Optional[StageTimer] = None):
+    """Etape placeholders, corps seul : tableaux SIM vides, remplacement, paragraphes vides."""
+    timer = timer or StageTimer()
+
+    # Supprimer les tableaux SIM vides AVANT le remplacement des placeholders
+    with timer.stage("remove_empty_sim_tables"):
+        remove_empty_sim_tables(doc, mapping)
+
+    # Remplacer dans le corps du document
+    with timer.stage("body_replacement"):
+        for p in list(iter_all_paragraphs(doc)):
+            timer.count("paragraphs_visited")
+            removed = replace_in_runs(p, mapping, timer=timer)
+            if removed:
+                continue
+    with timer.stage("remove_empty_paragraphs"):
+        remove_empty_paragraphs(doc)
+
+
+def count_images(doc) -> int:
+    return len(doc.element.body.xpath(".//w:drawing"))
+
+
+def apply_content(doc, heading_content: Optional[Dict[str, List[Dict]]] = None,
+                  images_at_markers: Optional[Dict[str, str]] = None,
+                  image_width_inches: float = 3.0,
+                  images_at_markers_sizes: Optional[Dict[str, float]] = None,
+                  timer: Optional[StageTimer] = None,
+                  image_cache: Optional[Dict[str, Union[bytes, Future]]] = None):
+    """Etape contenu : blocs texte/images sous les titres puis images sur les marqueurs.
+
+    `image_cache` : images deja en preparation (start_image_preparation), sinon lues ici.
+    """
+    timer = timer or StageTimer()
+    # Une meme image placee plusieurs fois n'est lue qu'une fois
+    if image_cache is None:
+        image_cache = start_image_preparation(referenced_images(heading_content, images_at_markers))
+    images_before = count_images(doc) if (heading_content or images_at_markers) else 0
+
+    # Insertion des blocs de contenu (texte + images) après les headings
+    if heading_content:
+        with timer.stage("content_blocks"):
+            apply_heading_content_blocks(doc, heading_content, default_width_inches=image_width_inches,
+                                         image_cache=image_cache)
+
+    # Insertion d'images sur les marqueurs
+    if images_at_markers:
+        with timer.stage("markers"):
+            apply_images_at_markers(doc, images_at_markers, width_inches=image_width_inches,
+                                    per_image_widths=images_at_markers_sizes, image_cache=image_cache)
+
+    if heading_content or images_at_markers:
+        timer.count("images_embedded", count_images(doc) - images_before)
 
 
 def process_document(input_path, output_path, mapping_override: Optional[Dict[str, str]] = None,
@@ -513,13 +739,37 @@ def process_document(input_path, output_path, mapping_override: Optional[Dict[st
                      heading_content: Optional[Dict[str, List[Dict]]] = None,
                      images_at_markers: Optional[Dict[str, str]] = None,
                      image_width_inches: float = 3.0,
-                     images_at_markers_sizes: Optional[Dict[str, float]] = None):
+                     images_at_markers_sizes: Optional[Dict[str, float]] = None,
+                     compresslevel: int = DEFAULT_COMPRESSLEVEL,
+                     timer: Optional[StageTimer] = None,
+                     streaming: Optional[bool] = None):
+    """Génère le document. `streaming` : None = en flux si la trame dépasse STREAMING_THRESHOLD_BYTES."""
     input_path = Path(input_path)
     output_path = Path(output_path)
-
-    doc = Document(str(input_path))
-
-    placeholders = find_placeholders_in_order(doc)
+    timer = timer or StageTimer()
+    # Images préparées en parallèle pendant le chargement et le traitement du texte
+    image_cache = start_image_preparation(referenced_images(heading_content, images_at_markers))
+
+    # Le mode flux ne pose pas de questions : mapping et décisions doivent être connus
+    can_stream = not interactive or (mapping_override is not None and decisions_override is not None)
+    if streaming is None:
+        from stream_rewrite import document_xml_size
+        streaming = can_stream and document_xml_size(input_path) >= STREAMING_THRESHOLD_BYTES
+    if streaming:
+        if not can_stream:
+            raise ValueError("Mode flux non interactif : fournir mapping_override et decisions_override")
+        from stream_rewrite import rewrite_document
+        rewrite_document(input_path, output_path, mapping_override or {}, decisions_override,
+                         heading_content, images_at_markers, image_width_inches, images_at_markers_sizes,
+                         compresslevel=compresslevel, timer=timer, image_cache=image_cache)
+        logger.info("Document genere (flux) : %s", output_path)
+        return timer
+
+    with timer.stage("template_load"):
+        doc = Document(str(input_path))
+
+    with timer.stage("find_placeholders"):
+        placeholders = find_placeholders_in_order(doc)
     if mapping_override is not None:
         mapping = mapping_override
     elif interactive:
@@ -527,30 +777,10 @@ def process_document(input_path, output_path, mapping_override: Optional[Dict[st
     else:
         mapping = {}
 
-    # Remplacer dans les en-têtes
-    for section in doc.sections:
-        header = section.header
-        # Paragraphes dans l'en-tête
-        for p in header.paragraphs:
-            replace_in_runs(p, mapping)
-        # Tableaux dans l'en-tête
-        for table in header.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for p in cell.paragraphs:
-                        replace_in_runs(p, mapping)
+    apply_mapping(doc, mapping, timer=timer)
 
-    # Supprimer les tableaux SIM vides AVANT le remplacement des placeholders
-    remove_empty_sim_tables(doc, mapping)
-
-    # Remplacer dans le corps du document
-    for p in list(iter_all_paragraphs(doc)):
-        removed = replace_in_runs(p, mapping)
-        if removed:
-            continue
-    remove_empty_paragraphs(doc)
-
-    headings = collect_headings_in_order(doc)
+    with timer.stage("collect_headings"):
+        headings = collect_headings_in_order(doc)
     if decisions_override is not None:
         decisions = decisions_override
     elif interactive:
@@ -558,27 +788,44 @@ def process_document(input_path, output_path, mapping_override: Optional[Dict[st
     else:
         decisions = default_heading_decisions(headings, mapping)
 
-    apply_heading_decisions(doc, decisions)
-    remove_empty_paragraphs(doc)
+    with timer.stage("apply_heading_decisions"):
+        apply_heading_decisions(doc, decisions)
+    with timer.stage("remove_empty_paragraphs"):
+        remove_empty_paragraphs(doc)
 
-    # Insertion des blocs de contenu (texte + images) après les headings
-    if heading_content:
-        apply_heading_content_blocks(doc, heading_content, default_width_inches=image_width_inches)
+    apply_content(doc, heading_content, images_at_markers, image_width_inches, images_at_markers_sizes,
+                  timer=timer, image_cache=image_cache)
 
-    # Insertion d'images sur les marqueurs
-    if images_at_markers:
-        apply_images_at_markers(doc, images_at_markers, width_inches=image_width_inches,
-                                per_image_widths=images_at_markers_sizes)
-
-    doc.save(str(output_path))
-    print(f"Document genere : {output_path}")
+    # Seuls le corps et les en-têtes sont re-sérialisés, le reste est recopié brut
+    with timer.stage("save"):
+        written = save_document(doc, output_path, template_path=input_path,
+                                modified_parts=document_parts_to_rewrite(doc), compresslevel=compresslevel)
+    timer.count("bytes_written", written)
+    logger.info("Document genere : %s", output_path)
+    return timer
 
 
 def main():
     parser = argparse.ArgumentParser(description="Automation interactive pour Word (placeholders + phrases sous titres)")
     parser.add_argument("--input", default="test.docx", help="Fichier Word source")
     parser.add_argument("--output", default="test_sortie.docx", help="Fichier Word de sortie")
+    parser.add_argument("--values", help="Fichier de valeurs JSON ou YAML (mapping, decisions, heading_content...) : "
+                                         "génération sans questions. YAML : PyYAML requis (optionnel, "
+                                         "pip install PyYAML)")
+    parser.add_argument("--watch", action="store_true",
+                        help="Avec --values : régénérer à chaque modification des valeurs, de la trame ou des images")
+    parser.add_argument("--preview", help="Aperçu HTML à régénérer avec le document (avec --values)")
     args = parser.parse_args()
+    configure_logging()
+    if args.watch and not args.values:
+        parser.error("--watch nécessite --values")
+    if args.values:
+        from watch_mode import ReportWatcher, watch
+        if args.watch:
+            watch(args.input, args.values, args.output, args.preview)
+        elif not ReportWatcher(args.input, args.values, args.output, args.preview).regenerate():
+            raise SystemExit(1)
+        return
     process_document(args.input, args.output)
 
 
@@ -0,0 +1,499 @@
+"""
+Sessions d'édition côté serveur pour la génération incrémentale.
+
+Le client crée une session avec un payload complet, puis n'envoie plus que des
+modifications au format JSON Patch (RFC 6902 : add / remove / replace), par
+exemple `{"op": "replace", "path": "/mapping/{nom}", "value": "Dupont"}`.
+
+Le serveur garde l'état fusionné et, pour chaque section du corps (un titre et ses
+blocs), le résultat de chaque étape : placeholders, décision du titre, contenu.
+Une modification ne rejoue que les sections qu'elle touche : remplacer une valeur
+du mapping recalcule les seules sections où figure ce placeholder (et les en-têtes
+s'ils le contiennent), un bloc ajouté sous un titre ne recalcule que ce titre.
+"""
+import copy
+import hashlib
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, MutableMapping, NamedTuple, Optional, Tuple
+
+from docx import Document
+from docx.blkcntnr import BlockItemContainer
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from docx.text.paragraph import Paragraph
+
+from docx_writer import document_parts_to_rewrite, save_document
+from generation_cache import file_digest
+from remplace_rapport import (
+    IMAGE_MARKER,
+    apply_body_mapping,
+    apply_content,
+    apply_heading_decisions,
+    is_heading,
+    referenced_images,
+    remove_empty_paragraphs,
+    replace_in_headers,
+    sim_placeholders,
+    start_image_preparation,
+)
+from stage_timer import StageTimer
+
+MAX_SESSIONS = 64
+SESSION_TTL_SECONDS = 2 * 3600
+# Précision de last_used dans l'état partagé : une écriture par minute au plus et par session
+LAST_USED_RESOLUTION_SECONDS = 60
+
+STAGE_HEADERS = "headers"
+STAGE_MAPPING = "mapping"
+STAGE_DECISIONS = "decisions"
+STAGE_CONTENT = "content"
+
+
+def _decode_pointer(path: str) -> List[str]:
+    if path == "":
+        return []
+    if not path.startswith("/"):
+        raise ValueError(f"Chemin JSON Pointer invalide: {path}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _list_index(container: list, token: str, allow_end: bool) -> int:
+    if token == "-" and allow_end:
+        return len(container)
+    try:
+        index = int(token)
+    except ValueError:
+        raise ValueError(f"Index de liste invalide: {token}")
+    upper = len(container) if allow_end else len(container) - 1
+    if index < 0 or index > upper:
+        raise ValueError(f"Index hors limites: {token}")
+    return index
+
+
+def apply_json_patch(state: Dict[str, Any], operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Applique les opérations add/remove/replace à une copie de `state`."""
+    result = copy.deepcopy(state)
+    for operation in operations:
+        op = operation.get("op")
+        tokens = _decode_pointer(operation.get("path", ""))
+        if not tokens:
+            raise ValueError("Le document racine ne peut pas être remplacé")
+        parent = result
+        for token in tokens[:-1]:
+            if isinstance(parent, list):
+                parent = parent[_list_index(parent, token, allow_end=False)]
+            elif isinstance(parent, dict) and token in parent:
+                parent = parent[token]
+            else:
+                raise ValueError(f"Chemin introuvable: {operation.get('path')}")
+        last = tokens[-1]
+        if op in ("add", "replace"):
+            if "value" not in operation:
+                raise ValueError(f"Valeur manquante pour '{op}' sur {operation.get('path')}")
+            value = copy.deepcopy(operation["value"])
+            if isinstance(parent, list):
+                index = _list_index(parent, last, allow_end=(op == "add"))
+                if op == "add":
+                    parent.insert(index, value)
+                else:
+                    parent[index] = value
+            elif isinstance(parent, dict):
+                if op == "replace" and last not in parent:
+                    raise ValueError(f"Chemin introuvable: {operation.get('path')}")
+                parent[last] = value
+            else:
+                raise ValueError(f"Chemin introuvable: {operation.get('path')}")
+        elif op == "remove":
+            if isinstance(parent, list):
+                del parent[_list_index(parent, last, allow_end=False)]
+            elif isinstance(parent, dict) and last in parent:
+                del parent[last]
+            else:
+                raise ValueError(f"Chemin introuvable: {operation.get('path')}")
+        else:
+            raise ValueError(f"Opération non supportée: {op}")
+    return result
+
+
+class _Blocks(NamedTuple):
+    """Blocs du corps produits par une étape pour une section (ou la trame entière)."""
+    key: str
+    elements: Tuple[Any, ...]
+    headings: Tuple[bool, ...]   # bloc de titre (début de section pour l'étape suivante)
+    texts: Tuple[str, ...]       # texte des paragraphes de chaque bloc
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _describe(doc, key: str, elements: List[Any]) -> _Blocks:
+    headings, texts = [], []
+    for element in elements:
+        paragraphs = [Paragraph(p, doc) for p in element.iter(qn("w:p"))]
+        headings.append(element.tag == qn("w:p") and is_heading(paragraphs[0]))
+        texts.append("\n".join(p.text for p in paragraphs))
+    return _Blocks(key, tuple(elements), tuple(headings), tuple(texts))
+
+
+def _clear_body(doc) -> List[Any]:
+    """Retire et retourne les blocs du corps (la propriété de section finale reste)."""
+    body = doc.element.body
+    elements = [child for child in body.iterchildren() if child.tag != qn("w:sectPr")]
+    for element in elements:
+        body.remove(element)
+    return elements
+
+
+def _fill_body(doc, elements: List[Any]) -> None:
+    body = doc.element.body
+    sect_pr = body.find(qn("w:sectPr"))
+    for element in elements:
+        if sect_pr is not None:
+            sect_pr.addprevious(element)
+        else:
+            body.append(element)
+
+
+def _sections(outputs: List[_Blocks]) -> List[List[Tuple[_Blocks, int, int]]]:
+    """Découpe les blocs en sections : chaque titre du corps ouvre une section.
+
+    Une section est une suite de tranches (blocs, début, fin) : un titre supprimé par
+    une étape rattache ses blocs à la section précédente, comme dans le document entier.
+    """
+    sections: List[List[Tuple[_Blocks, int, int]]] = []
+    for blocks in outputs:
+        start = 0
+        for index, heading in enumerate(blocks.headings):
+            if heading and index > start:
+                _extend(sections, blocks, start, index)
+                start = index
+            if heading:
+                sections.append([])
+        if start < len(blocks.elements):
+            _extend(sections, blocks, start, len(blocks.elements))
+    return [section for section in sections if section]
+
+
+def _extend(sections, blocks: _Blocks, start: int, end: int) -> None:
+    if not sections:
+        sections.append([])
+    sections[-1].append((blocks, start, end))
+
+
+def _section_elements(section) -> List[Any]:
+    return [element for blocks, start, end in section for element in blocks.elements[start:end]]
+
+
+def _section_text(section) -> str:
+    return "\n".join(text for blocks, start, end in section for text in blocks.texts[start:end])
+
+
+def _section_heading(section) -> Optional[str]:
+    blocks, start, _ = section[0]
+    return blocks.texts[start].strip() if blocks.headings[start] else None
+
+
+def relevant_mapping(mapping: Dict[str, str], text: str) -> List[List[str]]:
+    """Entrées du mapping qui peuvent modifier `text`, dans l'ordre du mapping.
+
+    Une valeur qui contient elle-même un placeholder entraîne celui-ci ; les tableaux
+    SIM dépendent des cinq placeholders de leur carte, même absents du texte.
+    """
+    found = set()
+    pending = [text]
+    while pending:
+        current = pending.pop()
+        for old, new in mapping.items():
+            if old not in found and old in current:
+                found.add(old)
+                pending.append(new)
+    entries = [[old, new] for old, new in mapping.items() if old in found]
+    for index in range(1, 9):
+        keys = sim_placeholders(index)
+        if any(key in text for key in keys):
+            entries.append([f"sim{index}"] + [mapping.get(key, "") for key in keys])
+    return entries
+
+
+class EditSession:
+    """État fusionné d'un rapport en cours d'édition et résultats des étapes par section.
+
+    Le corps est découpé en sections (un titre et ses blocs). Chaque étape garde, pour
+    chaque section, son résultat sous une clé calculée à partir de la section reçue de
+    l'étape précédente et des seules valeurs qui la concernent : placeholders présents,
+    décision du titre, blocs de contenu du titre, images de ses marqueurs. Une
+    modification ne rejoue donc que les sections qu'elle touche, étape par étape.
+
+    Le document python-docx est gardé d'un rendu à l'autre (les images insérées restent
+    rattachées à sa partie) : compter environ trois copies du corps par session.
+    """
+
+    def __init__(self, session_id: str, state: Dict[str, Any]):
+        self.id = session_id
+        self.state = state
+        self.last_used = time.time()
+        self._template_key: Optional[str] = None
+        self._doc = None
+        self._template: Optional[_Blocks] = None
+        self._template_rids: set = set()
+        self._headers: List[Tuple[Any, Any]] = []
+        self._headers_key: Optional[str] = None
+        self._results: Dict[str, Dict[str, _Blocks]] = {}
+
+    def _load(self, src_path: Path, template_key: str, timer: StageTimer) -> None:
+        with timer.stage("template_load"):
+            doc = Document(str(src_path))
+        # En-têtes de chaque section (définitions héritées résolues comme dans apply_mapping),
+        # avec leur contenu d'origine pour rejouer le remplacement
+        self._headers = []
+        seen = {}
+        for section in doc.sections:
+            part = section.header.part
+            if id(part) not in seen:
+                seen[id(part)] = copy.deepcopy(part.element)
+            self._headers.append((part, seen[id(part)]))
+        self._template = _describe(doc, template_key, _clear_body(doc))
+        self._template_rids = set(doc.part.rels)
+        self._doc = doc
+        self._template_key = template_key
+        self._headers_key = None
+        self._results = {}
+
+    def _replay_headers(self, mapping: Dict[str, str], timer: StageTimer) -> bool:
+        text = "\n".join(Paragraph(p, part).text for part, original in self._headers
+                         for p in original.iter(qn("w:p")))
+        key = _digest(relevant_mapping(mapping, text))
+        if key == self._headers_key:
+            return False
+        with timer.stage("header_replacement"):
+            for part, original in {id(part): (part, original) for part, original in self._headers}.values():
+                for child in list(part.element):
+                    part.element.remove(child)
+                part.element.extend(copy.deepcopy(child) for child in original)
+            replace_in_headers([BlockItemContainer(part.element, part) for part, _ in self._headers], mapping,
+                               timer=timer)
+        self._headers_key = key
+        return True
+
+    def _replay(self, stage: str, inputs: List[_Blocks], params: Callable, apply: Callable,
+                timer: StageTimer) -> Tuple[List[_Blocks], int]:
+        """Rejoue `apply(doc, section, params)` sur les seules sections dont la clé a changé."""
+        doc = self._doc
+        previous = self._results.get(stage, {})
+        results: Dict[str, _Blocks] = {}
+        outputs = []
+        replayed = 0
+        with timer.stage(stage):
+            for section in _sections(inputs):
+                section_params = params(section)
+                key = _digest([[blocks.key, start, end] for blocks, start, end in section] + [section_params])
+                blocks = results.get(key)
+                if blocks is not None:
+                    # Section identique plus haut dans le document : un élément n'a qu'un parent
+                    blocks = blocks._replace(elements=tuple(copy.deepcopy(e) for e in blocks.elements))
+                else:
+                    blocks = previous.get(key)
+                if blocks is None:
+                    # Section seule dans le corps : les fonctions de remplace_rapport la traitent
+                    # comme un document entier
+                    _fill_body(doc, [copy.deepcopy(element) for element in _section_elements(section)])
+                    apply(doc, section, section_params)
+                    blocks = _describe(doc, key, _clear_body(doc))
+                    replayed += 1
+                results.setdefault(key, blocks)
+                outputs.append(blocks)
+        self._results[stage] = results
+        timer.count(f"sections_{stage}", replayed)
+        return outputs, replayed
+
+    def _drop_unused_images(self) -> None:
+        """Retire les images insérées par des rendus précédents et qui ne sont plus placées."""
+        part = self._doc.part
+        used = set(self._doc.element.body.xpath(".//@r:embed | .//@r:id | .//@r:link"))
+        for rid, rel in list(part.rels.items()):
+            if rel.reltype == RT.IMAGE and rid not in used and rid not in self._template_rids:
+                del part.rels[rid]
+
+    def render(self, src_path: Path, output_path: Path, mapping: Dict[str, str], decisions: List[str],
+               heading_content: Dict[str, List[Dict]], images_at_markers: Dict[str, str],
+               image_width_inches: float, images_at_markers_sizes: Dict[str, float],
+               timer: Optional[StageTimer] = None,
+               image_cache: Optional[Dict[str, Any]] = None) -> Dict[str, int]:
+        """Génère le document en ne rejouant que les sections invalidées.
+
+        Retourne, par étape rejouée, le nombre de sections recalculées
+        (ex. {"content": 1} après l'ajout d'un bloc sous un titre).
+        `image_cache` : images déjà préparées (start_image_preparation), sinon lancées ici
+        pour les seules sections à recalculer.
+        """
+        timer = timer or StageTimer()
+        template_key = _digest([str(src_path), file_digest(src_path)])
+        if template_key != self._template_key:
+            self._load(src_path, template_key, timer)
+        else:
+            # Corps du rendu précédent retiré : ses blocs restent dans les résultats par section
+            _clear_body(self._doc)
+        replayed: Dict[str, int] = {}
+        if self._replay_headers(mapping, timer):
+            replayed[STAGE_HEADERS] = 1
+
+        def mapping_params(section):
+            return relevant_mapping(mapping, _section_text(section))
+
+        def apply_mapping_stage(doc, section, params):
+            apply_body_mapping(doc, mapping)
+
+        mapped, replayed[STAGE_MAPPING] = self._replay(
+            STAGE_MAPPING, [self._template], mapping_params, apply_mapping_stage, timer)
+
+        heading_index = itertools.count()
+
+        def decision_params(section):
+            # Même indexation que apply_heading_decisions : un titre du corps, une décision
+            return decisions[next(heading_index)] if _section_heading(section) is not None else None
+
+        def apply_decision_stage(doc, section, decision):
+            apply_heading_decisions(doc, [] if decision is None else [decision])
+            remove_empty_paragraphs(doc)
+
+        decided, replayed[STAGE_DECISIONS] = self._replay(
+            STAGE_DECISIONS, mapped, decision_params, apply_decision_stage, timer)
+
+        digests: Dict[str, str] = {}
+
+        def image_digest(path: str) -> str:
+            if path not in digests:
+                digests[path] = file_digest(Path(path))
+            return digests[path]
+
+        def content_params(section):
+            heading = _section_heading(section)
+            blocks = heading_content.get(heading, []) if heading is not None else []
+            text = _section_text(section) + "".join(f"\n{block.get('content', '')}" for block in blocks)
+            markers = sorted({marker.strip() for marker in IMAGE_MARKER.findall(text)})
+            return {
+                "heading": heading,
+                "marker_names": markers,
+                "blocks": [[block, image_digest(block["src"]) if block.get("src") else None] for block in blocks],
+                # Avec au moins une image, tous les marqueurs sont réécrits (même sans image)
+                "markers": bool(images_at_markers) and [
+                    [marker, images_at_markers.get(marker), images_at_markers_sizes.get(marker),
+                     image_digest(images_at_markers[marker]) if images_at_markers.get(marker) else None]
+                    for marker in markers],
+                "width": image_width_inches if blocks or markers else None,
+            }
+
+        def apply_content_stage(doc, section, params):
+            cache = image_cache
+            if cache is None:
+                # Seules les images de la section recalculée sont lues
+                cache = start_image_preparation(referenced_images(
+                    {params["heading"]: heading_content.get(params["heading"], [])},
+                    {marker: images_at_markers[marker] for marker in params["marker_names"]
+                     if images_at_markers.get(marker)}))
+            apply_content(doc, heading_content, images_at_markers, image_width_inches, images_at_markers_sizes,
+                          image_cache=cache)
+
+        filled, replayed[STAGE_CONTENT] = self._replay(
+            STAGE_CONTENT, decided, content_params, apply_content_stage, timer)
+
+        with timer.stage("assemble"):
+            _fill_body(self._doc, [element for blocks in filled for element in blocks.elements])
+            self._drop_unused_images()
+        with timer.stage("save"):
+            written = save_document(self._doc, output_path, template_path=src_path,
+                                    modified_parts=document_parts_to_rewrite(self._doc))
+        timer.count("bytes_written", written)
+        return {stage: count for stage, count in replayed.items() if count}
+
+
+class SessionStore:
+    """Sessions bornées en nombre et expirées après inactivité.
+
+    L'état des sessions peut être partagé entre workers via `states` (voir
+    shared_state) : une session créée sur un worker est reprise par un autre,
+    qui reconstruit alors ses instantanés au premier rendu.
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl_seconds: float = SESSION_TTL_SECONDS,
+                 states: Optional[MutableMapping] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, EditSession]" = OrderedDict()
+        self._states: MutableMapping = states if states is not None else {}
+        self._lock = threading.Lock()
+
+    def create(self, state: Dict[str, Any]) -> EditSession:
+        session = EditSession(uuid.uuid4().hex, state)
+        with self._lock:
+            self._sessions[session.id] = session
+        self.save(session)
+        return session
+
+    def save(self, session: EditSession) -> None:
+        """Enregistre l'état fusionné de la session (après un patch)."""
+        session.last_used = time.time()
+        self._states[session.id] = {"state": session.state, "last_used": session.last_used}
+
+    def get(self, session_id: str) -> Optional[EditSession]:
+        """Session active, ou None si elle est inconnue, supprimée ou expirée."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+        stored = self._states.get(session_id)
+        now = time.time()
+        if stored is not None and now - stored["last_used"] > self.ttl_seconds:
+            # Expirée : retirée ici plutôt qu'au prochain evict()
+            self._states.pop(session_id, None)
+            stored = None
+        if stored is None:
+            # Supprimée ou expirée (éventuellement par un autre worker)
+            if session is not None:
+                self.remove(session_id)
+            return None
+        if now - stored["last_used"] > LAST_USED_RESOLUTION_SECONDS:
+            # Reportée dans l'état partagé : les autres workers ne l'expirent pas
+            self._states[session_id] = {"state": stored["state"], "last_used": now}
+        if session is None:
+            session = EditSession(session_id, stored["state"])
+            with self._lock:
+                self._sessions[session_id] = session
+        else:
+            session.state = stored["state"]
+        session.last_used = now
+        return session
+
+    def session_ids(self) -> List[str]:
+        return list(self._states)
+
+    def remove(self, session_id: str) -> Optional[EditSession]:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        stored = self._states.pop(session_id, None)
+        if session is None and stored is not None:
+            session = EditSession(session_id, stored["state"])
+        return session
+
+    def evict(self) -> List[str]:
+        """Retire les sessions expirées et les plus anciennes au-delà de la limite."""
+        now = time.time()
+        evicted = []
+        for session_id in list(self._states):
+            stored = self._states.get(session_id)
+            if stored is not None and now - stored["last_used"] > self.ttl_seconds:
+                self.remove(session_id)
+                evicted.append(session_id)
+        with self._lock:
+            while len(self._sessions) > self.max_sessions:
+                session_id, _ = self._sessions.popitem(last=False)
+                self._states.pop(session_id, None)
+                evicted.append(session_id)
+        return evicted
@@ -0,0 +1,215 @@
+"""
+État partagé entre les workers uvicorn d'une même machine.
+
+Par défaut (LocalBackend) tout reste dans la mémoire du processus, comme avant.
+Avec `uvicorn --workers N`, définir RAPPORT_SHARED_STATE=<fichier.sqlite> active
+SqliteBackend, sans aucun service externe :
+- événements SSE : chaque worker écrit ses événements dans une table et relit
+  ceux des autres (les clients SSE d'un worker voient les générations des autres),
+- espaces clé/valeur JSON : état des sessions d'édition, références des uploads,
+  index des documents générés,
+- verrou inter-processus sur les fichiers de sortie (fcntl.flock).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrou limité au processus
+    fcntl = None
+
+EVENT_POLL_SECONDS = 0.25
+EVENT_RETENTION_SECONDS = 60.0
+
+EventCallback = Callable[[str, Optional[List[str]]], None]
+
+
+class LocalBackend:
+    """Un seul processus : espaces de noms en mémoire, verrous asyncio."""
+
+    # Les espaces de noms survivent-ils au redémarrage du processus ?
+    persistent = False
+
+    def __init__(self):
+        self._namespaces: Dict[str, MutableMapping] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def namespace(self, name: str) -> MutableMapping:
+        return self._namespaces.setdefault(name, {})
+
+    def publish(self, message: str, topics: Optional[List[str]] = None) -> None:
+        # Les abonnés locaux sont servis directement par l'EventHub
+        pass
+
+    async def listen(self, callback: EventCallback) -> None:
+        # Aucun autre processus à écouter
+        await asyncio.Event().wait()
+
+    @asynccontextmanager
+    async def lock(self, name: str):
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            yield
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteNamespace(MutableMapping):
+    """Dictionnaire JSON stocké dans la table kv (un espace de noms)."""
+
+    def __init__(self, backend: "SqliteBackend", name: str):
+        self._backend = backend
+        self._name = name
+
+    def __getitem__(self, key: str) -> Any:
+        rows = self._backend._query("SELECT value FROM kv WHERE namespace = ? AND key = ?", (self._name, key))
+        if not rows:
+            raise KeyError(key)
+        return json.loads(rows[0][0])
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._backend._execute(
+            "INSERT INTO kv (namespace, key, value, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, updated = excluded.updated",
+            (self._name, key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+
+    def __delitem__(self, key: str) -> None:
+        if not self._backend._execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self._name, key)):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self._backend._query("SELECT key FROM kv WHERE namespace = ?", (self._name,))
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self._backend._query("SELECT COUNT(*) FROM kv WHERE namespace = ?", (self._name,))[0][0]
+
+    def values(self):
+        rows = self._backend._query("SELECT value FROM kv WHERE namespace = ?", (self._name,))
+        return [json.loads(row[0]) for row in rows]
+
+
+class SqliteBackend(LocalBackend):
+    """Plusieurs workers sur une machine : SQLite (WAL) + verrou de fichier."""
+
+    persistent = True
+
+    def __init__(self, db_path: str):
+        super().__init__()
+        self.db_path = db_path
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, "
+            "message TEXT, topics TEXT, created REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv (namespace TEXT, key TEXT, value TEXT, updated REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._lock_files: Dict[str, Any] = {}
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        with self._db_lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def namespace(self, name: str) -> MutableMapping:
+        return SqliteNamespace(self, name)
+
+    def publish(self, message: str, topics: Optional[List[str]] = None) -> None:
+        self._execute(
+            "INSERT INTO events (origin, message, topics, created) VALUES (?, ?, ?, ?)",
+            (self.origin, message, json.dumps(topics), time.time()),
+        )
+
+    def _read_events(self, after_id: int) -> list:
+        return self._query("SELECT id, origin, message, topics FROM events WHERE id > ? ORDER BY id", (after_id,))
+
+    async def listen(self, callback: EventCallback) -> None:
+        """Relaye aux abonnés locaux les événements publiés par les autres workers."""
+        loop = asyncio.get_running_loop()
+        last_id = (await loop.run_in_executor(None, self._query, "SELECT COALESCE(MAX(id), 0) FROM events"))[0][0]
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(EVENT_POLL_SECONDS)
+            rows = await loop.run_in_executor(None, self._read_events, last_id)
+            for event_id, origin, message, topics in rows:
+                last_id = event_id
+                if origin != self.origin:
+                    callback(message, json.loads(topics))
+            if time.monotonic() - last_prune > EVENT_RETENTION_SECONDS:
+                last_prune = time.monotonic()
+                await loop.run_in_executor(
+                    None, self._execute, "DELETE FROM events WHERE created < ?",
+                    (time.time() - EVENT_RETENTION_SECONDS,),
+                )
+
+    def _lock_file(self, name: str):
+        f = self._lock_files.get(name)
+        if f is None:
+            f = open(f"{self.db_path}.{name}.lock", "a+b")
+            self._lock_files[name] = f
+        return f
+
+    @asynccontextmanager
+    async def lock(self, name: str):
+        if fcntl is None:
+            async with super().lock(name):
+                yield
+            return
+        # Verrou asyncio d'abord (une seule attente de fichier par worker), puis flock
+        local = self._locks.setdefault(name, asyncio.Lock())
+        await local.acquire()
+        fd = self._lock_file(name).fileno()
+        acquiring = asyncio.get_running_loop().run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Attente annulée (client déconnecté) : le flock aboutira quand même dans son
+            # thread ; il est relâché dès qu'il est obtenu, et le verrou local seulement
+            # ensuite (sinon un autre appel du worker « obtiendrait » ce même flock)
+            def release(future):
+                if not future.cancelled() and future.exception() is None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                local.release()
+
+            acquiring.add_done_callback(release)
+            raise
+        except BaseException:
+            local.release()
+            raise
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            local.release()
+
+    def close(self) -> None:
+        for f in self._lock_files.values():
+            f.close()
+        with self._db_lock:
+            self._conn.close()
+
+
+def create_backend(db_path: Optional[str] = None):
+    db_path = db_path if db_path is not None else os.environ.get("RAPPORT_SHARED_STATE", "")
+    if db_path:
+        return SqliteBackend(db_path)
+    return LocalBackend()
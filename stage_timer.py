@@ -0,0 +1,36 @@
+"""
+Mesure du temps passé dans chaque étape de process_document.
+
+    timer = StageTimer()
+    with timer.stage("template_load"):
+        doc = Document(path)
+    timer.count("paragraphs_visited", 42)
+    timer.report()  # {"total_seconds": ..., "stages": [...], "counts": {...}}
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages: List[Dict] = []
+        self.counts: Dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({"stage": name, "seconds": time.perf_counter() - start})
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self) -> Dict:
+        return {
+            "total_seconds": round(sum(s["seconds"] for s in self.stages), 6),
+            "stages": [{"stage": s["stage"], "seconds": round(s["seconds"], 6)} for s in self.stages],
+            "counts": dict(self.counts),
+        }
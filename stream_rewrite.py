@@ -0,0 +1,487 @@
+"""
+Réécriture en flux des très grosses trames, à mémoire bornée.
+
+process_document charge tout le document dans le modèle objet de python-docx :
+pour une trame de plusieurs centaines de pages, plusieurs centaines de Mo par
+génération. Ici, word/document.xml est lu par iterparse : chaque bloc de premier
+niveau (paragraphe, tableau) est traité dès qu'il est complet, écrit dans
+l'archive de sortie puis libéré. La mémoire est bornée par le plus gros bloc.
+
+Les blocs sont construits avec les classes d'éléments de python-docx : les
+remplacements, les marqueurs et les blocs de contenu passent par les mêmes
+fonctions que process_document, avec le même résultat (tableaux SIM vides,
+placeholders, paragraphes vides, décisions de titres y compris la suppression
+d'un titre et de ses tableaux, contenu sous les titres, images aux marqueurs).
+Les en-têtes, petits, sont traités en entier. Seule différence : une image
+identique à un média déjà présent dans la trame est ajoutée à nouveau au lieu
+d'être partagée.
+"""
+import os
+import posixpath
+import re
+import zipfile
+from pathlib import Path
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Set, Union
+
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml.ns import qn
+from docx.oxml.parser import OxmlElement, element_class_lookup, parse_xml
+from docx.oxml.shape import CT_Inline
+from docx.parts.styles import StylesPart
+from docx.styles.styles import Styles
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from lxml import etree
+
+from docx_writer import DEFAULT_COMPRESSLEVEL, copy_raw_entry
+from remplace_rapport import (
+    DEFAULT_ANALYSIS_TEMPLATE,
+    fill_with_mapping,
+    insert_content_blocks,
+    is_heading,
+    referenced_images,
+    remove_paragraph,
+    replace_image_markers,
+    replace_in_runs,
+    sim_table_state,
+    start_image_preparation,
+)
+from stage_timer import StageTimer
+
+KEEP_TITLE_ONLY = "__KEEP_TITLE_ONLY__"
+CONTENT_TYPES_NAME = "[Content_Types].xml"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_DECLARATION = b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+# Attributs `id` sans espace de noms (docPr, cNvPr) : ceux que python-docx incrémente
+_SHAPE_ID = re.compile(rb'\sid="(\d+)"')
+_SCAN_CHUNK = 1 << 20
+
+W_BODY = qn("w:body")
+W_P = qn("w:p")
+W_TBL = qn("w:tbl")
+W_SECTPR = qn("w:sectPr")
+
+
+def main_document_name(zin: zipfile.ZipFile) -> str:
+    """Nom ZIP de la partie principale (word/document.xml en pratique)."""
+    rels = etree.fromstring(zin.read("_rels/.rels"))
+    for rel in rels.iter(f"{{{RELS_NS}}}Relationship"):
+        if rel.get("Type") == RT.OFFICE_DOCUMENT:
+            return rel.get("Target").lstrip("/")
+    raise KeyError("Partie principale introuvable dans _rels/.rels")
+
+
+def document_xml_size(path) -> int:
+    """Taille décompressée du corps de la trame (critère du mode flux)."""
+    with zipfile.ZipFile(str(path)) as zin:
+        return zin.getinfo(main_document_name(zin)).file_size
+
+
+def _rels_name(part_name: str) -> str:
+    folder, name = posixpath.split(part_name)
+    return posixpath.join(folder, "_rels", f"{name}.rels")
+
+
+def _resolve(part_name: str, target: str) -> str:
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part_name), target))
+
+
+def _max_shape_id(zin: zipfile.ZipFile, name: str) -> int:
+    # Lecture par morceaux : seul le plus grand id est gardé
+    highest, tail = 0, b""
+    with zin.open(name) as f:
+        while True:
+            chunk = f.read(_SCAN_CHUNK)
+            if not chunk:
+                return highest
+            data = tail + chunk
+            for match in _SHAPE_ID.finditer(data):
+                highest = max(highest, int(match.group(1)))
+            tail = data[-64:]
+
+
+def _qname(element) -> str:
+    local = etree.QName(element).localname
+    return f"{element.prefix}:{local}" if element.prefix else local
+
+
+class _StoryPart:
+    """Ce que les objets python-docx demandent à leur partie : styles et nouvelles images."""
+
+    def __init__(self, styles: Styles, rel_ids: Set[str], zip_names: Set[str], next_shape_id: int):
+        self._styles = styles
+        # get_by_id parcourt tous les styles à chaque appel : un titre est testé par paragraphe
+        self._style_memo: Dict[tuple, object] = {}
+        self._rel_ids = rel_ids
+        self._zip_names = zip_names
+        self._next_shape_id = next_shape_id
+        self._by_sha1: Dict[str, tuple] = {}
+        # (rId, nom ZIP, type MIME, octets) des images ajoutées
+        self.new_media: List[tuple] = []
+        self.pictures = 0
+
+    @property
+    def part(self):
+        return self
+
+    def get_style(self, style_id, style_type):
+        key = (style_id, style_type)
+        style = self._style_memo.get(key)
+        if style is None:
+            style = self._style_memo[key] = self._styles.get_by_id(style_id, style_type)
+        return style
+
+    def _next_rid(self) -> str:
+        n = 1
+        while f"rId{n}" in self._rel_ids:
+            n += 1
+        self._rel_ids.add(f"rId{n}")
+        return f"rId{n}"
+
+    def _next_media_name(self, ext: str) -> str:
+        n = 1
+        while f"word/media/image{n}.{ext}" in self._zip_names:
+            n += 1
+        name = f"word/media/image{n}.{ext}"
+        self._zip_names.add(name)
+        return name
+
+    def new_pic_inline(self, image_descriptor, width=None, height=None):
+        image = Image.from_file(image_descriptor)
+        known = self._by_sha1.get(image.sha1)
+        if known is None:
+            rid = self._next_rid()
+            self.new_media.append((rid, self._next_media_name(image.ext), image.content_type, image.blob))
+            known = self._by_sha1[image.sha1] = (rid, image)
+        rid, image = known
+        cx, cy = image.scaled_dimensions(width, height)
+        shape_id = self._next_shape_id
+        self._next_shape_id += 1
+        self.pictures += 1
+        return CT_Inline.new_pic_inline(shape_id, rid, image.filename, cx, cy)
+
+
+class _BodyRewriter:
+    """Applique, bloc par bloc, les étapes de process_document sur le corps du document."""
+
+    def __init__(self, part: _StoryPart, write: Callable[[bytes], None], mapping: Dict[str, str],
+                 decisions: Optional[List[str]], heading_content: Dict[str, List[Dict]],
+                 images_at_markers: Dict[str, str], image_width_inches: float,
+                 images_at_markers_sizes: Dict[str, float], timer: StageTimer,
+                 image_cache: Dict[str, Union[bytes, Future]]):
+        self.part = part
+        self.write = write
+        self.mapping = mapping
+        self.decisions = decisions
+        self.default_decision = fill_with_mapping(DEFAULT_ANALYSIS_TEMPLATE, mapping)
+        self.heading_content = heading_content
+        self.images_at_markers = images_at_markers
+        self.image_width_inches = image_width_inches
+        self.images_at_markers_sizes = images_at_markers_sizes
+        self.timer = timer
+        self.image_cache = image_cache
+        self.header_rids: List[str] = []
+        self.root_declarations: List[bytes] = []
+        self.heading_index = 0
+        # Après un titre supprimé, ses tableaux le sont aussi jusqu'au titre suivant
+        self.dropping_tables = False
+        # Contenu d'un titre, placé après le paragraphe suivant s'il n'est pas un titre :
+        # les blocs écrits entre-temps (tableaux) sont retenus jusque-là
+        self.pending_content: Optional[List[Dict]] = None
+        self.held: List[bytes] = []
+
+    def start(self, root) -> None:
+        shell = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+        start_tag = etree.tostring(shell)
+        self.root_declarations = [f' xmlns:{prefix}="{uri}"'.encode() if prefix else f' xmlns="{uri}"'.encode()
+                                  for prefix, uri in root.nsmap.items()]
+        self.write(XML_DECLARATION)
+        self.write(start_tag[:-2] + b">")
+
+    def serialize(self, element) -> bytes:
+        # Les déclarations de la racine, répétées par tostring sur chaque bloc, sont retirées
+        data = etree.tostring(element, encoding="utf-8", with_tail=False)
+        head, sep, rest = data.partition(b">")
+        for declaration in self.root_declarations:
+            head = head.replace(declaration, b"", 1)
+        return head + sep + rest
+
+    def _out(self, data: bytes) -> None:
+        if self.pending_content is not None:
+            self.held.append(data)
+        else:
+            self.write(data)
+
+    def _collect_header_refs(self, sect_pr) -> None:
+        for ref in sect_pr.findall(qn("w:headerReference")):
+            if ref.get(qn("w:type")) == "default":
+                self.header_rids.append(ref.get(qn("r:id")))
+
+    def _markers(self, paragraph: Paragraph) -> None:
+        if self.images_at_markers:
+            replace_image_markers(paragraph, self.images_at_markers, self.image_width_inches,
+                                  self.images_at_markers_sizes, image_cache=self.image_cache)
+
+    def _content(self, blocks: List[Dict]) -> None:
+        # Conteneur provisoire : insert_content_blocks insère après un paragraphe ancre
+        container = OxmlElement("w:body")
+        anchor = OxmlElement("w:p")
+        container.append(anchor)
+        insert_content_blocks(Paragraph(anchor, self.part), blocks, self.image_width_inches, self.image_cache)
+        for p in container[1:]:
+            self._markers(Paragraph(p, self.part))
+            self.write(self.serialize(p))
+
+    def _flush_pending(self, content_first: bool) -> None:
+        content, held = self.pending_content, self.held
+        self.pending_content, self.held = None, []
+        if content_first:
+            self._content(content)
+        for data in held:
+            self.write(data)
+        if not content_first:
+            self._content(content)
+
+    def block(self, element) -> None:
+        if element.tag == W_P:
+            self.paragraph(element)
+        elif element.tag == W_TBL:
+            self.table(element)
+        elif element.tag == W_SECTPR:
+            self._collect_header_refs(element)
+            if self.pending_content is not None:
+                self._flush_pending(content_first=True)
+            self.write(self.serialize(element))
+        else:
+            self._out(self.serialize(element))
+
+    def finish(self) -> None:
+        if self.pending_content is not None:
+            self._flush_pending(content_first=True)
+
+    def table(self, element) -> None:
+        table = Table(element, self.part)
+        sim_index, has_value = sim_table_state(table, self.mapping)
+        if (sim_index is not None and not has_value) or self.dropping_tables:
+            return
+        for row in table.rows:
+            for cell in row.cells:
+                for p in cell.paragraphs:
+                    self.timer.count("paragraphs_visited")
+                    replace_in_runs(p, self.mapping, timer=self.timer)
+                    self._markers(p)
+        self._out(self.serialize(element))
+
+    def _next_decision(self) -> str:
+        idx = self.heading_index
+        self.heading_index += 1
+        if self.decisions is not None and idx < len(self.decisions):
+            return self.decisions[idx]
+        return self.default_decision
+
+    def paragraph(self, element) -> None:
+        sect_pr = element.find(f"{qn('w:pPr')}/{W_SECTPR}")
+        if sect_pr is not None:
+            self._collect_header_refs(sect_pr)
+        paragraph = Paragraph(element, self.part)
+        self.timer.count("paragraphs_visited")
+        if replace_in_runs(paragraph, self.mapping, timer=self.timer):
+            return
+        if not paragraph.text.strip():
+            remove_paragraph(paragraph)
+            return
+        heading = is_heading(paragraph)
+        decision = None
+        if heading:
+            decision = self._next_decision()
+            if decision != KEEP_TITLE_ONLY and not decision:
+                remove_paragraph(paragraph)
+                self.dropping_tables = True
+                return
+            self.dropping_tables = False
+
+        if self.pending_content is not None:
+            if heading:
+                self._flush_pending(content_first=True)
+            else:
+                # Le contenu du titre précédent suit ce paragraphe
+                content = self.pending_content
+                self.pending_content = None
+                for data in self.held:
+                    self.write(data)
+                self.held = []
+                self._emit(paragraph)
+                self._content(content)
+                return
+        if not heading:
+            self._emit(paragraph)
+            return
+
+        heading_text = paragraph.text.strip()
+        self._emit(paragraph)
+        content = self.heading_content.get(heading_text) if self.heading_content else None
+        if decision != KEEP_TITLE_ONLY and decision.strip():
+            # Phrase sous le titre : c'est elle que suit le contenu du titre
+            sentence = OxmlElement("w:p")
+            Paragraph(sentence, self.part).add_run(decision)
+            self._emit(Paragraph(sentence, self.part))
+            if content:
+                self._content(content)
+        elif content:
+            self.pending_content = content
+
+    def _emit(self, paragraph: Paragraph) -> None:
+        self._markers(paragraph)
+        self._out(self.serialize(paragraph._p))
+
+
+def _rewrite_body(source, rewriter: _BodyRewriter) -> None:
+    context = etree.iterparse(source, events=("end",), remove_blank_text=True, resolve_entities=False,
+                              huge_tree=True)
+    context.set_element_class_lookup(element_class_lookup)
+    started = False
+    body_open = False
+    for _, element in context:
+        if not started:
+            rewriter.start(element.getroottree().getroot())
+            started = True
+        parent = element.getparent()
+        if parent is None:
+            # Fin de la racine
+            rewriter.write(f"</{_qname(element)}>".encode())
+            return
+        top_level = parent.getparent() is None
+        if parent.tag == W_BODY and parent.getparent().getparent() is None:
+            if not body_open:
+                rewriter.write(f"<{_qname(parent)}>".encode())
+                body_open = True
+            rewriter.block(element)
+        elif top_level and element.tag == W_BODY:
+            if not body_open:
+                rewriter.write(f"<{_qname(element)}>".encode())
+            rewriter.finish()
+            rewriter.write(f"</{_qname(element)}>".encode())
+        elif top_level:
+            # Avant le corps (w:background) : recopié tel quel
+            rewriter.write(rewriter.serialize(element))
+        else:
+            continue
+        # Bloc écrit : libéré (sauf s'il a déjà été retiré par le traitement)
+        if element.getparent() is not None:
+            parent.remove(element)
+
+
+def _rewrite_header(blob: bytes, part: _StoryPart, mapping: Dict[str, str], timer: StageTimer) -> bytes:
+    header = parse_xml(blob)
+    for p in header.findall(W_P):
+        timer.count("paragraphs_visited")
+        replace_in_runs(Paragraph(p, part), mapping, timer=timer)
+    for tbl in header.findall(W_TBL):
+        for row in Table(tbl, part).rows:
+            for cell in row.cells:
+                for p in cell.paragraphs:
+                    timer.count("paragraphs_visited")
+                    replace_in_runs(p, mapping, timer=timer)
+    return serialize_part_xml(header)
+
+
+def _with_media(rels_blob: bytes, content_types_blob: bytes, rels_target_base: str, new_media: List[tuple]):
+    rels = etree.fromstring(rels_blob)
+    for rid, name, _, _ in new_media:
+        etree.SubElement(rels, f"{{{RELS_NS}}}Relationship", Id=rid, Type=RT.IMAGE,
+                         Target=posixpath.relpath(name, rels_target_base))
+    types = etree.fromstring(content_types_blob)
+    known = {d.get("Extension", "").lower() for d in types.iter(f"{{{CT_NS}}}Default")}
+    for _, name, content_type, _ in new_media:
+        ext = name.rsplit(".", 1)[-1].lower()
+        if ext not in known:
+            etree.SubElement(types, f"{{{CT_NS}}}Default", Extension=ext, ContentType=content_type)
+            known.add(ext)
+    return serialize_part_xml(rels), serialize_part_xml(types)
+
+
+def rewrite_document(input_path, output_path, mapping: Dict[str, str],
+                     decisions: Optional[List[str]] = None,
+                     heading_content: Optional[Dict[str, List[Dict]]] = None,
+                     images_at_markers: Optional[Dict[str, str]] = None,
+                     image_width_inches: float = 3.0,
+                     images_at_markers_sizes: Optional[Dict[str, float]] = None,
+                     compresslevel: int = DEFAULT_COMPRESSLEVEL,
+                     timer: Optional[StageTimer] = None,
+                     image_cache: Optional[Dict[str, Union[bytes, Future]]] = None) -> StageTimer:
+    """Équivalent non interactif de process_document, en flux (decisions=None : phrase par défaut)."""
+    timer = timer or StageTimer()
+    if image_cache is None:
+        image_cache = start_image_preparation(referenced_images(heading_content, images_at_markers))
+    input_path, output_path = Path(input_path), Path(output_path)
+    # La trame est lue pendant l'écriture : si on l'écrase, on passe par un fichier temporaire
+    final_path = output_path
+    if output_path.resolve() == input_path.resolve():
+        output_path = output_path.with_name(f".{output_path.name}.tmp")
+    if compresslevel <= 0:
+        compression, level = zipfile.ZIP_STORED, None
+    else:
+        compression, level = zipfile.ZIP_DEFLATED, min(compresslevel, 9)
+    needs_images = bool(images_at_markers) or any(
+        block.get("type") == "image" for blocks in (heading_content or {}).values() for block in blocks
+    )
+
+    with zipfile.ZipFile(str(input_path)) as zin, \
+            zipfile.ZipFile(str(output_path), "w", compression=compression, compresslevel=level) as zout:
+        names = zin.namelist()
+        document_name = main_document_name(zin)
+        rels_name = _rels_name(document_name)
+        rels_blob = zin.read(rels_name) if rels_name in names else (
+            f'<Relationships xmlns="{RELS_NS}"/>'.encode())
+        relationships = list(etree.fromstring(rels_blob).iter(f"{{{RELS_NS}}}Relationship"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in relationships}
+        styles_name = next((_resolve(document_name, rel.get("Target")) for rel in relationships
+                            if rel.get("Type") == RT.STYLES), None)
+        styles_blob = zin.read(styles_name) if styles_name in names else StylesPart._default_styles_xml()
+        next_shape_id = _max_shape_id(zin, document_name) + 1 if needs_images else 1
+        part = _StoryPart(Styles(parse_xml(styles_blob)), set(targets), set(names), next_shape_id)
+
+        with timer.stage("stream_document"):
+            with zout.open(document_name, "w") as dst, zin.open(document_name) as src:
+                rewriter = _BodyRewriter(part, dst.write, mapping, decisions, heading_content or {},
+                                         images_at_markers or {}, image_width_inches,
+                                         images_at_markers_sizes or {}, timer, image_cache)
+                _rewrite_body(src, rewriter)
+        timer.count("images_embedded", part.pictures)
+
+        with timer.stage("header_replacement"):
+            header_names = []
+            for rid in dict.fromkeys(rewriter.header_rids):
+                target = targets.get(rid)
+                if target is None:
+                    continue
+                name = _resolve(document_name, target)
+                if name in names and name not in header_names:
+                    header_names.append(name)
+                    zout.writestr(name, _rewrite_header(zin.read(name), part, mapping, timer))
+
+        with timer.stage("save"):
+            rewritten = {document_name, *header_names}
+            if part.new_media:
+                new_rels, new_types = _with_media(rels_blob, zin.read(CONTENT_TYPES_NAME),
+                                                  posixpath.dirname(document_name), part.new_media)
+                zout.writestr(rels_name, new_rels)
+                zout.writestr(CONTENT_TYPES_NAME, new_types)
+                rewritten.update((rels_name, CONTENT_TYPES_NAME))
+                for _, name, _, blob in part.new_media:
+                    zout.writestr(name, blob)
+            for info in zin.infolist():
+                if info.filename not in rewritten:
+                    copy_raw_entry(zin, zout, info)
+
+    if output_path != final_path:
+        os.replace(output_path, final_path)
+    written = final_path.stat().st_size
+    timer.count("bytes_written", written)
+    return timer
@@ -0,0 +1,124 @@
+"""
+Registre des trames Word, découvertes dans un dossier et surveillées.
+
+Chaque fichier `<nom>.docx` du dossier devient la trame `<nom>`, générée dans
+`<nom>_sortie.docx` à côté (ou dans `output_dir`, par exemple un tmpfs). Les
+requêtes ne lisent que le registre en mémoire (aucun accès disque pour résoudre une trame) ; l'analyse de la trame
+(placeholders, titres, marqueurs) y est gardée jusqu'à modification du fichier.
+
+`watch()` rescanne le dossier à chaque changement : notifications du système
+(inotify via watchfiles, s'il est installé) ou, à défaut, sondage périodique.
+Seules les trames ajoutées, modifiées ou supprimées sont signalées, ce qui permet
+de n'invalider que leurs caches.
+"""
+import asyncio
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+try:
+    from watchfiles import awatch
+except ImportError:  # sondage périodique
+    awatch = None
+
+OUTPUT_SUFFIX = "_sortie"
+POLL_SECONDS = 2.0
+
+logger = logging.getLogger(__name__)
+
+
+def is_template_file(name: str) -> bool:
+    # Ni documents générés, ni fichiers verrou de Word (~$test.docx), ni fichiers cachés
+    return (name.lower().endswith(".docx") and not name.startswith(("~$", "."))
+            and not Path(name).stem.endswith(OUTPUT_SUFFIX))
+
+
+class TemplateEntry:
+    __slots__ = ("name", "path", "output_path", "mtime_ns", "size", "analysis")
+
+    def __init__(self, name: str, path: Path, output_path: Path, mtime_ns: int, size: int):
+        self.name = name
+        self.path = path
+        self.output_path = output_path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.analysis: Optional[dict] = None
+
+
+class TemplateRegistry:
+    def __init__(self, directory: Path, analyzer: Callable[[Path], dict], default: Optional[str] = None,
+                 output_dir: Optional[Path] = None):
+        self.directory = Path(directory)
+        self.analyzer = analyzer
+        self.default = default
+        self.output_dir = Path(output_dir) if output_dir else None
+        self._entries: Dict[str, TemplateEntry] = {}
+        self._lock = threading.Lock()
+
+    def output_path_for(self, path: Path) -> Path:
+        name = f"{path.stem}{OUTPUT_SUFFIX}.docx"
+        return self.output_dir / name if self.output_dir is not None else path.with_name(name)
+
+    def scan(self) -> List[str]:
+        """Relit le dossier ; retourne les trames ajoutées, modifiées ou supprimées."""
+        found = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if is_template_file(item.name) and item.is_file():
+                        st = item.stat()
+                        found[Path(item.name).stem] = (Path(item.path), st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            logger.warning("Dossier des trames introuvable: %s", self.directory)
+
+        changed = []
+        with self._lock:
+            entries = {}
+            for name in sorted(found):
+                path, mtime_ns, size = found[name]
+                entry = self._entries.get(name)
+                if entry is None or (entry.mtime_ns, entry.size) != (mtime_ns, size):
+                    entry = TemplateEntry(name, path, self.output_path_for(path), mtime_ns, size)
+                    changed.append(name)
+                entries[name] = entry
+            changed.extend(name for name in self._entries if name not in entries)
+            # Remplacement en bloc : un lecteur voit l'ancien ou le nouvel état, jamais un mélange
+            self._entries = entries
+        return changed
+
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def get(self, name: str) -> Optional[TemplateEntry]:
+        return self._entries.get(name)
+
+    def first(self) -> Optional[TemplateEntry]:
+        """Trame par défaut si elle existe, sinon la première par ordre alphabétique."""
+        entries = self._entries
+        if self.default in entries:
+            return entries[self.default]
+        return next(iter(entries.values()), None)
+
+    def analysis(self, entry: TemplateEntry) -> dict:
+        """Analyse de la trame, calculée une fois par version du fichier."""
+        if entry.analysis is None:
+            entry.analysis = self.analyzer(entry.path)
+        return entry.analysis
+
+    async def watch(self, on_change: Callable[[List[str]], Awaitable[None]],
+                    poll_seconds: float = POLL_SECONDS) -> None:
+        loop = asyncio.get_running_loop()
+        if awatch is not None:
+            async for changes in awatch(self.directory, recursive=False,
+                                        watch_filter=lambda _, path: is_template_file(os.path.basename(path))):
+                changed = await loop.run_in_executor(None, self.scan)
+                if changed:
+                    await on_change(changed)
+            return
+        while True:
+            await asyncio.sleep(poll_seconds)
+            changed = await loop.run_in_executor(None, self.scan)
+            if changed:
+                await on_change(changed)
@@ -0,0 +1,90 @@
+"""
+Tests des requêtes partielles (Range) et de la validation par ETag de bytes_response.
+"""
+import pytest
+from starlette.requests import Request
+
+from compression import bytes_response, parse_range
+
+DATA = bytes(range(256)) * 4  # 1024 octets
+ETAG = '"abc"'
+
+
+def _request(**headers):
+    raw = [(name.replace("_", "-").lower().encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/download", "headers": raw})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=1000-", (1000, 1023)),       # ouverte
+    ("bytes=-24", (1000, 1023)),         # suffixe
+    ("bytes=-5000", (0, 1023)),          # suffixe plus long que le contenu
+    ("bytes=1000-5000", (1000, 1023)),   # fin tronquée
+    ("bytes=0-0", (0, 0)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(DATA)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=0-9,20-29", "items=0-9", "bytes=a-b", "bytes=5", "bytes=-"])
+def test_parse_range_ignored(header):
+    # Plusieurs plages, autre unité ou syntaxe invalide : réponse complète
+    assert parse_range(header, len(DATA)) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=10-5", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        parse_range(header, len(DATA))
+
+
+def test_full_response_advertises_ranges():
+    response = bytes_response(_request(), DATA, ETAG, "application/octet-stream", filename="rapport.docx")
+    assert response.status_code == 200
+    assert response.body == DATA
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == ETAG
+    assert response.headers["content-disposition"] == 'attachment; filename="rapport.docx"'
+
+
+def test_partial_responses():
+    response = bytes_response(_request(range="bytes=-24"), DATA, ETAG, "application/octet-stream")
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 1000-1023/1024"
+    assert response.body == DATA[1000:]
+
+    response = bytes_response(_request(range="bytes=1000-"), DATA, ETAG, "application/octet-stream")
+    assert response.status_code == 206
+    assert response.body == DATA[1000:]
+
+
+def test_unsatisfiable_range_is_416():
+    response = bytes_response(_request(range="bytes=5000-"), DATA, ETAG, "application/octet-stream")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_multiple_ranges_get_the_full_content():
+    response = bytes_response(_request(range="bytes=0-9,20-29"), DATA, ETAG, "application/octet-stream")
+    assert response.status_code == 200
+    assert response.body == DATA
+
+
+def test_if_range():
+    # ETag identique : la plage est servie ; document changé : contenu complet
+    same = bytes_response(_request(range="bytes=0-9", if_range=ETAG), DATA, ETAG, "application/octet-stream")
+    assert same.status_code == 206 and same.body == DATA[:10]
+    changed = bytes_response(_request(range="bytes=0-9", if_range='"old"'), DATA, ETAG, "application/octet-stream")
+    assert changed.status_code == 200 and changed.body == DATA
+
+
+def test_if_none_match():
+    assert bytes_response(_request(if_none_match=ETAG), DATA, ETAG, "application/octet-stream").status_code == 304
+    assert bytes_response(_request(if_none_match=f'W/{ETAG}'), DATA, ETAG, "x/y").status_code == 304
+    assert bytes_response(_request(if_none_match='"other"'), DATA, ETAG, "x/y").status_code == 200
+
+
+def test_non_ascii_filename():
+    response = bytes_response(_request(), DATA, ETAG, "application/pdf", filename="été.pdf")
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''%C3%A9t%C3%A9.pdf"
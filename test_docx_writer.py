@@ -0,0 +1,54 @@
+"""
+Tests de l'écriture directe du .docx : archive valide, relisible par python-docx,
+parties inchangées recopiées à l'identique, avec ou sans copie brute.
+"""
+import zipfile
+from pathlib import Path
+
+import pytest
+from docx import Document
+
+import docx_writer
+from docx_writer import document_parts_to_rewrite, save_document
+
+TEMPLATE = Path(__file__).parent / "test.docx"
+
+
+def _save(tmp_path, compresslevel):
+    doc = Document(str(TEMPLATE))
+    doc.paragraphs[0].add_run(" modifié")
+    modified = document_parts_to_rewrite(doc)
+    output = tmp_path / f"sortie_{compresslevel}.docx"
+    save_document(doc, output, TEMPLATE, modified_parts=modified, compresslevel=compresslevel)
+    return output, {name.lstrip("/") for name in modified}
+
+
+def _check(output, modified):
+    with zipfile.ZipFile(output) as zout, zipfile.ZipFile(TEMPLATE) as zin:
+        assert zout.testzip() is None
+        names = zout.namelist()
+        assert len(names) == len(set(names))
+        unchanged = [info for info in zin.infolist()
+                     if info.filename not in modified and not info.filename.endswith(".rels")
+                     and info.filename != "[Content_Types].xml"]
+        assert unchanged
+        for info in unchanged:
+            assert zout.read(info.filename) == zin.read(info)
+    assert " modifié" in Document(str(output)).paragraphs[0].text
+
+
+@pytest.mark.parametrize("compresslevel", [0, 6, 9])
+def test_save_document_copies_unchanged_parts(tmp_path, compresslevel):
+    output, modified = _save(tmp_path, compresslevel)
+    _check(output, modified)
+    with zipfile.ZipFile(output) as zout, zipfile.ZipFile(TEMPLATE) as zin:
+        # Copie brute : mêmes octets compressés, même méthode que la trame
+        styles, original = zout.getinfo("word/styles.xml"), zin.getinfo("word/styles.xml")
+        assert (styles.compress_type, styles.compress_size) == (original.compress_type, original.compress_size)
+
+
+@pytest.mark.parametrize("compresslevel", [0, 9])
+def test_fallback_without_zipfile_internals(tmp_path, monkeypatch, compresslevel):
+    monkeypatch.setattr(docx_writer, "_ZIPFILE_INTERNALS", ("attribut_disparu",))
+    output, modified = _save(tmp_path, compresslevel)
+    _check(output, modified)
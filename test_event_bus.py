@@ -0,0 +1,84 @@
+"""
+Tests de la diffusion SSE : fusion des messages en attente, filtrage par sujet,
+battement de cœur et déconnexion des clients qui ne lisent plus.
+"""
+import asyncio
+import time
+
+from event_bus import MAX_PENDING_EVENTS, EventHub, Subscriber
+
+
+def test_pending_messages_are_coalesced_and_bounded():
+    async def scenario():
+        subscriber = Subscriber(None)
+        # Même clé : seul le dernier message est gardé, en fin de file
+        subscriber.push("test:updated", "v1")
+        subscriber.push("test3:updated", "autre")
+        subscriber.push("test:updated", "v2")
+        assert await subscriber.wait(0) == ["autre", "v2"]
+
+        # Au-delà de la borne, les plus anciens sont abandonnés
+        for i in range(MAX_PENDING_EVENTS + 8):
+            subscriber.push(f"cle{i}", f"message {i}")
+        messages = await subscriber.wait(0)
+        assert len(messages) == MAX_PENDING_EVENTS
+        assert messages[0] == "message 8" and messages[-1] == f"message {MAX_PENDING_EVENTS + 7}"
+    asyncio.run(scenario())
+
+
+def test_publish_respects_topics():
+    async def scenario():
+        hub = EventHub()
+        everything = hub.subscribe()
+        test_only = hub.subscribe({"test"})
+        session_only = hub.subscribe({"session:abc"})
+
+        hub.publish("updated", ["test"])
+        hub.publish("updated", ["test3", "session:abc"])
+        hub.publish("reload")  # sans sujet : pour tout le monde
+
+        assert await everything.wait(0) == ["updated", "updated", "reload"]
+        assert await test_only.wait(0) == ["updated", "reload"]
+        assert await session_only.wait(0) == ["updated", "reload"]
+        # Rafale sur une même trame : un seul message en attente
+        for _ in range(10):
+            hub.publish("updated", ["test"])
+        assert await test_only.wait(0) == ["updated"]
+    asyncio.run(scenario())
+
+
+def test_clients_that_stop_reading_are_dropped():
+    async def scenario():
+        hub = EventHub(dead_client_seconds=0.05)
+        stalled = hub.subscribe()
+        reading = hub.subscribe()
+        hub.publish("updated", ["test"])
+        await asyncio.sleep(0.1)
+        await reading.wait(0)
+        hub.publish("updated", ["test"])
+
+        # Messages en attente depuis plus que le délai : désabonné et fermé
+        assert stalled.closed and len(hub) == 1
+        assert await reading.wait(0) == ["updated"]
+        # Un client sans rien en attente n'est jamais considéré comme mort
+        idle = hub.subscribe()
+        idle.last_read = time.monotonic() - 3600
+        hub.publish("updated", ["test"])
+        assert not idle.closed
+    asyncio.run(scenario())
+
+
+def test_stream_sends_heartbeats_and_messages():
+    async def scenario():
+        hub = EventHub()
+        stream = hub.stream({"test"}, heartbeat_seconds=0.05)
+        assert await stream.__anext__() == ": connected\n\n"
+        # Rien à envoyer : commentaire SSE pour garder la connexion
+        assert await stream.__anext__() == ": ping\n\n"
+        hub.publish("updated", ["test3"])
+        hub.publish("updated", ["test"])
+        assert await stream.__anext__() == "data: updated\n\n"
+        assert len(hub) == 1
+        await stream.aclose()
+        assert len(hub) == 0
+    asyncio.run(scenario())
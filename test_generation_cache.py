@@ -0,0 +1,89 @@
+"""
+Tests de la mémoïsation des générations : clé (payload, trame, images), mémo des
+empreintes de fichiers et bornes du LRU.
+"""
+import os
+
+import generation_cache
+from generation_cache import GenerationCache, file_digest, generation_key
+
+
+def _write(path, data, mtime_ns=None):
+    path.write_bytes(data)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def _files(tmp_path):
+    template = _write(tmp_path / "trame.docx", b"trame v1")
+    image = _write(tmp_path / "photo.jpg", b"image v1")
+    return template, image
+
+
+def test_key_ignores_payload_key_order(tmp_path):
+    template, image = _files(tmp_path)
+    first = {"template": "test", "mapping": {"{a}": "1", "{b}": "2"}, "decisions": ["x"]}
+    second = {"decisions": ["x"], "mapping": {"{b}": "2", "{a}": "1"}, "template": "test"}
+    assert generation_key(first, template, [str(image)]) == generation_key(second, template, [str(image)])
+    # Ordre et doublons des images sans effet non plus
+    other = _write(tmp_path / "autre.png", b"png")
+    assert (generation_key(first, template, [str(image), str(other)])
+            == generation_key(first, template, [str(other), str(image), str(image)]))
+
+
+def test_editing_the_template_or_an_image_changes_the_key(tmp_path):
+    template, image = _files(tmp_path)
+    payload = {"mapping": {"{a}": "1"}}
+    key = generation_key(payload, template, [str(image)])
+
+    _write(template, b"trame v2")
+    after_template = generation_key(payload, template, [str(image)])
+    assert after_template != key
+
+    _write(image, b"image v2")
+    assert generation_key(payload, template, [str(image)]) != after_template
+    assert generation_key({"mapping": {"{a}": "2"}}, template, [str(image)]) != key
+
+
+def test_file_digest_is_memoized_on_mtime_and_size(tmp_path, monkeypatch):
+    path = _write(tmp_path / "trame.docx", b"aaaa", mtime_ns=1_000_000_000)
+    monkeypatch.setattr(generation_cache, "_digest_memo", {})
+    digest = file_digest(path)
+
+    # Même date et même taille : le contenu n'est pas relu
+    _write(path, b"bbbb", mtime_ns=1_000_000_000)
+    assert file_digest(path) == digest
+    # Date modifiée : empreinte recalculée
+    _write(path, b"bbbb", mtime_ns=2_000_000_000)
+    assert file_digest(path) != digest
+    assert file_digest(tmp_path / "absent.docx") == "missing"
+
+
+def test_lru_evicts_by_bytes_and_entries():
+    cache = GenerationCache(max_entries=10, max_bytes=100)
+    cache.put("a", b"x" * 40)
+    cache.put("b", b"x" * 40)
+    assert cache.get("a") is not None  # "a" devient le plus récent
+    cache.put("c", b"x" * 40)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    # Plus grand que la borne : jamais mis en cache
+    cache.put("d", b"x" * 101)
+    assert cache.get("d") is None
+
+    small = GenerationCache(max_entries=2, max_bytes=100)
+    for key in ("a", "b", "c"):
+        small.put(key, b"x")
+    assert small.get("a") is None and small.get("c") == b"x"
+
+
+def test_on_disk_tracking(tmp_path):
+    cache = GenerationCache()
+    output = _write(tmp_path / "sortie.docx", b"rapport")
+    cache.mark_on_disk(output, "k1")
+    assert cache.is_on_disk(output, "k1") and not cache.is_on_disk(output, "k2")
+    assert cache.key_on_disk(output) == "k1"
+    # Fichier réécrit par ailleurs : plus considéré comme à jour
+    _write(output, b"rapport modifie")
+    assert cache.key_on_disk(output) is None
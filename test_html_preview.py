@@ -0,0 +1,82 @@
+"""
+Tests de l'aperçu HTML natif : en-têtes, tableaux et corps rendus une seule fois,
+feuille de style en cache par trame et repli sur mammoth si le rendu échoue.
+"""
+import shutil
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import html_preview
+from benchmark_pipeline import build_template
+from html_preview import render_docx_html
+
+ROOT = Path(__file__).parent
+
+
+def test_test_docx_renders_headers_tables_and_body_once():
+    rendered = render_docx_html(ROOT / "test.docx")
+    # En-tête (tableau de l'en-tête de section), avant le corps
+    assert rendered.count("Art. L223-1") == 1
+    assert rendered.count("Date du rapport") == 1
+    assert rendered.index("Art. L223-1") < rendered.index("Identité de l’objectif")
+    # Tableaux du corps
+    assert rendered.count("Identité de l’objectif") == 1
+    assert rendered.count("Commentaires\xa0: {commentaire}") == 1
+    # Corps : le titre apparaît une fois, la table des matières n'en garde qu'un lien
+    assert rendered.count("Table des matières") == 1
+    assert rendered.count('<a id="_Toc215823739"></a>Synthèse</h1>') == 1
+
+
+def test_large_generated_template(tmp_path):
+    sections = 60
+    template = tmp_path / "grande.docx"
+    build_template(template, sections)
+    rendered = render_docx_html(template)
+
+    assert rendered.count("Rapport {daterap} - {nom} {prenom}") == 1
+    assert rendered.count("<table") == 2 * sections
+    for i in (0, sections // 2, sections - 1):
+        assert rendered.count(f"<h1>Section {i} {{titre{i}}}</h1>") == 1
+        # Placeholder coupé sur plusieurs runs : recollé dans le rendu
+        assert rendered.count(f"<p>Référence : {{ref{i}}}</p>") == 1
+        assert rendered.count(f"<td><p>{{imei{i}}}</p></td>") == 1
+        assert rendered.count(f"[[IMG:photo{i}]]") == 1
+
+
+def test_second_render_reuses_the_stylesheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(html_preview, "_style_cache", {})
+    parsed = []
+    parse = html_preview.parse_stylesheet
+    monkeypatch.setattr(html_preview, "parse_stylesheet", lambda *parts: parsed.append(1) or parse(*parts))
+
+    first = render_docx_html(ROOT / "test.docx")
+    assert len(parsed) == 1
+    # Même trame, ou document généré qui en reprend styles.xml et numbering.xml : pas de nouvelle analyse
+    copy = tmp_path / "copie.docx"
+    shutil.copy(ROOT / "test.docx", copy)
+    assert render_docx_html(copy) == first
+    assert len(parsed) == 1
+    render_docx_html(ROOT / "test2.docx")
+    assert len(parsed) == 2
+
+
+def test_corrupt_part_falls_back_to_mammoth(tmp_path, monkeypatch):
+    import app
+    corrupt = tmp_path / "corrompu.docx"
+    with zipfile.ZipFile(ROOT / "test.docx") as zin, zipfile.ZipFile(corrupt, "w") as zout:
+        for info in zin.infolist():
+            data = zin.read(info)
+            zout.writestr(info, b"<w:document" if info.filename == "word/document.xml" else data)
+    with pytest.raises(Exception):
+        render_docx_html(corrupt)
+
+    calls = []
+    monkeypatch.setattr(app, "PREVIEW_RENDERER", "native")
+    monkeypatch.setattr(app, "convert_to_html_mammoth", lambda path: calls.append(path) or "<p>mammoth</p>")
+    assert app.convert_to_html(corrupt) == "<p>mammoth</p>"
+    assert calls == [corrupt]
+    # Document sain : rendu natif, mammoth jamais appelé
+    assert app.convert_to_html(ROOT / "test.docx") == render_docx_html(ROOT / "test.docx")
+    assert calls == [corrupt]
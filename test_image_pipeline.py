@@ -0,0 +1,68 @@
+"""
+Tests de la normalisation des images à l'upload : orientation EXIF, plafond de
+résolution et image déjà normalisée renvoyée telle quelle.
+"""
+import io
+
+from PIL import Image
+
+from image_pipeline import EXIF_ORIENTATION_TAG, MAX_IMAGE_DIMENSION, normalize_image
+
+
+def _encode(image, fmt, orientation=None):
+    out = io.BytesIO()
+    if orientation is None:
+        image.save(out, fmt)
+    else:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION_TAG] = orientation
+        image.save(out, fmt, exif=exif)
+    return out.getvalue()
+
+
+def _open(data):
+    return Image.open(io.BytesIO(data))
+
+
+def test_exif_orientation_is_applied_to_pixels():
+    # Photo "couchée" : 400x200 stockée, orientation 6 (rotation de 90° à l'affichage)
+    image = Image.new("RGB", (400, 200), (255, 255, 255))
+    image.paste((255, 0, 0), (0, 0, 40, 40))  # repère dans le coin haut gauche
+    result = normalize_image(_encode(image, "JPEG", orientation=6), "photo.jpg")
+
+    assert result.extension == ".jpg"
+    assert (result.info["width"], result.info["height"]) == (200, 400)
+    assert result.info["orientation"] == 1 and result.info["original_orientation"] == 6
+    with _open(result.data) as stored:
+        assert stored.size == (200, 400)
+        assert not stored.getexif().get(EXIF_ORIENTATION_TAG)
+        # Rotation horaire : le coin haut gauche passe en haut à droite
+        red, green, blue = stored.getpixel((190, 10))
+        assert red > 200 and green < 80 and blue < 80
+
+
+def test_large_images_are_capped():
+    image = Image.new("RGB", (MAX_IMAGE_DIMENSION * 2, MAX_IMAGE_DIMENSION), (10, 120, 200))
+    for fmt, name, extension in (("JPEG", "grande.jpg", ".jpg"), ("PNG", "grande.png", ".png")):
+        result = normalize_image(_encode(image, fmt), name)
+        assert result.extension == extension
+        assert max(result.info["width"], result.info["height"]) == MAX_IMAGE_DIMENSION
+        with _open(result.data) as stored:
+            assert stored.size == (MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION // 2)
+
+
+def test_already_normalized_images_are_returned_unchanged():
+    for fmt, name in (("JPEG", "droite.jpg"), ("PNG", "droite.png")):
+        data = _encode(Image.new("RGB", (300, 200), (0, 128, 0)), fmt)
+        result = normalize_image(data, name)
+        assert result.data is data
+        assert result.info == {"width": 300, "height": 200, "mime": Image.MIME[fmt], "orientation": 1}
+
+
+def test_metadata_forces_a_reencode():
+    # Orientation neutre mais EXIF présent : ré-encodé pour retirer les métadonnées
+    data = _encode(Image.new("RGB", (300, 200)), "JPEG", orientation=1)
+    result = normalize_image(data, "exif.jpg")
+    assert result.data != data
+    with _open(result.data) as stored:
+        assert not stored.getexif()
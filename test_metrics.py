@@ -0,0 +1,40 @@
+"""
+Tests du format Prometheus : label worker et fusion des instantanés de plusieurs workers.
+"""
+import os
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def _registry():
+    registry = Registry()
+    requests = registry.register(Counter("t_requests_total", "Requêtes", ["route"]))
+    latency = registry.register(Histogram("t_seconds", "Latence", buckets=(0.1, 1.0)))
+    registry.register(Gauge("t_listeners", "Clients", function=lambda: 3))
+    return registry, requests, latency
+
+
+def test_samples_carry_the_worker_label():
+    registry, requests, latency = _registry()
+    requests.inc(route="/generate")
+    latency.observe(0.5)
+    text = registry.render()
+    worker = f'worker="{os.getpid()}"'
+    assert f't_requests_total{{route="/generate",{worker}}} 1' in text
+    assert f't_seconds_bucket{{{worker},le="0.1"}} 0' in text
+    assert f't_seconds_bucket{{{worker},le="1"}} 1' in text
+    assert f't_seconds_count{{{worker}}} 1' in text
+    assert f't_listeners{{{worker}}} 3' in text
+
+
+def test_render_merges_worker_snapshots_under_one_header():
+    registry, requests, _ = _registry()
+    requests.inc(route="/generate")
+    other = {"t_requests_total": ['t_requests_total{route="/generate",worker="1"} 5']}
+    text = registry.render([registry.snapshot(), other])
+    lines = text.splitlines()
+    assert lines.count("# TYPE t_requests_total counter") == 1
+    start = lines.index("# TYPE t_requests_total counter")
+    family = lines[start + 1:start + 3]
+    assert 't_requests_total{route="/generate",worker="1"} 5' in family
+    assert any(f'worker="{os.getpid()}"' in line for line in family)
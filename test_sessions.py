@@ -0,0 +1,179 @@
+"""
+Tests des sessions d'édition : JSON Patch (RFC 6902), expiration et rendu incrémental.
+"""
+import hashlib
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+from docx import Document
+from PIL import Image
+
+from remplace_rapport import collect_headings_in_order, find_placeholders_in_order, process_document
+from sessions import LAST_USED_RESOLUTION_SECONDS, EditSession, SessionStore, apply_json_patch
+from test_stream_rewrite import _summary
+
+TEMPLATE = Path(__file__).parent / "test.docx"
+
+
+def _state():
+    return {
+        "mapping": {"{nom}": "Dupont", "a/b": "x"},
+        "decisions": ["un", "deux"],
+        "heading_content": {"Titre": [{"type": "text", "content": "bloc"}]},
+    }
+
+
+def test_add_replace_remove_on_objects():
+    state = apply_json_patch(_state(), [
+        {"op": "add", "path": "/mapping/{date}", "value": "2024"},
+        {"op": "replace", "path": "/mapping/{nom}", "value": "Martin"},
+        {"op": "remove", "path": "/heading_content/Titre"},
+    ])
+    assert state["mapping"] == {"{nom}": "Martin", "a/b": "x", "{date}": "2024"}
+    assert state["heading_content"] == {}
+
+
+def test_list_operations_and_end_marker():
+    state = apply_json_patch(_state(), [
+        {"op": "add", "path": "/decisions/-", "value": "trois"},
+        {"op": "add", "path": "/decisions/0", "value": "zéro"},
+        {"op": "replace", "path": "/decisions/1", "value": "UN"},
+        {"op": "remove", "path": "/decisions/2"},
+        {"op": "add", "path": "/heading_content/Titre/-", "value": {"type": "image", "src": "/uploads/a.jpg"}},
+    ])
+    assert state["decisions"] == ["zéro", "UN", "trois"]
+    assert state["heading_content"]["Titre"][-1]["src"] == "/uploads/a.jpg"
+
+
+def test_escaped_pointer_tokens():
+    state = apply_json_patch(_state(), [
+        {"op": "replace", "path": "/mapping/a~1b", "value": "y"},
+        {"op": "add", "path": "/mapping/~0tilde", "value": "z"},
+    ])
+    assert state["mapping"]["a/b"] == "y"
+    assert state["mapping"]["~tilde"] == "z"
+
+
+@pytest.mark.parametrize("operation", [
+    {"op": "replace", "path": "/decisions/2", "value": "x"},
+    {"op": "remove", "path": "/decisions/-"},
+    {"op": "add", "path": "/decisions/3", "value": "x"},
+    {"op": "add", "path": "/decisions/-1", "value": "x"},
+    {"op": "replace", "path": "/mapping/{inconnu}", "value": "x"},
+    {"op": "remove", "path": "/inconnu/x"},
+    {"op": "replace", "path": "", "value": {}},
+    {"op": "replace", "path": "mapping", "value": {}},
+    {"op": "add", "path": "/mapping/{x}"},
+    {"op": "move", "path": "/mapping/{nom}"},
+])
+def test_invalid_operations_raise(operation):
+    with pytest.raises(ValueError):
+        apply_json_patch(_state(), [operation])
+
+
+def test_patch_never_mutates_the_input():
+    state = _state()
+    value = {"type": "text", "content": "nouveau"}
+    result = apply_json_patch(state, [
+        {"op": "add", "path": "/heading_content/Titre/-", "value": value},
+        {"op": "replace", "path": "/mapping/{nom}", "value": "Martin"},
+    ])
+    assert state == _state()
+    # La valeur insérée est copiée : la modifier ensuite ne touche pas l'état
+    value["content"] = "modifié"
+    assert result["heading_content"]["Titre"][-1]["content"] == "nouveau"
+    # Une opération invalide en fin de liste n'applique pas les précédentes à l'entrée
+    with pytest.raises(ValueError):
+        apply_json_patch(state, [{"op": "remove", "path": "/decisions/0"},
+                                 {"op": "remove", "path": "/inconnu"}])
+    assert state == _state()
+
+
+def test_expired_session_is_not_returned():
+    states = {}
+    store = SessionStore(ttl_seconds=60, states=states)
+    session = store.create(_state())
+    states[session.id] = {"state": session.state, "last_used": time.time() - 120}
+
+    assert store.get(session.id) is None
+    assert session.id not in store.session_ids()
+
+
+def test_get_refreshes_the_stored_last_used():
+    states = {}
+    store = SessionStore(ttl_seconds=3600, states=states)
+    session = store.create(_state())
+    old = time.time() - 2 * LAST_USED_RESOLUTION_SECONDS
+    states[session.id] = {"state": session.state, "last_used": old}
+
+    assert store.get(session.id) is not None
+    assert states[session.id]["last_used"] > old
+
+
+def _media(path):
+    with zipfile.ZipFile(path) as archive:
+        return sorted(hashlib.sha1(archive.read(name)).hexdigest() for name in archive.namelist()
+                      if name.startswith("word/media/"))
+
+
+def _values():
+    doc = Document(str(TEMPLATE))
+    mapping = {p: f"valeur {i}" for i, p in enumerate(find_placeholders_in_order(doc))}
+    headings = [p.text.strip() for p in collect_headings_in_order(doc)]
+    return mapping, ["__KEEP_TITLE_ONLY__"] * len(headings), headings
+
+
+def _render(session, tmp_path, mapping, decisions, heading_content, markers=None):
+    output = tmp_path / "session.docx"
+    stages = session.render(TEMPLATE, output, dict(mapping), list(decisions), heading_content, markers or {},
+                            3.0, {})
+    expected = tmp_path / "complet.docx"
+    process_document(TEMPLATE, expected, mapping_override=dict(mapping), decisions_override=list(decisions),
+                     interactive=False, heading_content=heading_content, images_at_markers=markers or {},
+                     streaming=False)
+    assert _summary(output) == _summary(expected)
+    # Images retirées depuis un rendu précédent : plus dans le paquet
+    assert _media(output) == _media(expected)
+    return stages
+
+
+def test_render_replays_only_the_touched_sections(tmp_path):
+    mapping, decisions, headings = _values()
+    session = EditSession("s", {})
+    first = _render(session, tmp_path, mapping, decisions, {})
+    assert first["mapping"] == first["content"] > 1
+
+    assert _render(session, tmp_path, mapping, decisions, {}) == {}
+    # Placeholder présent dans une seule section
+    mapping["{commentaire}"] = "nouveau commentaire"
+    assert _render(session, tmp_path, mapping, decisions, {}) == {"mapping": 1, "decisions": 1, "content": 1}
+    # Placeholder des en-têtes seulement
+    mapping["{daterap}"] = "01/01/2030"
+    assert _render(session, tmp_path, mapping, decisions, {})["headers"] == 1
+    decisions[headings.index("Contacts")] = "Aucun contact."
+    assert _render(session, tmp_path, mapping, decisions, {}) == {"decisions": 1, "content": 1}
+    content = {"Web": [{"type": "text", "content": "Historique vide."}]}
+    assert _render(session, tmp_path, mapping, decisions, content) == {"content": 1}
+
+
+def test_incremental_render_matches_a_full_generation(tmp_path):
+    image = tmp_path / "photo.png"
+    Image.new("RGB", (60, 40), (0, 90, 200)).save(image)
+    mapping, decisions, headings = _values()
+    session = EditSession("s", {})
+    content = {}
+    edits = [
+        lambda: mapping.update({"{nom}": ""}),                       # paragraphe supprimé
+        lambda: decisions.__setitem__(headings.index("Carte SIM n°2"), ""),  # titre et tableaux supprimés
+        lambda: content.update({"Synthèse": [{"type": "image", "src": str(image), "width": 1.0}]}),
+        lambda: content.update({"Contacts": [{"type": "text", "content": "bloc"}]}),
+        lambda: content.pop("Synthèse"),                             # image retirée du paquet
+        lambda: decisions.__setitem__(headings.index("Carte SIM n°2"), "Phrase"),
+        lambda: mapping.update({"{nom}": "Dupont"}),
+    ]
+    _render(session, tmp_path, mapping, decisions, content)
+    for edit in edits:
+        edit()
+        _render(session, tmp_path, mapping, decisions, {k: list(v) for k, v in content.items()})
@@ -0,0 +1,67 @@
+"""
+Tests du verrou inter-processus de SqliteBackend (fcntl.flock).
+"""
+import asyncio
+
+import pytest
+
+from shared_state import SqliteBackend, fcntl
+
+pytestmark = pytest.mark.skipif(fcntl is None, reason="flock indisponible (Windows)")
+
+
+def _held_elsewhere(path) -> bool:
+    # Autre description de fichier : se comporte comme un autre worker
+    with open(path, "a+b") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+
+def test_lock_is_released_after_use(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "etat.sqlite"))
+    lock_path = tmp_path / "etat.sqlite.documents.lock"
+
+    async def scenario():
+        async with backend.lock("documents"):
+            assert _held_elsewhere(lock_path)
+        assert not _held_elsewhere(lock_path)
+    asyncio.run(scenario())
+    backend.close()
+
+
+def test_cancelled_waiter_does_not_keep_the_lock(tmp_path):
+    backend = SqliteBackend(str(tmp_path / "etat.sqlite"))
+    lock_path = tmp_path / "etat.sqlite.documents.lock"
+
+    async def scenario():
+        other_worker = open(lock_path, "a+b")
+        fcntl.flock(other_worker.fileno(), fcntl.LOCK_EX)
+
+        async def wait_for_lock():
+            async with backend.lock("documents"):
+                pytest.fail("le verrou ne devait pas être obtenu")
+
+        waiter = asyncio.create_task(wait_for_lock())
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        # L'autre worker relâche : le flock obtenu ensuite par le thread abandonné est rendu
+        fcntl.flock(other_worker.fileno(), fcntl.LOCK_UN)
+        other_worker.close()
+        await asyncio.sleep(0.3)
+        assert not _held_elsewhere(lock_path)
+
+        async def use_lock():
+            async with backend.lock("documents"):
+                assert _held_elsewhere(lock_path)
+
+        await asyncio.wait_for(use_lock(), 5)
+        assert not _held_elsewhere(lock_path)
+    asyncio.run(scenario())
+    backend.close()
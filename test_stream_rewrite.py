@@ -0,0 +1,98 @@
+"""
+Le mode flux (stream_rewrite) doit produire le même document que le modèle objet
+python-docx : paragraphes, tableaux, en-têtes et images, sur les trames fournies.
+"""
+import hashlib
+import random
+import zipfile
+from pathlib import Path
+
+import pytest
+from docx import Document
+from PIL import Image
+
+from remplace_rapport import (
+    collect_headings_in_order,
+    find_image_markers_in_order,
+    find_placeholders_in_order,
+    process_document,
+)
+
+TEMPLATES = ["test.docx", "test2.docx", "test3.docx"]
+ROOT = Path(__file__).parent
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+R_EMBED = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed"
+WP_EXTENT = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}extent"
+
+
+def _rows(table):
+    return [[cell.text for cell in row.cells] for row in table.rows]
+
+
+def _drawings(part, archive: zipfile.ZipFile):
+    """(empreinte du média, largeur, hauteur) de chaque image, dans l'ordre du document."""
+    drawings = []
+    for extent in part.element.iter(WP_EXTENT):
+        drawing = extent.getparent()
+        blip = next(drawing.iter(f"{A_NS}blip"))
+        target = part.rels[blip.get(R_EMBED)].target_ref
+        data = archive.read(f"word/{target}")
+        drawings.append((hashlib.sha1(data).hexdigest(), extent.get("cx"), extent.get("cy")))
+    return drawings
+
+
+def _summary(path: Path):
+    doc = Document(str(path))
+    with zipfile.ZipFile(path) as archive:
+        return {
+            "paragraphs": [(p.style.name, p.text) for p in doc.paragraphs],
+            "tables": [_rows(t) for t in doc.tables],
+            "headers": [([p.text for p in s.header.paragraphs], [_rows(t) for t in s.header.tables])
+                        for s in doc.sections],
+            "drawings": _drawings(doc.part, archive),
+        }
+
+
+def _scenarios(template: Path, images):
+    doc = Document(str(template))
+    placeholders = find_placeholders_in_order(doc)
+    headings = [p.text.strip() for p in collect_headings_in_order(doc)]
+    markers = find_image_markers_in_order(doc)
+    # Tout rempli, phrases par défaut et une image par marqueur
+    yield ({p: f"valeur {i}" for i, p in enumerate(placeholders)}, None, {},
+           {m: images[i % 2] for i, m in enumerate(markers)})
+    # Tous les titres conservés, avec une phrase ou seuls
+    yield ({p: f"valeur {i}" for i, p in enumerate(placeholders)},
+           [f"Phrase {i}" if i % 2 else "__KEEP_TITLE_ONLY__" for i in range(len(headings))], {},
+           {m: images[1] for m in markers})
+    # Valeurs vides (tableaux SIM retirés), décisions variées, blocs de contenu sous les titres
+    r = random.Random(template.name)
+    yield ({p: r.choice(["", "texte"]) for p in placeholders},
+           [r.choice(["", "__KEEP_TITLE_ONLY__", "Phrase ajoutée"]) for _ in headings],
+           {h: [{"type": "text", "content": f"bloc {h}"}, {"type": "image", "src": images[1], "width": 2}]
+            for h in headings if r.random() < 0.5},
+           {m: images[0] for m in markers[:1]})
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = [tmp_path / "rouge.jpg", tmp_path / "vert.png"]
+    Image.new("RGB", (400, 300), (200, 10, 10)).save(paths[0])
+    Image.new("RGB", (300, 500), (10, 200, 10)).save(paths[1])
+    return [str(p) for p in paths]
+
+
+@pytest.mark.parametrize("template_name", TEMPLATES)
+def test_streaming_matches_object_model(template_name, images, tmp_path):
+    template = ROOT / template_name
+    for index, (mapping, decisions, heading_content, markers) in enumerate(_scenarios(template, images)):
+        outputs = []
+        for streaming in (False, True):
+            output = tmp_path / f"sortie_{index}_{streaming}.docx"
+            process_document(template, output, mapping_override=dict(mapping), decisions_override=decisions,
+                             interactive=False, heading_content=heading_content, images_at_markers=markers,
+                             streaming=streaming)
+            outputs.append(_summary(output))
+        full, streamed = outputs
+        for aspect in ("paragraphs", "tables", "headers", "drawings"):
+            assert streamed[aspect] == full[aspect], f"{template_name}, scénario {index}: {aspect}"
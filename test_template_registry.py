@@ -0,0 +1,82 @@
+"""
+Tests du registre des trames : fichiers retenus comme trames, détection des
+ajouts/modifications/suppressions et surveillance par sondage (sans watchfiles).
+"""
+import asyncio
+
+import template_registry
+from template_registry import TemplateRegistry, is_template_file
+
+
+def test_is_template_file_filters_lock_hidden_and_output_files():
+    assert is_template_file("test.docx")
+    assert is_template_file("Rapport.DOCX")
+    # Fichier verrou de Word, fichiers cachés, documents générés, autres extensions
+    assert not is_template_file("~$test.docx")
+    assert not is_template_file(".test.docx")
+    assert not is_template_file("test_sortie.docx")
+    assert not is_template_file("test_sortie.DOCX")
+    assert not is_template_file("test.doc")
+    assert not is_template_file("test.docx.tmp")
+    # Le suffixe ne compte qu'en fin de nom
+    assert is_template_file("test_sortie_v2.docx")
+
+
+def test_scan_reports_changes_and_ignores_non_templates(tmp_path):
+    for name in ("a.docx", "b.docx", "~$a.docx", ".cache.docx", "a_sortie.docx", "notes.txt"):
+        (tmp_path / name).write_bytes(b"v1")
+    (tmp_path / "dossier.docx").mkdir()
+    analyzed = []
+    registry = TemplateRegistry(tmp_path, analyzer=lambda path: analyzed.append(path) or {"path": path},
+                                default="b", output_dir=tmp_path / "sorties")
+
+    assert registry.scan() == ["a", "b"]
+    assert registry.names() == ["a", "b"]
+    assert registry.first().name == "b"
+    assert registry.get("a").output_path == tmp_path / "sorties" / "a_sortie.docx"
+    # Rien n'a changé : rien à signaler
+    assert registry.scan() == []
+
+    # Analyse gardée jusqu'à modification du fichier
+    entry = registry.get("a")
+    assert registry.analysis(entry) is registry.analysis(entry)
+    (tmp_path / "a.docx").write_bytes(b"version 2")
+    (tmp_path / "b.docx").unlink()
+    (tmp_path / "c.docx").write_bytes(b"v1")
+    assert sorted(registry.scan()) == ["a", "b", "c"]
+    assert registry.names() == ["a", "c"]
+    registry.analysis(registry.get("a"))
+    assert len(analyzed) == 2
+    # Trame par défaut disparue : première par ordre alphabétique
+    assert registry.first().name == "a"
+
+
+def test_watch_polls_without_watchfiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(template_registry, "awatch", None)
+    (tmp_path / "a.docx").write_bytes(b"v1")
+    registry = TemplateRegistry(tmp_path, analyzer=dict)
+    registry.scan()
+
+    async def scenario():
+        notified = asyncio.Queue()
+
+        async def on_change(names):
+            await notified.put(sorted(names))
+
+        watcher = asyncio.create_task(registry.watch(on_change, poll_seconds=0.02))
+        try:
+            (tmp_path / "b.docx").write_bytes(b"v1")
+            assert await asyncio.wait_for(notified.get(), 5) == ["b"]
+            # Fichier verrou de Word et document généré : aucune notification
+            (tmp_path / "~$b.docx").write_bytes(b"verrou")
+            (tmp_path / "b_sortie.docx").write_bytes(b"sortie")
+            (tmp_path / "a.docx").write_bytes(b"version 2")
+            assert await asyncio.wait_for(notified.get(), 5) == ["a"]
+            (tmp_path / "b.docx").unlink()
+            assert await asyncio.wait_for(notified.get(), 5) == ["b"]
+            await asyncio.sleep(0.1)
+            assert notified.empty()
+        finally:
+            watcher.cancel()
+        assert registry.names() == ["a"]
+    asyncio.run(scenario())
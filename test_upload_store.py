@@ -0,0 +1,119 @@
+"""
+Tests du nettoyage de uploads/ : délai d'expiration, quota LRU, références.
+"""
+import json
+import os
+import time
+
+from upload_store import ORPHAN_META_GRACE_SECONDS, REFERENCES_FILENAME, UploadStore
+
+DAY = 24 * 3600
+
+
+def _file(store, name, size=100, age=0.0):
+    path = store.upload_dir / name
+    path.write_bytes(b"x" * size)
+    (store.meta_dir / f"{path.stem}.json").write_text(json.dumps({"filename": name}), encoding="utf-8")
+    when = time.time() - age
+    os.utime(path, (when, when))
+    return path
+
+
+def test_ttl_removes_only_unreferenced_expired_files(tmp_path):
+    store = UploadStore(tmp_path)
+    old = _file(store, "a" * 32 + ".jpg", age=10 * DAY)
+    pinned = _file(store, "b" * 32 + ".jpg", age=10 * DAY)
+    fresh = _file(store, "c" * 32 + ".jpg", age=60)
+    store.set_references("report:test", [str(pinned)])
+
+    stats = store.sweep(ttl_seconds=7 * DAY)
+
+    assert stats["removed"] == 1
+    assert not old.exists() and not (store.meta_dir / f"{old.stem}.json").exists()
+    assert pinned.exists() and fresh.exists()
+
+
+def test_quota_evicts_least_recently_used_unreferenced_files(tmp_path):
+    store = UploadStore(tmp_path)
+    oldest = _file(store, "a" * 32 + ".jpg", age=5 * DAY)
+    older = _file(store, "b" * 32 + ".jpg", age=4 * DAY)
+    pinned = _file(store, "c" * 32 + ".jpg", age=9 * DAY)
+    recent = _file(store, "d" * 32 + ".jpg", age=3600)
+    store.set_references("session:s1", [pinned.name])
+
+    stats = store.sweep(ttl_seconds=0, quota_bytes=250, quota_min_age_seconds=DAY)
+
+    # 400 octets pour 250 : les deux plus anciennes non référencées sont supprimées
+    assert not oldest.exists() and not older.exists()
+    # Référencée ou utilisée depuis moins d'un jour : jamais supprimée, même au-delà du quota
+    assert pinned.exists() and recent.exists()
+    assert stats == {"removed": 2, "freed_bytes": 200, "total_bytes": 200}
+
+
+def test_quota_never_removes_files_younger_than_the_ttl(tmp_path):
+    store = UploadStore(tmp_path)
+    older = _file(store, "a" * 32 + ".jpg", age=3 * DAY)
+    newer = _file(store, "b" * 32 + ".jpg", age=2 * DAY)
+
+    stats = store.sweep(ttl_seconds=7 * DAY, quota_bytes=50, quota_min_age_seconds=DAY)
+
+    # Seule copie des images : le quota n'anticipe pas l'expiration
+    assert older.exists() and newer.exists()
+    assert stats == {"removed": 0, "freed_bytes": 0, "total_bytes": 200}
+
+
+def test_refcount_and_release(tmp_path):
+    store = UploadStore(tmp_path)
+    name = "a" * 32 + ".jpg"
+    store.set_references("report:test", [name])
+    store.set_references("session:s1", [name])
+    assert store.refcount(name) == 2
+    store.release("session:s1")
+    assert store.refcount(name) == 1
+    store.set_references("report:test", [])
+    assert store.refcount(name) == 0
+    assert store.owners() == []
+
+
+def test_references_survive_a_restart(tmp_path):
+    store = UploadStore(tmp_path)
+    pinned = _file(store, "a" * 32 + ".jpg", age=10 * DAY)
+    store.set_references("report:test", [pinned.name])
+
+    restarted = UploadStore(tmp_path)
+    assert restarted.refcount(pinned.name) == 1
+    restarted.sweep(ttl_seconds=DAY)
+    assert pinned.exists()
+
+
+def test_unreadable_references_suspend_the_sweep(tmp_path):
+    (tmp_path / REFERENCES_FILENAME).write_text("{pas du json", encoding="utf-8")
+    store = UploadStore(tmp_path)
+    old = _file(store, "a" * 32 + ".jpg", age=10 * DAY)
+
+    assert store.sweep(ttl_seconds=DAY)["removed"] == 0
+    assert old.exists()
+
+
+def test_touch_marks_a_file_as_just_used(tmp_path):
+    store = UploadStore(tmp_path)
+    path = _file(store, "a" * 32 + ".jpg", age=10 * DAY)
+    store.touch(path.name, resolution=0)
+    store.sweep(ttl_seconds=DAY)
+    assert path.exists()
+
+
+def test_orphan_sidecars_are_removed_after_a_grace_period(tmp_path):
+    store = UploadStore(tmp_path)
+    orphan = store.meta_dir / ("a" * 32 + ".json")
+    in_progress = store.meta_dir / ("b" * 32 + ".json")
+    for meta in (orphan, in_progress):
+        meta.write_text("{}", encoding="utf-8")
+    old = time.time() - 2 * ORPHAN_META_GRACE_SECONDS
+    os.utime(orphan, (old, old))
+
+    store.sweep(ttl_seconds=DAY)
+
+    assert not orphan.exists()
+    # Fiche récente : son fichier peut être en cours d'écriture par store()
+    assert in_progress.exists()
@@ -0,0 +1,253 @@
+"""
+Stockage des images envoyées via /upload, adressé par contenu.
+
+Chaque fichier est rangé sous l'empreinte SHA-256 des octets reçus
+("uploads/<empreinte>.jpg"), avec une fiche JSON dans "uploads/.meta/"
+(nom d'origine, type MIME, dimensions, orientation EXIF). Deux utilisateurs qui
+envoient chacun un "IMG_0935.PNG" différent ne s'écrasent plus, et un contenu
+déjà reçu (sous n'importe quel nom) est renvoyé immédiatement sans rien écrire.
+
+Les rapports générés déclarent les fichiers qu'ils utilisent (compteur de
+références par fichier) ; `sweep()` supprime les fichiers non référencés
+inutilisés depuis plus d'un délai donné, puis les moins récemment utilisés
+tant que le dossier dépasse son quota.
+
+Le dossier ne contient aucune variante régénérable : chaque fichier stocké est la
+seule copie de l'image envoyée (l'original n'est pas gardé). Le quota, désactivé par
+défaut, ne supprime donc jamais un fichier plus récent que le délai d'expiration :
+il ne vise que les fichiers non référencés, inutilisés depuis plus que ce délai et
+que `quota_min_age_seconds`. Avec un délai d'expiration actif, ces fichiers sont déjà
+supprimés par l'expiration et le quota ne fait que signaler son dépassement ; sans
+délai (ttl 0), il est le seul critère.
+
+Sans état partagé (SQLite, déjà persistant), les références sont enregistrées dans
+"uploads/.references.json" et relues à la création du store, donc avant tout
+nettoyage : un redémarrage ne libère pas les images des rapports existants.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, MutableMapping, Optional
+
+from PIL import Image
+
+META_DIRNAME = ".meta"
+# Longueur de l'empreinte dans les noms de fichiers (128 bits)
+HASH_NAME_LENGTH = 32
+REFERENCES_FILENAME = ".references.json"
+EXIF_ORIENTATION_TAG = 0x0112
+# Précision de la date de dernière utilisation : évite de retoucher le fichier à chaque génération
+TOUCH_RESOLUTION_SECONDS = 3600
+# Quota : un fichier utilisé (ou ré-envoyé) depuis moins longtemps n'est jamais supprimé
+QUOTA_MIN_AGE_SECONDS = 24 * 3600
+# Fiche sans fichier plus récente que ce délai : upload en cours d'écriture, pas une orpheline
+ORPHAN_META_GRACE_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def describe_image(data: bytes) -> Dict:
+    """Dimensions, type MIME et orientation EXIF (lecture de l'en-tête uniquement)."""
+    with Image.open(io.BytesIO(data)) as img:
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        return {
+            "width": img.width,
+            "height": img.height,
+            "mime": Image.MIME.get(img.format, "application/octet-stream"),
+            "orientation": int(orientation),
+        }
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+class UploadStore:
+    """Dossier d'upload adressé par contenu, avec une fiche de métadonnées par fichier."""
+
+    def __init__(self, upload_dir: Path, refs: Optional[MutableMapping] = None):
+        self.upload_dir = Path(upload_dir)
+        self.meta_dir = self.upload_dir / META_DIRNAME
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        # propriétaire ("report:test", "session:...") -> fichiers utilisés ;
+        # `refs` peut être partagé entre workers (voir shared_state), sinon fichier local
+        self._refs_path: Optional[Path] = None
+        self.references_restored = True
+        if refs is None:
+            self._refs_path = self.upload_dir / REFERENCES_FILENAME
+            refs = self._load_refs()
+        self._refs: MutableMapping = refs
+        self._lock = threading.Lock()
+
+    def _load_refs(self) -> Dict[str, list]:
+        try:
+            refs = json.loads(self._refs_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            refs = None
+        if not isinstance(refs, dict):
+            # Mieux vaut ne rien nettoyer que supprimer des images encore utilisées
+            logger.error("Références des uploads illisibles (%s) : nettoyage suspendu", self._refs_path)
+            self.references_restored = False
+            return {}
+        return refs
+
+    def _save_refs(self) -> None:
+        # Appelé sous self._lock
+        if self._refs_path is not None:
+            _write_atomic(self._refs_path,
+                          json.dumps(dict(self._refs), ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+    def _meta_path(self, digest: str) -> Path:
+        return self.meta_dir / f"{digest[:HASH_NAME_LENGTH]}.json"
+
+    def find(self, digest: str) -> Optional[Dict]:
+        """Fiche du fichier déjà stocké pour cette empreinte, ou None."""
+        meta_path = self._meta_path(digest)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not (self.upload_dir / meta["filename"]).exists():
+            return None
+        return meta
+
+    def store(self, digest: str, data: bytes, extension: str, original_name: str,
+              info: Optional[Dict] = None) -> Dict:
+        """Écrit `data` sous son empreinte et enregistre sa fiche ; retourne la fiche.
+
+        `digest` est l'empreinte des octets reçus : une image normalisée (HEIC converti,
+        photo redressée) reste retrouvée par l'empreinte de l'original.
+        `info` : dimensions/MIME/orientation déjà connus, sinon lus dans `data`.
+        """
+        filename = f"{digest[:HASH_NAME_LENGTH]}{extension.lower()}"
+        meta = {
+            "sha256": digest,
+            "filename": filename,
+            "original_name": original_name,
+            "size": len(data),
+            "created": time.time(),
+        }
+        meta.update(info if info is not None else describe_image(data))
+        _write_atomic(self.upload_dir / filename, data)
+        # La fiche en dernier : sa présence signifie que le fichier est complet
+        _write_atomic(self._meta_path(digest), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        return meta
+
+    def set_references(self, owner: str, filenames: Iterable[str]) -> None:
+        """Remplace les fichiers utilisés par `owner` et marque-les comme récemment utilisés."""
+        names = {Path(f).name for f in filenames}
+        with self._lock:
+            previous = self._refs.get(owner)
+            if names:
+                if previous != sorted(names):
+                    self._refs[owner] = sorted(names)
+                    self._save_refs()
+            elif previous is not None:
+                del self._refs[owner]
+                self._save_refs()
+        for name in names:
+            self.touch(name)
+
+    def touch(self, filename: str, resolution: float = TOUCH_RESOLUTION_SECONDS) -> None:
+        """Marque le fichier comme utilisé maintenant (à `resolution` secondes près)."""
+        path = self.upload_dir / Path(filename).name
+        now = time.time()
+        try:
+            if now - path.stat().st_mtime > resolution:
+                os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def release(self, owner: str) -> None:
+        with self._lock:
+            if self._refs.pop(owner, None) is not None:
+                self._save_refs()
+
+    def owners(self) -> List[str]:
+        with self._lock:
+            return list(self._refs)
+
+    def refcount(self, filename: str) -> int:
+        with self._lock:
+            return sum(1 for names in self._refs.values() if filename in names)
+
+    def _remove(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+        (self.meta_dir / f"{path.stem}.json").unlink(missing_ok=True)
+
+    def sweep(self, ttl_seconds: float, quota_bytes: Optional[int] = None,
+              quota_min_age_seconds: float = QUOTA_MIN_AGE_SECONDS) -> Dict[str, int]:
+        """Supprime les fichiers non référencés expirés, puis applique le quota (LRU).
+
+        La date de dernière utilisation est la date de modification du fichier
+        (mise à jour par `set_references` et `touch`). Un fichier référencé n'est jamais
+        supprimé ; le quota épargne aussi ceux utilisés depuis moins de `quota_min_age_seconds`
+        ou du délai d'expiration : il ne supprime pas avant lui la seule copie d'une image.
+        """
+        if not self.references_restored:
+            return {"removed": 0, "freed_bytes": 0, "total_bytes": 0}
+        with self._lock:
+            referenced = set().union(*self._refs.values())
+        if ttl_seconds > 0:
+            quota_min_age_seconds = max(quota_min_age_seconds, ttl_seconds)
+        now = time.time()
+        removed = 0
+        freed = 0
+        entries = []
+        stems = set()
+        total = 0
+        for path in self.upload_dir.iterdir():
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            st = path.stat()
+            if path.name not in referenced and ttl_seconds > 0 and now - st.st_mtime > ttl_seconds:
+                self._remove(path)
+                removed += 1
+                freed += st.st_size
+                continue
+            total += st.st_size
+            stems.add(path.stem)
+            if path.name not in referenced and now - st.st_mtime >= quota_min_age_seconds:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        if quota_bytes is not None and total > quota_bytes:
+            for _, size, path in sorted(entries, key=lambda e: e[0]):
+                if total <= quota_bytes:
+                    break
+                self._remove(path)
+                stems.discard(path.stem)
+                removed += 1
+                freed += size
+                total -= size
+            if total > quota_bytes:
+                logger.warning("Quota des uploads dépassé (%d octets pour %d) : fichiers référencés "
+                               "ou trop récents pour être supprimés", total, quota_bytes)
+
+        # Fiches orphelines (fichier supprimé à la main). store() écrit le fichier puis sa
+        # fiche : une fiche récente ou dont le fichier est apparu depuis le parcours est gardée
+        for meta_path in self.meta_dir.glob("*.json"):
+            if meta_path.stem in stems:
+                continue
+            try:
+                if now - meta_path.stat().st_mtime < ORPHAN_META_GRACE_SECONDS:
+                    continue
+            except OSError:
+                continue
+            if any(self.upload_dir.glob(f"{meta_path.stem}.*")):
+                continue
+            meta_path.unlink(missing_ok=True)
+
+        return {"removed": removed, "freed_bytes": freed, "total_bytes": total}
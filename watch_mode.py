@@ -0,0 +1,198 @@
+"""
+Mode surveillance de remplace_rapport (--watch) : le rapport est régénéré à chaque
+modification, sans relancer le processus ni poser de questions.
+
+Le fichier de valeurs (JSON, ou YAML) reprend les champs de /generate : mapping,
+decisions, heading_content, images_at_markers, image_width_inches,
+images_at_markers_sizes. Les chemins d'images relatifs partent du dossier du
+fichier de valeurs.
+
+PyYAML est une dépendance optionnelle, absente de requirements.txt : sans lui
+(`pip install PyYAML`), seuls les fichiers de valeurs JSON sont acceptés.
+
+Seul le travail nécessaire est refait :
+- la trame n'est analysée (placeholders, titres) qu'une fois par version du fichier ;
+- une EditSession garde le résultat de chaque étape par section (un titre et ses
+  blocs) : seules les sections touchées par la modification sont recalculées ;
+- les images préparées sont gardées tant que le fichier ne change pas.
+
+Les fichiers surveillés (valeurs, trame, images référencées) sont sondés toutes
+les `poll_seconds` : quelques stat() par tour, sans dépendance supplémentaire.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from docx import Document
+
+from html_preview import render_docx_html
+from remplace_rapport import (
+    collect_headings_in_order,
+    find_placeholders_in_order,
+    referenced_images,
+    resolve_heading_decisions,
+    start_image_preparation,
+)
+from sessions import EditSession
+from stage_timer import StageTimer
+
+try:
+    import yaml
+except ImportError:  # fichiers de valeurs JSON seulement
+    yaml = None
+
+POLL_SECONDS = 0.3
+YAML_EXTENSIONS = (".yaml", ".yml")
+
+logger = logging.getLogger(__name__)
+
+Stamp = Optional[Tuple[int, int]]
+
+
+def _stamp(path) -> Stamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_values(path: Path) -> Dict[str, Any]:
+    """Contenu du fichier de valeurs ; ValueError s'il est illisible."""
+    text = Path(path).read_text(encoding="utf-8")
+    if Path(path).suffix.lower() in YAML_EXTENSIONS:
+        if yaml is None:
+            raise ValueError("PyYAML n'est pas installé (pip install PyYAML) : utiliser un fichier de valeurs JSON")
+        try:
+            values = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f"YAML invalide: {e}") from e
+    else:
+        values = json.loads(text)
+    if values is None:
+        values = {}
+    if not isinstance(values, dict):
+        raise ValueError("Le fichier de valeurs doit contenir un objet (mapping, decisions...)")
+    return values
+
+
+def _resolve_image(src: str, base_dir: Path) -> str:
+    path = Path(src).expanduser()
+    return str(path if path.is_absolute() else base_dir / path)
+
+
+class ReportWatcher:
+    """Trame gardée analysée et instantané de génération, pour un fichier de valeurs."""
+
+    def __init__(self, template: Path, values_path: Path, output: Path, preview: Optional[Path] = None):
+        self.template = Path(template)
+        self.values_path = Path(values_path)
+        self.output = Path(output)
+        self.preview = Path(preview) if preview else None
+        self._session = EditSession("watch", {})
+        self._analysis_stamp: Stamp = None
+        self._placeholders: List[str] = []
+        self._headings: List[str] = []
+        self._images: List[str] = []
+        self._prepared: Dict[str, Tuple[Stamp, bytes]] = {}
+        self._stamps: Optional[List[Stamp]] = None
+
+    def _watched(self) -> List[str]:
+        return [str(self.values_path), str(self.template), *self._images]
+
+    def changed(self) -> bool:
+        """Vrai si un fichier surveillé a changé depuis la dernière génération."""
+        return [_stamp(path) for path in self._watched()] != self._stamps
+
+    def _analyze(self, stamp: Stamp) -> None:
+        if stamp != self._analysis_stamp:
+            doc = Document(str(self.template))
+            self._placeholders = find_placeholders_in_order(doc)
+            self._headings = [p.text for p in collect_headings_in_order(doc)]
+            self._analysis_stamp = stamp
+
+    def _image_cache(self, stamps: Dict[str, Stamp]) -> Dict[str, Any]:
+        """Images inchangées reprises telles quelles, les autres préparées en parallèle."""
+        cache: Dict[str, Any] = {}
+        stale = []
+        for key, stamp in stamps.items():
+            prepared = self._prepared.get(key)
+            if prepared is not None and prepared[0] == stamp:
+                cache[key] = prepared[1]
+            else:
+                stale.append(key)
+        cache.update(start_image_preparation(stale))
+        return cache
+
+    def render(self) -> Tuple[Dict[str, int], StageTimer]:
+        """Relit les valeurs et régénère le document (et l'aperçu) ; retourne les sections recalculées par étape."""
+        # Dates relevées avant lecture : une modification pendant la génération en relance une
+        values_stamp, template_stamp = _stamp(self.values_path), _stamp(self.template)
+        self._stamps = [values_stamp, template_stamp, *(_stamp(path) for path in self._images)]
+        values = load_values(self.values_path)
+        timer = StageTimer()
+        with timer.stage("template_analysis"):
+            self._analyze(template_stamp)
+
+        mapping = dict(values.get("mapping") or {})
+        for name in self._placeholders:
+            mapping.setdefault(name, "")
+        decisions = resolve_heading_decisions(self._headings, mapping, values.get("decisions"))
+        base_dir = self.values_path.parent
+        heading_content = {
+            heading: [dict(block, src=_resolve_image(block["src"], base_dir))
+                      if block.get("type") == "image" and block.get("src") else dict(block)
+                      for block in blocks]
+            for heading, blocks in (values.get("heading_content") or {}).items()
+        }
+        markers = {marker: _resolve_image(src, base_dir)
+                   for marker, src in (values.get("images_at_markers") or {}).items() if src}
+
+        self._images = referenced_images(heading_content, markers)
+        image_stamps = {str(Path(path).resolve()): _stamp(path) for path in self._images}
+        self._stamps = [values_stamp, template_stamp, *(_stamp(path) for path in self._images)]
+        image_cache = self._image_cache({key: stamp for key, stamp in image_stamps.items() if stamp is not None})
+
+        stages = self._session.render(
+            self.template, self.output, mapping, decisions, heading_content, markers,
+            float(values.get("image_width_inches") or 3.0), values.get("images_at_markers_sizes") or {},
+            timer=timer, image_cache=image_cache,
+        )
+        # Seules les images de cette version des valeurs sont gardées
+        self._prepared = {key: (image_stamps[key], data) for key, data in image_cache.items()
+                          if isinstance(data, bytes)}
+        if self.preview is not None:
+            with timer.stage("preview"):
+                self.preview.write_text(render_docx_html(self.output), encoding="utf-8")
+        return stages, timer
+
+    def regenerate(self) -> bool:
+        """render() avec journalisation ; une erreur est signalée sans arrêter la surveillance."""
+        try:
+            stages, timer = self.render()
+        except (OSError, ValueError) as e:
+            logger.error("Génération impossible: %s", e)
+            return False
+        except Exception:
+            logger.exception("Génération impossible")
+            return False
+        logger.info("Document régénéré en %.2f s (sections recalculées: %s) : %s", timer.report()["total_seconds"],
+                    ", ".join(f"{stage} {count}" for stage, count in stages.items()) or "aucune", self.output)
+        return True
+
+
+def watch(template: Path, values_path: Path, output: Path, preview: Optional[Path] = None,
+          poll_seconds: float = POLL_SECONDS) -> None:
+    """Régénère à chaque modification des valeurs, de la trame ou d'une image, jusqu'à Ctrl+C."""
+    watcher = ReportWatcher(template, values_path, output, preview)
+    logger.info("Surveillance de %s et %s (Ctrl+C pour arrêter)", values_path, template)
+    try:
+        while True:
+            if watcher.changed():
+                watcher.regenerate()
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        logger.info("Surveillance arrêtée")